@@ -0,0 +1,132 @@
+from utils.timer import Timer
+from utils.waterfall_backends import backends, getBackend, numba, _trancheArrays, _poolCashFlowsLoop, \
+    _trancheWaterfallLoop, _IRRLoop
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from liabilities.waterfall_spec import WaterfallSpec
+from loan.hazard_curves import HazardCurves
+from simulations.simulate_waterfall import simulatePathMetrics
+from utils.random_streams import pathUniforms
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check that every compute backend of the waterfall kernels (utils.waterfall_backends) gives the
+same results as doWaterfall: the same paths are run through doWaterfall (via simulatePathMetrics) and through each
+backend, in Sequential and Pro Rata mode and with a waterfall spec that uses every kind of step (lockout, OC and IC
+triggered turbo, reserve target), and the largest differences are printed. The pool cash flows are also compared
+with prepayments (a CPR curve).
+The numba loops are also run as plain python when numba is not installed, so they are checked either way
+'''
+
+NSIM = 50  # number of paths to compare
+SEED = 2020  # master seed of the paths
+TOLERANCE = 1e-9  # largest difference allowed in DIRR and AL
+# principal locked out for 6 periods, senior turbo while its OC is below 1.3, everything turbo while the IC of
+# both tranches is below 3, and at most 1% of the face kept in the reserve account
+TRIGGERS = WaterfallSpec([{'pay': 'interest'}, {'pay': 'principal', 'from': 6},
+                          {'pay': 'turbo', 'tranches': [0], 'when': ('OC', 0, 1.3)},
+                          {'pay': 'turbo', 'when': ('IC', 1, 3.0)}, {'pay': 'reserve', 'target': 0.01}], 'Triggers')
+
+
+def main():
+    # load the loans from the csv in this project
+    pool1 = LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv'))
+    schedule = PoolSchedule(pool1)
+    default_times = schedule.defaultTimes(pathUniforms(SEED, 0, NSIM, len(schedule.lastActive)))
+    reference_backend = getBackend('python')
+    cash, principal, last_period = reference_backend.poolCashFlows(schedule, default_times)
+    collateral = schedule.poolBalance(default_times)
+
+    failures = []
+    for mode in ['Sequential', 'Pro Rata', 'Triggers']:
+        securities1 = StructuredSecurities(pool1.totalPrincipal())
+        securities1.addTranche(0.8, 0.05, 0)
+        securities1.addTranche(0.2, 0.08, 1)
+        if mode == 'Triggers':
+            securities1.spec = TRIGGERS
+        else:
+            securities1.mode = mode
+
+        # doWaterfall on the loan and tranche objects is the reference for everything
+        with Timer('doWaterfall ' + mode):
+            reference = simulatePathMetrics(pool1, securities1, NSIM, SEED)
+        reference_flows = reference_backend.trancheWaterfall(cash, principal, last_period, securities1, collateral)
+
+        print(f'{"backend":<16s}{"mode":<12s}{"DIRR/AL":<14s}{"flows":<14s}{"cash":<14s}{"IRR":<14s}')
+        available = [name for name in backends if name != 'numba' or numba is not None]
+        for name in available:
+            backend = getBackend(name)
+            with Timer(name + ' ' + mode):
+                path_metrics = backend.pathDIRR_AL(cash, principal, last_period, securities1, collateral)
+            flows = backend.trancheWaterfall(cash, principal, last_period, securities1, collateral)
+            pool_flows = backend.poolCashFlows(schedule, default_times)
+            failures += report(name, mode, path_metrics, reference, flows, reference_flows, pool_flows,
+                               (cash, principal, last_period), backend.IRR)
+        if numba is None:
+            # the numba loops without numba: the same code as plain python
+            flows = _trancheWaterfallLoop(cash, principal, last_period.astype(np.int64),
+                                          *_trancheArrays(securities1, collateral), collateral)
+            pool_flows = _poolCashFlowsLoop(schedule.payment, schedule.principal, schedule.recovery, schedule.balance,
+                                            schedule.lastActive, default_times.astype(np.int64),
+                                            np.full(default_times.shape, schedule.periods, dtype=np.int64))
+            path_metrics = metricsFromFlows(flows, securities1, _IRRLoop)
+            failures += report('numba (python)', mode, path_metrics, reference, flows, reference_flows, pool_flows,
+                               (cash, principal, last_period), _IRRLoop)
+
+    # pool cash flows with prepayments, on every backend and the numba loop as plain python
+    schedule = PoolSchedule(pool1, hazard=HazardCurves(cpr=HazardCurves.PSA(200)))
+    default_times, prepay_times = schedule.eventTimes(pathUniforms(SEED, 0, NSIM, schedule.randomsPerPath))
+    reference_pool_flows = reference_backend.poolCashFlows(schedule, default_times, prepay_times)
+    pool_flows = {name: getBackend(name).poolCashFlows(schedule, default_times, prepay_times)
+                  for name in backends if name != 'numba' or numba is not None}
+    pool_flows['numba (python)'] = _poolCashFlowsLoop(schedule.payment, schedule.principal, schedule.recovery,
+                                                      schedule.balance, schedule.lastActive,
+                                                      default_times.astype(np.int64), prepay_times.astype(np.int64))
+    for name, flows in pool_flows.items():
+        cash_diff = max(np.abs(np.asarray(a, dtype=float) - b).max() / max(np.abs(b).max(), 1)
+                        for a, b in zip(flows, reference_pool_flows))
+        print(f'{name:<16s}{"prepayment":<12s}{"":<28s}{cash_diff:<14.3e}')
+        failures += ['{} prepayment'.format(name)] if cash_diff > TOLERANCE else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('All backends match doWaterfall')
+
+
+# print the largest differences of one backend against the reference, returns the failures
+def report(name, mode, path_metrics, reference, flows, reference_flows, pool_flows, reference_pool_flows, IRR):
+    metrics_diff = np.abs(path_metrics - reference).max()
+    flows_diff = max(np.abs(a - b).max() for a, b in zip(flows, reference_flows))
+    # pool cash flows can be summed in a different order, so they are compared relative to their size
+    cash_diff = max(np.abs(np.asarray(a, dtype=float) - b).max() / max(np.abs(b).max(), 1)
+                    for a, b in zip(pool_flows, reference_pool_flows))
+    # IRR of a few level payment schedules against numpy_financial
+    test_flows = np.array([[-1000.0] + [90.0] * 12, [-1000.0] + [80.0] * 12, [-1000.0] + [0.0] * 11 + [1200.0]])
+    irr_diff = np.abs(IRR(test_flows) - getBackend('python').IRR(test_flows)).max()
+    print(f'{name:<16s}{mode:<12s}{metrics_diff:<14.3e}{flows_diff:<14.3e}{cash_diff:<14.3e}{irr_diff:<14.3e}')
+    return ['{} {}'.format(name, mode)] if max(metrics_diff, cash_diff, irr_diff) > TOLERANCE else []
+
+
+# [DIRR, AL] per tranche per path from tranche flows, the same as WaterfallBackend.pathDIRR_AL
+def metricsFromFlows(flows, structured_securities, IRR):
+    interest_paid, principal_paid, _ = flows
+    faces = np.array([tranche.face for tranche in structured_securities.trancheList])
+    rates = np.array([tranche.rate for tranche in structured_securities.trancheList])
+    paths, count, periods = principal_paid.shape
+    payments = np.concatenate([np.broadcast_to(-faces[None, :, None], (paths, count, 1)),
+                               interest_paid + principal_paid], axis=2)
+    path_metrics = np.empty((paths, count, 2))
+    path_metrics[:, :, 0] = rates - IRR(payments.reshape(-1, periods + 1)).reshape(paths, count) * 12
+    path_metrics[:, :, 1] = (principal_paid * np.arange(periods)).sum(axis=2) / faces
+    return path_metrics
+
+
+if __name__ == '__main__':
+    main()
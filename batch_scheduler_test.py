@@ -0,0 +1,118 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from liabilities.tranche_base import Tranche
+from liabilities.waterfall_spec import WaterfallSpec
+from simulations.batch_scheduler import runBatch
+from simulations.monte import runMonte
+from simulations.simulate_waterfall import simulateWaterfall
+import numpy as np
+import logging
+import json
+import os
+import tempfile
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check runBatch on a batch of three deals: one solving its rates like runMonte, one simulated once
+like simulateWaterfall and one with an OC test in its waterfall spec. The results are those of runMonte and
+simulateWaterfall with the same seeds, with doWaterfall in the workers and on the numpy backend. The cpu seconds of
+every deal are process time, so they are above 0 and the utilization is not above 1, and the summary file has them.
+A deal that is not right is a ValueError before any process starts, and no summary is written
+'''
+
+SEEDS = [2049, 2050, 2051]  # master seeds of the deals
+LOANS = [100, 60, 80]  # loans of the csv of every deal
+NSIM = [60, 40, 40]  # paths of every deal
+TOLERANCE = 0.005  # tolerance of the rates solved
+DIFFERENCE = 1e-9  # largest difference allowed in DIRR and AL
+PROCESSES = 2
+STEPS = [{'pay': 'interest'}, {'pay': 'principal'}, {'pay': 'turbo', 'tranches': [0], 'when': ('OC', 0, 1.3)}]
+
+
+def securities(loanpool, tranches=True, spec=False):
+    structured_securities = StructuredSecurities(loanpool.totalPrincipal())
+    if tranches:
+        structured_securities.addTranche(0.8, 0.05, 0)
+        structured_securities.addTranche(0.2, 0.08, 1)
+    if spec:
+        structured_securities.spec = WaterfallSpec(STEPS, 'OC turbo')
+    return structured_securities
+
+
+def deals(pools):
+    return [{'name': 'solved', 'loanpool': pools[0], 'structured_securities': securities(pools[0], False),
+             'NSIM': NSIM[0], 'seed': SEEDS[0], 'tolerance': TOLERANCE},
+            {'name': 'once', 'loanpool': pools[1], 'structured_securities': securities(pools[1]), 'NSIM': NSIM[1],
+             'seed': SEEDS[1]},
+            {'name': 'OC', 'loanpool': pools[2], 'structured_securities': securities(pools[2], spec=True),
+             'NSIM': NSIM[2], 'seed': SEEDS[2]}]
+
+
+# the largest difference of the numbers of two results, None if the ratings or layout differ
+def difference(result, reference):
+    numbers, reference_numbers = [[[value for value in row if not isinstance(value, str)] for row in res]
+                                  for res in (result, reference)]
+    ratings = [[value for value in row if isinstance(value, str)] for row in result]
+    if ratings != [[value for value in row if isinstance(value, str)] for row in reference]:
+        return None
+    return np.abs(np.array(numbers, dtype=float) - np.array(reference_numbers, dtype=float)).max()
+
+
+def main():
+    loans = list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))
+    pools = [LoanPool(loans[:count]) for count in LOANS]
+    references = [runMonte(pools[0], securities(pools[0], False), TOLERANCE, NSIM[0], seed=SEEDS[0]),
+                  simulateWaterfall(pools[1], securities(pools[1]), NSIM[1], SEEDS[1]),
+                  simulateWaterfall(pools[2], securities(pools[2], spec=True), NSIM[2], SEEDS[2])]
+    # simulateWaterfall gives the average DIRR and AL, runBatch adds the rating
+    for reference in references[1:]:
+        for row in reference:
+            row.append(Tranche.DIRR_Rating(row[0]))
+    failures = []
+
+    print(f'{"backend":<10s}{"deal":<10s}{"difference":<14s}{"cpu seconds":<14s}{"shards"}')
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in [None, 'numpy']:
+            filename = os.path.join(directory, 'batch.json')
+            summary = runBatch(deals(pools), PROCESSES, filename, backend)
+            with open(filename) as fp:
+                written = json.load(fp)
+            for deal, reference in zip(summary['deals'], references):
+                diff = difference(deal.get('result', []), reference)
+                print(f'{str(backend):<10s}{deal["name"]:<10s}{"-" if diff is None else f"{diff:.3e}":<14s}'
+                      f'{deal["cpuSeconds"]:<14.3f}{deal["shards"]}')
+                failures += ['{} {}'.format(backend, deal['name'])] if diff is None or diff > DIFFERENCE else []
+                failures += ['cpu seconds of {}'.format(deal['name'])] if not deal['cpuSeconds'] > 0 else []
+            print(f'{summary["seconds"]:.2f} seconds, utilization {summary["utilization"]:.2f}')
+            # process time can not run ahead of the wall clock of the processes (a little room for the clocks)
+            failures += ['utilization'] if not 0 < summary['utilization'] <= 1.05 else []
+            failures += ['summary file'] if written['utilization'] != summary['utilization'] or \
+                [deal['cpuSeconds'] for deal in written['deals']] != [deal['cpuSeconds'] for deal in summary['deals']] \
+                else []
+
+        bad = deals(pools)
+        shared = deals(pools)
+        shared[1]['structured_securities'] = shared[2]['structured_securities']
+        cases = {'shared StructuredSecurities': shared, 'no loan pool': [dict(bad[1], loanpool=None)],
+                 'NSIM 0': [dict(bad[1], NSIM=0)], 'NSIM 2.5': [dict(bad[1], NSIM=2.5)],
+                 'tolerance 0': [dict(bad[0], tolerance=0)]}
+        for name, batch in cases.items():
+            filename = os.path.join(directory, name + '.json')
+            try:
+                runBatch(batch, PROCESSES, filename)
+                message = 'no error'
+            except ValueError as error:
+                message = str(error)
+            print(f'{name:<28s}{message}')
+            failures += [name] if message == 'no error' or os.path.exists(filename) else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The batch gives the results of its deals run one by one')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from simulations.monte import runMonte, poolKey
+from simulations.checkpoint import MonteCheckpoint
+import logging
+import tempfile
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the checkpoint of runMonte: a run that is stopped after its first iteration and resumed
+from its checkpoint continues with the same seed and the next paths, so it ends with exactly the rates, DIRR and AL
+of the same run done in one go. A converged checkpoint warm starts a run with a tighter tolerance from its rates,
+and resuming with a different seed than the checkpoint was run with is reported. Resuming a checkpoint of another loan
+pool is a ValueError that leaves the checkpoint as it was, and a checkpoint that does not record its pool takes the
+pool of the run
+'''
+
+NSIM = 10  # paths per iteration
+SEED = 2028  # master seed of the runs
+LOANS = 40  # loans of the csv used, runMonte asks every loan every period
+TOLERANCE = 0.005
+
+
+class Interrupt(Exception):
+    pass
+
+
+def stopAfterFirst(iteration, rates, diff):
+    if iteration == 1:
+        raise Interrupt()
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        checkpoint = os.path.join(directory, 'monte.ckpt')
+        reference = runMonte(pool1, StructuredSecurities(pool1.totalPrincipal()), TOLERANCE, NSIM, seed=SEED)
+
+        try:
+            runMonte(pool1, StructuredSecurities(pool1.totalPrincipal()), TOLERANCE, NSIM, checkpoint, seed=SEED,
+                     callback=stopAfterFirst)
+        except Interrupt:
+            pass
+        stopped = MonteCheckpoint.load(checkpoint)
+        print(f'stopped after {stopped.iteration} iteration(s), {stopped.paths} paths')
+
+        # resuming with another seed keeps the seed of the checkpoint, and says so
+        warnings = []
+        handler = logging.Handler()
+        handler.emit = lambda record: warnings.append(record.getMessage())
+        logging.getLogger().addHandler(handler)
+        resumed = runMonte(pool1, StructuredSecurities(pool1.totalPrincipal()), TOLERANCE, NSIM, checkpoint,
+                           seed=SEED + 1)
+        logging.getLogger().removeHandler(handler)
+        print(f'resumed:   {resumed}')
+        print(f'reference: {reference}')
+        failures += ['resume'] if resumed != reference else []
+        failures += ['seed warning'] if not any('is ignored' in warning for warning in warnings) else []
+
+        # a converged checkpoint starts the next run from its rates
+        converged = MonteCheckpoint.load(checkpoint)
+        rates = []
+        runMonte(pool1, StructuredSecurities(pool1.totalPrincipal()), TOLERANCE / 2, NSIM, checkpoint,
+                 callback=lambda iteration, iteration_rates, diff: rates.append(list(iteration_rates)))
+        print(f'warm start from {converged.rates}: first rates {rates[0]}')
+        failures += ['warm start'] if rates[0] != converged.rates else []
+
+        # the iterations of another pool are not resumed, and the checkpoint keeps its pool
+        foreign = os.path.join(directory, 'foreign.ckpt')
+        MonteCheckpoint([0.05, 0.08], TOLERANCE, NSIM, SEED, pool='not-this-pool').save(foreign)
+        try:
+            runMonte(pool1, StructuredSecurities(pool1.totalPrincipal()), TOLERANCE, NSIM, foreign)
+            message = 'no error'
+        except ValueError as error:
+            message = str(error).replace(foreign, os.path.basename(foreign))
+        kept = MonteCheckpoint.load(foreign)
+        print(f'a checkpoint of another pool: {message}')
+        failures += ['another pool'] if message == 'no error' or kept.pool != 'not-this-pool' or kept.iteration else []
+
+        unknown = os.path.join(directory, 'unknown.ckpt')
+        MonteCheckpoint([0.05, 0.08], TOLERANCE, NSIM, SEED).save(unknown)
+        runMonte(pool1, StructuredSecurities(pool1.totalPrincipal()), TOLERANCE, NSIM, unknown)
+        adopted = MonteCheckpoint.load(unknown).pool == poolKey(pool1)
+        print(f'a checkpoint without its pool takes the pool of the run: {adopted}')
+        failures += ['no pool'] if not adopted else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The resumed run matches the run done in one go')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from simulations import chunked_simulation
+from simulations.chunked_simulation import simulateWaterfallChunked, chunkPlan
+from simulations.pool_paths import simulatePoolPaths
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check simulateWaterfallChunked against PoolPaths.averageDIRR_AL over all the paths of
+simulatePoolPaths with the same seed: with a budget large enough for the whole schedule (chunks of paths only) the
+result is the same to the last bit, and with a budget that also splits the loans the pool cash flows are only added
+in a different order. Every loan chunk builds its schedule once, however many path chunks there are
+'''
+
+NSIM = 500  # number of paths
+SEED = 2037  # master seed of the paths
+LOANS = 300  # loans of the csv used
+BUDGETS = [8 * 2 ** 20, 4 * 2 ** 20, 2 ** 20, 2 ** 18]  # memory budgets in bytes, from no chunks to many
+TOLERANCE = 1e-9  # largest difference allowed with loan chunks
+
+
+class CountingSchedule(PoolSchedule):
+    built = 0
+
+    def __init__(self, *args, **kwargs):
+        CountingSchedule.built += 1
+        super().__init__(*args, **kwargs)
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    schedule = PoolSchedule(pool1)
+    reference = np.array(simulatePoolPaths(pool1, NSIM, schedule, seed=SEED).averageDIRR_AL(structured_securities))
+    failures = []
+
+    chunked_simulation.PoolSchedule = CountingSchedule
+    print(f'{"budget (MB)":<14s}{"loan chunks":<14s}{"path chunks":<14s}{"schedules built":<18s}{"difference"}')
+    for budget in BUDGETS:
+        plan = chunkPlan(LOANS, schedule.periods, budget)
+        loan_chunks, path_chunks = -(-LOANS // plan['loans']), -(-NSIM // plan['paths'])
+        CountingSchedule.built = 0
+        res = np.array(simulateWaterfallChunked(pool1, structured_securities, NSIM, budget, seed=SEED))
+        diff = np.abs(res - reference).max()
+        print(f'{budget / 2 ** 20:<14.2f}{loan_chunks:<14d}{path_chunks:<14d}{CountingSchedule.built:<18d}'
+              f'{diff:.3e}')
+        if diff > (0 if loan_chunks == 1 else TOLERANCE) or CountingSchedule.built != loan_chunks:
+            failures.append('budget of {} bytes'.format(budget))
+    chunked_simulation.PoolSchedule = PoolSchedule
+    if not any(-(-LOANS // chunkPlan(LOANS, schedule.periods, budget)['loans']) > 1 and
+               -(-NSIM // chunkPlan(LOANS, schedule.periods, budget)['paths']) > 1 for budget in BUDGETS):
+        failures.append('no budget splits both the loans and the paths')
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The chunked simulation gives the same averages')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+from loan.hazard_curves import HazardCurves
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from liabilities.waterfall_spec import WaterfallSpec
+from simulations.monte import runMonte, runExpected, expectedRates
+from simulations.pool_paths import simulatePoolPaths, expectedDIRR_AL
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the expected pool cash flows with a waterfall spec that has an OC test. The expected balance
+of expectedCashFlows(collateral=True) is the average pool balance of simulated paths within a few standard errors,
+like the expected cash and principal. expectedDIRR_AL runs the OC spec on it, the same on the numpy backend as on the
+tranche waterfall of the loans: with the OC level at 0 the test never fires and the deal is the sequential one, with
+a level no balance reaches the turbo always runs, and a level in between gives neither. runExpected and
+runMonte(..., warmStart=True) run with the spec, the warm start being runMonte from the rates of expectedRates
+'''
+
+NSIM = 2000  # paths the expected flows are compared with
+MONTE_NSIM = 100  # paths of every runMonte iteration
+SEED = 2046  # master seed of the paths
+LOANS = 300  # loans of the csv used
+ERRORS = 5  # how many standard errors the averages may be from the expected flows, over all periods
+TOLERANCE = 1e-9  # largest difference allowed in DIRR and AL
+ROUNDING = 1e-6  # dollars the average of equal flows may be off by
+MONTE_TOLERANCE = 0.005  # tolerance of the rates solved
+HAZARD = HazardCurves(cdr=0.05, cpr=HazardCurves.PSA(100))
+TRANCHES = [(0.8, 0.05, 0), (0.2, 0.08, 1)]
+
+
+# the steps of a deal whose senior tranche takes all the cash left while its OC is below level
+def steps(level):
+    return [{'pay': 'interest'}, {'pay': 'principal'}, {'pay': 'turbo', 'tranches': [0], 'when': ('OC', 0, level)}]
+
+
+def securities(loanpool, spec=None, tranches=True):
+    structured_securities = StructuredSecurities(loanpool.totalPrincipal())
+    for face_percent, rate, subordination in TRANCHES if tranches else []:
+        structured_securities.addTranche(face_percent, rate, subordination)
+    if spec is not None:
+        structured_securities.spec = WaterfallSpec(spec)
+    return structured_securities
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS], HAZARD)
+    schedule = PoolSchedule(pool1)
+    failures = []
+
+    cash, principal, last_period, balance = schedule.expectedCashFlows(collateral=True)
+    paths = simulatePoolPaths(pool1, NSIM, schedule, seed=SEED, collateral=True)
+    print(f'{"flow":<12s}{"error (SE)"}')
+    for name, flows, expected in [('cash', paths.cash, cash[0]), ('principal', paths.principal, principal[0]),
+                                  ('balance', paths.collateral, balance[0])]:
+        # the balance of period 0 is the same on every path, so its standard error is only rounding
+        error = np.maximum(flows.std(axis=0, ddof=1) / np.sqrt(NSIM), ROUNDING)
+        errors = np.abs(flows.mean(axis=0) - expected) / error
+        print(f'{name:<12s}{errors.max():.2f}')
+        failures += [name] if errors.max() > ERRORS else []
+    plain = schedule.expectedCashFlows()
+    diff = max(np.abs(plain[0] - cash).max(), np.abs(plain[1] - principal).max(), np.abs(plain[2] - last_period).max())
+    print(f'expected flows without the balance against with it: {diff:.3e}')
+    failures += ['collateral=False'] if diff > 0 else []
+
+    print(f'{"OC level":<10s}{"backends":<12s}{"DIRR and AL"}')
+    sequential = np.array(expectedDIRR_AL(pool1, securities(pool1), schedule))
+    turbo = np.array(expectedDIRR_AL(pool1, securities(pool1, [{'pay': 'interest'}, {'pay': 'principal'},
+                                                                 {'pay': 'turbo', 'tranches': [0]}]), schedule))
+    for level, reference in [(0, sequential), (1e9, turbo), (1.3, None)]:
+        numpy_metrics = np.array(expectedDIRR_AL(pool1, securities(pool1, steps(level)), schedule))
+        loan_metrics = np.array(expectedDIRR_AL(pool1, securities(pool1, steps(level)), schedule, backend=None))
+        backends = np.abs(numpy_metrics - loan_metrics).max()
+        print(f'{level:<10g}{backends:<12.3e}{numpy_metrics.round(6).tolist()}')
+        failures += ['backends at {}'.format(level)] if backends > TOLERANCE else []
+        if reference is not None:
+            failures += ['level {}'.format(level)] if np.abs(numpy_metrics - reference).max() > TOLERANCE else []
+        elif min(np.abs(numpy_metrics - sequential).max(), np.abs(numpy_metrics - turbo).max()) <= TOLERANCE:
+            failures += ['level {}'.format(level)]
+
+    expected = runExpected(pool1, securities(pool1, steps(1.3), False), MONTE_TOLERANCE)
+    print(f'runExpected: {[round(tranche[-1], 6) for tranche in expected]}')
+    rates = expectedRates(pool1, securities(pool1, steps(1.3), False), MONTE_TOLERANCE)
+    failures += ['expectedRates'] if rates != [tranche[-1] for tranche in expected] else []
+
+    iterations = {}
+    warm = runMonte(pool1, securities(pool1, steps(1.3), False), MONTE_TOLERANCE, MONTE_NSIM, seed=SEED,
+                    warmStart=True, callback=lambda iteration, rates, diff: iterations.update(warm=iteration))
+    started = runMonte(pool1, securities(pool1, steps(1.3), False), MONTE_TOLERANCE, MONTE_NSIM, seed=SEED,
+                       initialRates=rates)
+    runMonte(pool1, securities(pool1, steps(1.3), False), MONTE_TOLERANCE, MONTE_NSIM, seed=SEED,
+             callback=lambda iteration, rates, diff: iterations.update(cold=iteration))
+    print(f'runMonte warm start: {[round(tranche[-1], 6) for tranche in warm]} in {iterations["warm"]} iterations, '
+          f'cold start in {iterations["cold"]}')
+    failures += ['warmStart'] if warm != started else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The expected pool balance runs the OC test of the expected cash flows')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+from asset.asset_houses import PrimaryHome
+from loan.hazard_curves import HazardCurves
+from loan.loan_pool import LoanPool
+from loan.mortgage import FixedMortgage
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from simulations.pool_paths import simulatePoolPaths
+from simulations.simulate_waterfall import simulateWaterfall
+from utils.random_streams import pathUniforms
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the HazardCurves of a pool of auto loans and mortgages, with a CDR curve for every loan, a
+lower one for the mortgages and a PSA CPR curve for the cars only. Every loan gets the curve of its closest class,
+the simulated defaults and prepayments of every period come at the monthly rates of the curves (a default wins when
+both fall in the same period), simulateWaterfall (doWaterfall, which takes the paths of a pool with hazard curves
+from its PoolSchedule) is the same as simulatePoolPaths with the same seed, and HazardCurves without any curve draws
+the same paths as a pool without hazard curves
+'''
+
+NSIM = 40  # paths of the waterfall
+EVENT_PATHS = 4000  # paths whose default and prepayment periods are counted
+SEED = 2042  # master seed of the paths
+LOANS = 150  # auto loans of the csv used
+MORTGAGES = 50  # mortgages added to them
+PERIODS = 36  # periods whose events are counted
+ERRORS = 4  # how many standard errors the counts may be from the curves
+TOLERANCE = 1e-9  # largest difference allowed in DIRR and AL
+CDR = {'Loan': 0.02, 'FixedMortgage': 0.01}
+CPR = {'Car': HazardCurves.PSA(150)}
+
+
+def main():
+    loans = list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS]
+    loans += [FixedMortgage(360, 0.04, 200000, PrimaryHome(250000)) for _ in range(MORTGAGES)]
+    hazard = HazardCurves(CDR, CPR)
+    pool1 = LoanPool(loans, hazard)
+    schedule = PoolSchedule(pool1)
+    failures = []
+
+    # the monthly rates every loan should get: mortgages 1% CDR and no prepayment, cars 2% CDR and PSA 150
+    mortgage = np.arange(len(loans)) >= LOANS
+    T = np.arange(1, PERIODS + 1)
+    mdr = np.where(mortgage[:, None], HazardCurves.monthlyRate(0.01), HazardCurves.monthlyRate(0.02)) * np.ones(PERIODS)
+    smm = np.where(mortgage[:, None], 0, HazardCurves.monthlyRate(HazardCurves.PSA(150)[:PERIODS]))
+    annual = 1 - (1 - HazardCurves.monthlyRate(np.array([0.01, 0.02, 0.06]))) ** 12
+    print(f'monthly rates back to annual: {np.abs(annual - [0.01, 0.02, 0.06]).max():.3e}')
+    failures += ['monthlyRate'] if np.abs(annual - [0.01, 0.02, 0.06]).max() > 1e-12 else []
+
+    default_times, prepay_times = schedule.eventTimes(pathUniforms(SEED, 0, EVENT_PATHS, schedule.randomsPerPath))
+    prepay_times = prepay_times if prepay_times is not None else np.full(default_times.shape, schedule.periods)
+    # loans still paying at the start of each period, and the defaults and prepayments of the period
+    alive = np.minimum(default_times, prepay_times)[:, :, None] >= T
+    defaults = (default_times[:, :, None] == T).sum(axis=0)
+    prepays = (prepay_times[:, :, None] == T).sum(axis=0)
+    expected_defaults = alive.sum(axis=0) * mdr
+    expected_prepays = alive.sum(axis=0) * smm * (1 - mdr)
+    print(f'{"":<12s}{"event":<12s}{"counted":<10s}{"expected":<12s}{"error (SE)"}')
+    for name, group in [('mortgages', mortgage), ('cars', ~mortgage)]:
+        for event, counted, expected in [('default', defaults, expected_defaults),
+                                         ('prepayment', prepays, expected_prepays)]:
+            counted, expected = counted[group].sum(), expected[group].sum()
+            error = abs(counted - expected) / np.sqrt(expected) if expected > 0 else (np.inf if counted else 0.0)
+            print(f'{name:<12s}{event:<12s}{counted:<10d}{expected:<12.1f}{error:.2f}')
+            failures += ['{} of the {}'.format(event, name)] if error > ERRORS else []
+
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    arrays = simulatePoolPaths(pool1, NSIM, schedule, seed=SEED).averageDIRR_AL(structured_securities)
+    loan_level = simulateWaterfall(pool1, structured_securities, NSIM, seed=SEED)
+    diff = np.abs(np.array(loan_level) - arrays).max()
+    print(f'simulateWaterfall against simulatePoolPaths: {diff:.3e}')
+    failures += ['simulateWaterfall'] if diff > TOLERANCE else []
+
+    no_curves = simulatePoolPaths(LoanPool(loans, HazardCurves()), NSIM, seed=SEED)
+    no_hazard = simulatePoolPaths(LoanPool(loans), NSIM, seed=SEED)
+    diff = max(np.abs(no_curves.cash - no_hazard.cash).max(), np.abs(no_curves.principal - no_hazard.principal).max())
+    print(f'HazardCurves() against no hazard curves: {diff:.3e}')
+    failures += ['no curves'] if diff > 0 else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The loans default and prepay at the rates of their curves')
+
+
+if __name__ == '__main__':
+    main()
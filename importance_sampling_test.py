@@ -0,0 +1,69 @@
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from simulations.importance_sampling import simulateWaterfallIS
+from simulations.pool_paths import simulatePoolPaths
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the importance sampling of simulateWaterfallIS: with every path nominal (defensive=1) the
+weights are all 1 and the paths are the same as simulatePoolPaths with the same seed, and with tilted defaults the
+weighted averages agree with a large plain run within a few standard errors, for every tilt. The variance
+reduction is the nominal variance estimated from the weighted paths over the variance of the weighted average, so
+multiplied by the variance of the weighted average it has to come back to the variance of plain Monte Carlo (the
+reference run's) within a factor of RATIO
+'''
+
+NSIM = 1000  # paths of every run
+REFERENCE_NSIM = 8000  # paths of the plain reference run
+SEED = 2034  # master seed of the paths
+LOANS = 300  # loans of the csv used
+ERRORS = 4  # how many standard errors a run may be from the reference
+RATIO = 2  # how far the nominal variance estimated from the weighted paths may be from the plain one
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.9, 0.05, 0)
+    structured_securities.addTranche(0.1, 0.08, 1)
+    schedule = PoolSchedule(pool1)
+    failures = []
+
+    nominal = simulateWaterfallIS(pool1, structured_securities, NSIM, defensive=1, seed=SEED, schedule=schedule)
+    plain = simulatePoolPaths(pool1, NSIM, schedule, seed=SEED)
+    diff = np.abs(np.array(nominal['DIRR_AL']) - plain.averageDIRR_AL(structured_securities)).max()
+    print(f'nominal against simulatePoolPaths: {diff:.3e}, effective sample size {nominal["effectiveSampleSize"]:.0f}')
+    failures += ['nominal'] if diff > 1e-9 or abs(nominal['effectiveSampleSize'] - NSIM) > 1e-6 else []
+
+    reference_paths = simulatePoolPaths(pool1, REFERENCE_NSIM, schedule, seed=SEED + 1).pathDIRR_AL(
+        structured_securities)
+    reference = reference_paths.mean(axis=0)
+    reference_error = reference_paths.std(axis=0, ddof=1) / np.sqrt(REFERENCE_NSIM)
+    plain_variance = reference_paths.var(axis=0, ddof=1) / NSIM
+    print(f'{"tilt":<8s}{"largest error (SE)":<20s}{"ESS":<8s}{"nominal variance / plain":<26s}{"variance reduction"}')
+    for tilt in [1.2, 1.5, 2.0]:
+        run = simulateWaterfallIS(pool1, structured_securities, NSIM, tilt=tilt, seed=SEED, schedule=schedule)
+        errors = np.abs(np.array(run['DIRR_AL']) - reference) / np.sqrt(
+            np.array(run['standardError']) ** 2 + reference_error ** 2)
+        reduction = np.array(run['varianceReduction'])
+        ratio = reduction * np.array(run['standardError']) ** 2 / plain_variance
+        print(f'{tilt:<8.1f}{errors.max():<20.2f}{run["effectiveSampleSize"]:<8.0f}'
+              f'{f"{ratio.min():.2f} - {ratio.max():.2f}":<26s}{np.round(reduction, 4).tolist()}')
+        failures += ['tilt {}'.format(tilt)] if errors.max() > ERRORS else []
+        if not np.all(np.isfinite(reduction) & (reduction > 0)) or ratio.min() < 1 / RATIO or ratio.max() > RATIO:
+            failures.append('variance reduction of tilt {}'.format(tilt))
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The weighted averages agree with plain Monte Carlo')
+
+
+if __name__ == '__main__':
+    main()
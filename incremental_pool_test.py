@@ -0,0 +1,94 @@
+from asset.asset_houses import PrimaryHome
+from loan.hazard_curves import HazardCurves
+from loan.loan_pool import LoanPool
+from loan.mortgage import FixedMortgage
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from simulations.incremental_pool import IncrementalPool
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check IncrementalPool: a pool that has had loans added and removed (some of the first loans, some
+of the added ones) has the same paths as a pool built fresh from the loans left with the same keys, up to the rounding
+of adding and taking away, and exactly after rebuild(); a loan longer than the pool rebuilds it over the longer
+horizon, again the same as a fresh build. The paths have the odds of the loans: the average pool cash flows agree
+with PoolSchedule.expectedCashFlows within a few standard errors
+'''
+
+NSIM = 2000  # number of paths
+SEED = 2045  # master seed of the loan streams
+LOANS = 300  # loans of the csv the pool starts with
+ADDED = 100  # loans of the csv added afterwards
+TOLERANCE = 1e-6  # largest difference allowed in cash flows (dollars) and DIRR and AL
+ERRORS = 5  # how many standard errors the average cash flows may be from the expected ones, over all periods
+HAZARD = HazardCurves(cdr=0.03, cpr=HazardCurves.PSA(100))
+
+
+def securities(loanpool):
+    structured_securities = StructuredSecurities(loanpool.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    return structured_securities
+
+
+# the largest difference of the cash, principal, balance and last period of the paths of two pools
+def difference(pool, other):
+    paths, other_paths = pool.paths(), other.paths()
+    return max(np.abs(paths.cash - other_paths.cash).max(), np.abs(paths.principal - other_paths.principal).max(),
+               np.abs(paths.collateral - other_paths.collateral).max(),
+               np.abs(paths.lastPeriod - other_paths.lastPeriod).max())
+
+
+def fresh(pool):
+    built = IncrementalPool(LoanPool([], HAZARD), NSIM, SEED, pool.periods, collateral=True)
+    built.add(pool.loanpool, pool.keys)
+    return built
+
+
+def main():
+    loans = list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))
+    pool = IncrementalPool(LoanPool(loans[:LOANS], HAZARD), NSIM, SEED, collateral=True)
+    added = pool.add(loans[LOANS:LOANS + ADDED])
+    pool.remove(list(range(0, LOANS, 7)) + added[::5])
+    failures = []
+
+    reference = fresh(pool)
+    diff = difference(pool, reference)
+    metrics = np.abs(np.array(pool.averageDIRR_AL(securities(pool.loanpool))) -
+                     reference.averageDIRR_AL(securities(pool.loanpool))).max()
+    print(f'{len(pool)} loans after adding and removing, against a fresh build: paths {diff:.3e}, '
+          f'DIRR and AL {metrics:.3e}')
+    failures += ['add and remove'] if diff > TOLERANCE or metrics > TOLERANCE else []
+    pool.rebuild()
+    diff = difference(pool, reference)
+    print(f'after rebuild(): {diff:.3e}')
+    failures += ['rebuild'] if diff > 0 else []
+
+    mortgage = pool.add([FixedMortgage(360, 0.04, 300000, PrimaryHome(400000))])
+    diff = difference(pool, fresh(pool))
+    print(f'a longer loan, {pool.periods} periods, against a fresh build: {diff:.3e}')
+    failures += ['longer loan'] if diff > 0 or pool.periods != 361 else []
+    pool.remove(mortgage)
+
+    expected_cash, expected_principal, _ = PoolSchedule(pool.loanpool, pool.periods).expectedCashFlows()
+    paths = pool.paths()
+    errors = []
+    for flows, expected in [(paths.cash, expected_cash[0]), (paths.principal, expected_principal[0])]:
+        error = flows.std(axis=0, ddof=1) / np.sqrt(NSIM)
+        errors.append((np.abs(flows.mean(axis=0) - expected) / np.where(error > 0, error, np.inf)).max())
+    print(f'average cash and principal against the expected ones: {errors[0]:.2f} and {errors[1]:.2f} SE')
+    failures += ['odds'] if max(errors) > ERRORS else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('Adding and removing loans gives the paths of a fresh build')
+
+
+if __name__ == '__main__':
+    main()
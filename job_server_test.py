@@ -0,0 +1,81 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from simulations.job_server import JobServer
+from simulations.job_client import JobClient
+from simulations.monte import runMonte
+import asyncio
+import logging
+import tempfile
+import threading
+import time
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the local job server through its client: a job on a loan tape streams one progress record
+per iteration and ends with the same DIRR, AL, rating and rates as runMonte on that tape with the job's seed, the
+server keeps answering other requests while a job runs, and a job that would never converge can be cancelled
+'''
+
+NSIM = 10  # paths per iteration
+SEED = 2030  # seed of the job
+LOANS = 40  # loans of the csv put on the test tape
+TOLERANCE = 1e-9  # largest difference allowed in DIRR, AL and rates
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        tape = os.path.join(directory, 'loans.csv')
+        with open(os.path.join('Loan Test', 'Loans.csv'), 'r', encoding='utf-8-sig') as fp:
+            lines = fp.readlines()[:LOANS + 1]
+        with open(tape, 'w') as fp:
+            fp.writelines(lines)
+
+        # the server runs its own event loop in a thread, the client blocks like a front end would
+        loop = asyncio.new_event_loop()
+        server = JobServer(maxWorkers=2)
+        address = loop.run_until_complete(server.start())
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        client = JobClient(port=address[1])
+        try:
+            job_id = client.submit(tape, NSIM=NSIM, seed=SEED)
+            started = time.time()
+            client.jobs()
+            print(f'GET /jobs while the job runs: {time.time() - started:.3f}s')
+            events = list(client.events(job_id))
+            final = events[-1]
+            reference = runMonte(*tapeAndSecurities(tape), 0.005, NSIM, seed=SEED)
+            diff = max(max(abs(tranche['DIRR'] - DIRR), abs(tranche['AL'] - AL), abs(tranche['rate'] - rate))
+                       for tranche, (DIRR, AL, _, rate) in zip(final['result'], reference))
+            print(f'job: {final["status"]}, {len(events) - 1} progress records, difference to runMonte {diff:.3e}')
+            if final['status'] != 'done' or diff > TOLERANCE or len(events) < 2 or \
+                    [tranche['rating'] for tranche in final['result']] != [tranche[2] for tranche in reference]:
+                failures.append('job result')
+
+            job_id = client.submit(tape, NSIM=NSIM, seed=SEED, tolerance=1e-15)
+            time.sleep(1)
+            client.cancel(job_id)
+            status = client.result(job_id)['status']
+            print(f'cancelled job: {status}')
+            failures += ['cancel'] if status != 'cancelled' else []
+        finally:
+            asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+            loop.call_soon_threadsafe(loop.stop)
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The job server matches runMonte')
+
+
+# the LoanPool of a tape and a StructuredSecurities for runMonte to add its tranches to
+def tapeAndSecurities(tape):
+    loanpool = LoanPool.readLoansFromCSV(tape)
+    return loanpool, StructuredSecurities(loanpool.totalPrincipal())
+
+
+if __name__ == '__main__':
+    main()
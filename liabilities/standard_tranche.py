@@ -4,10 +4,14 @@ Standard tranches receive both interest and principal payments from the pool of
 """
 
 from liabilities.tranche_base import Tranche
+import numpy_financial as npf
+import numpy as np
 import logging
 
 
 class StandardTranche(Tranche):
+    ledgerCapacity = 64  # initial number of periods of the payment ledger
+
     def __init__(self, face, rate, face_percent, subordination):
         super(StandardTranche, self).__init__(face, rate, face_percent, subordination)
         self._currentPeriod = 0  # initialize current time period to 0
@@ -18,6 +22,9 @@ class StandardTranche(Tranche):
         self._currentInterestPaid = 0  # initialize current interest paid to 0
         self._interestShortfall = 0  # initialize a special case of current interest due to 0
         self._currentNotionalBalance = self.face  # initialize the balance to face value
+        # the payments of every period, one row per period: [interest paid, principal paid]
+        # preallocated and doubled when a path runs longer, so recording a payment never builds a list
+        self._ledger = np.zeros((self.ledgerCapacity, 2))
 
     # This static-level method will return the monthly interest rate for a passed-in annual rate
     @staticmethod
@@ -55,8 +62,20 @@ class StandardTranche(Tranche):
             # no need to reset it back to 0 manually because it will be recalculated for every new payment
             self._principalShortfall = self._currentPrincipalDue - self._currentPrincipalPaid
             # reduce the current outstanding balance after making the payment
+            self._record(1, self._currentPrincipalPaid)
         return PMT - self._currentPrincipalPaid  # if customer paid more than the balanced owed, return the portion
 
+    # This func would pay down principal beyond the principal due (a turbo step of the waterfall spec), with as
+    # much of PMT as the balance takes; it can follow the regular principal payment of the period
+    def makeTurboPayment(self, PMT):
+        paid = min(self._currentNotionalBalance, PMT)
+        self._currentNotionalBalance -= paid
+        self._currentPrincipalPaid += paid
+        # a shortfall can never be larger than the balance that is left
+        self._principalShortfall = min(self._principalShortfall, self._currentNotionalBalance)
+        self._record(1, self._currentPrincipalPaid)
+        return PMT - paid
+
     # This func would record an interest payment for the current object time period
     def makeInterestPayment(self, PMT):
         # to make sure that only be allowed to be called once for a given time period
@@ -70,14 +89,43 @@ class StandardTranche(Tranche):
             # if the payment is less than the current interest due, shortfall would be incurred
             self._interestShortfall = self._currentInterestDue - self._currentInterestPaid
             # remember to add the interest shortfalls to the balance due
+            self._record(0, self._currentInterestPaid)
         return PMT - self._currentInterestPaid  # if customer paid more than the balanced owed, return the portion
 
+    # record a payment (column 0 interest, 1 principal) in the ledger row of the current period
+    def _record(self, column, amount):
+        self._grow(self._currentPeriod + 1)
+        self._ledger[self._currentPeriod, column] = amount
+
+    # double the ledger until it has at least `periods` rows
+    def _grow(self, periods):
+        while periods > len(self._ledger):
+            self._ledger = np.concatenate([self._ledger, np.zeros(self._ledger.shape)])
+
+    # the ledger of the periods so far, 0..current period - 1; a tranche paid off early records nothing in its
+    # last periods, so the ledger is grown to them here
+    @property
+    def ledger(self):
+        self._grow(self._currentPeriod)
+        return self._ledger[:self._currentPeriod]
+
+    # IRR, DIRR, AL and letter rating from the ledger, each computed once
+    def ledgerMetrics(self):
+        ledger = self.ledger
+        IRR = npf.irr(np.concatenate([[-self.face], ledger[:, 0] + ledger[:, 1]])) * 12
+        DIRR = self.rate - IRR
+        AL = np.dot(np.arange(len(ledger)), ledger[:, 1]) / self.face
+        return [IRR, DIRR, AL, self.DIRR_Rating(DIRR)]
+
     # This would reset the tranche to its original state, time=0
     def reset(self):
+        self._ledger[:self._currentPeriod + 1] = 0  # clear the periods used by the last path
         self._currentPeriod = 0  # reset current time period to 0
         self._currentPrincipalPaid = 0  # reset current principal paid to 0
         self._currentInterestPaid = 0  # reset current interest paid to 0
         self._interestShortfall = 0  # reset a special case of current interest due to 0
+        self._principalShortfall = 0  # reset the principal shortfall, it must not carry over into the next path
+        self._currentPrincipalDue = 0  # reset the principal due to 0
         self._currentNotionalBalance = self.face  # reset balance back to face
         self._currentInterestDue = 0  # reset current interest due to 0
 
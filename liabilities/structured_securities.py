@@ -6,6 +6,8 @@ import logging
 
 from liabilities.tranche_base import Tranche
 from liabilities.standard_tranche import StandardTranche
+from liabilities.waterfall_spec import WaterfallSpec, builtinSpecs, INTEREST, CASH_FLAG, PRINCIPAL, TURBO, \
+    RESERVE, TEST, OC
 
 
 class StructuredSecurities(object):
@@ -13,7 +15,10 @@ class StructuredSecurities(object):
         self._total_face = total_face  # initialized with a total face amount
         self._trancheList = []  # initialize an internal list of tranches
         self._mode = 'Sequential'  # initialize the mode
+        self._spec = builtinSpecs['Sequential']  # the priority of payments of the mode, see WaterfallSpec
+        self._program = None  # the spec compiled for the tranches, built when first needed
         self._reserveAccount = 0  # initialize the reserve account (the extra cash goes into here)
+        self._releasedCash = 0  # cash released by a reserve step of the spec, it leaves the deal
 
     # This will add tranche to the tranche list
     def addTranche(self, face_percent, rate, subordination):
@@ -24,41 +29,60 @@ class StructuredSecurities(object):
         # always sort the tranche list after added a new tranche
         # use callable to pass in the key in order of subordination
         self._trancheList = sorted(self._trancheList, key=lambda tranche: tranche.subordination)
+        self._program = None  # compile the spec again for the new tranches
 
     # This func would increase the current time period by 1
     def increaseTimePeriod(self):
         for tranche in self._trancheList:  # call each tranche in the list
             tranche.increaseTimePeriod()  # increase the current time period for each tranche
 
-    # This method would cycle through the tranches to make payments; interest, then principal
-    # the different modes impact how the payment would be made
-    def makePayments(self, cash_amount, dueAmount):
+    # This method would run the priority of payments of the spec (the mode) for the current time period:
+    # for Sequential and Pro Rata, interest to every tranche, then principal if there is cash left
+    # the compiled program is a flat list of operations, so a complex spec costs no more per operation than these two
+    # collateral is the pool balance, only needed by a spec with an OC test
+    def makePayments(self, cash_amount, dueAmount, collateral=None):
         # initialize cash_left = cash_amount
         cash_left = cash_amount + self._reserveAccount
         # any of the previous cash amount in reserve account will supplement the cash amount for the next period
         self._reserveAccount = 0  # reset the reserve account back to 0
-        for tranche in self._trancheList:  # cycle through all interest payments, paying each tranche
-            cash_left = tranche.makeInterestPayment(cash_left)
-            # the makeInterestPayment func already return the cash overpaid and handled interest shortfall
-        # now assume there is cash left over for making principal payments
-        if cash_left:
-            if self._mode == 'Sequential':  # when mode is sequential
-                # cycle through each tranche in order of subordination (this list is already sorted)
-                # in the Sequential mode, cycle through each tranche (in order of subordination)
-                # making the maximum principal payment
-                for tranche in self._trancheList:
-                    if tranche.notionalBalance:
-                        cash_left = tranche.makePrincipalPayment(cash_left, dueAmount)
-            elif self._mode == 'Pro Rata':
-                # in the Pro Rata mode, use the percent of each tranche to allocate the principal
-                # received to each one
-                # already handle the wrong mode in mode getter, so no need for logging.error here
-                for tranche in self._trancheList:
-                    if tranche.notionalBalance:
-                        # now is the minimum of principal received * tranche%
-                        cash_left = tranche.makePrincipalPayment(cash_left, dueAmount * tranche.face_percent)
+        available = cash_left
+        flags = {}
+        tranches = self._trancheList
+        period = tranches[0].currentPeriod if tranches else 0
+        for op, k, param, slot, guard, guard_value, start, kind in self.program:
+            if period < start or (guard >= 0 and flags[guard] != guard_value):
+                continue
+            if op == INTEREST:
+                # makeInterestPayment returns the cash overpaid and handles the interest shortfall
+                cash_left = tranches[k].makeInterestPayment(cash_left)
+            elif op == CASH_FLAG:
+                flags[slot] = bool(cash_left)  # principal is only paid if there is cash left
+            elif op == PRINCIPAL:
+                # param is 1 for Sequential and the percent of the tranche for Pro Rata
+                if flags[slot] and tranches[k].notionalBalance:
+                    cash_left = tranches[k].makePrincipalPayment(cash_left, dueAmount * param)
+            elif op == TURBO:
+                if tranches[k].notionalBalance:
+                    cash_left = tranches[k].makeTurboPayment(cash_left)
+            elif op == RESERVE:
+                kept = min(cash_left, param)
+                self._releasedCash += cash_left - kept
+                cash_left = kept
+            elif op == TEST:
+                flags[slot] = self._coverage(kind, k, collateral, available) < param
         self._reserveAccount = cash_left  # the extra cash goes into reserve account
 
+    # OC (collateral / notional) or IC (cash available / interest due) ratio of tranches 0..k
+    def _coverage(self, kind, k, collateral, available):
+        if kind == OC:
+            if collateral is None:
+                logging.error('The OC test of the waterfall spec needs the collateral balance')
+                raise ValueError('The OC test of the waterfall spec needs the collateral balance')
+            covered, numerator = sum(tranche.notionalBalance for tranche in self._trancheList[:k + 1]), collateral
+        else:
+            covered, numerator = sum(tranche.interestDue for tranche in self._trancheList[:k + 1]), available
+        return numerator / covered if covered > 0 else float('inf')
+
     # This function will return a list of lists of the data in tranches
     def getWaterfall(self):
         res_lst = []
@@ -77,6 +101,38 @@ class StructuredSecurities(object):
         if imode not in {'Sequential', 'Pro Rata'}:
             logging.error('Please enter a valid mode (Sequential/Pro Rata)')
         self._mode = imode
+        # an unknown mode only pays interest, as it always did
+        self._spec = builtinSpecs.get(imode, WaterfallSpec([{'pay': 'interest'}], imode))
+        self._program = None
+
+    # the priority of payments; setting a WaterfallSpec replaces the mode with the name of the spec
+    @property
+    def spec(self):
+        return self._spec
+
+    @spec.setter
+    def spec(self, ispec):
+        self._spec = ispec
+        self._mode = ispec.name
+        self._program = None
+
+    # the spec compiled for the tranches, as tuples of (op, tranche, param, slot, guard, guard value, from, kind)
+    @property
+    def program(self):
+        if self._program is None:
+            self._program = [(int(op), int(k), param, int(slot), int(guard), int(guard_value), start, int(kind))
+                             for op, k, param, slot, guard, guard_value, start, kind
+                             in self._spec.compile(self._trancheList)]
+        return self._program
+
+    # the compiled spec as an array, for the compute backends
+    @property
+    def programArray(self):
+        return self._spec.compile(self._trancheList)
+
+    @property
+    def releasedCash(self):
+        return self._releasedCash
 
     @property
     def reserveAccount(self):  # getter for reserve amount
@@ -90,9 +146,11 @@ class StructuredSecurities(object):
     def trancheList(self, tranche_list):  # setter for the tranche list within the class
         # should pass in list
         self._trancheList = tranche_list
+        self._program = None
 
     # for each tranche in the structured_securities, reset them to period = 0
     def reset(self):
         self._reserveAccount = 0
+        self._releasedCash = 0
         for tranche in self._trancheList:
             tranche.reset()  # call the reset() for each tranche
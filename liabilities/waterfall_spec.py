@@ -0,0 +1,159 @@
+"""
+WaterfallSpec is a declarative priority of payments for StructuredSecurities. A spec is a list of steps that are
+compiled once, for the tranches of a deal, into a flat program: one row of numbers per operation, run in order every
+period by StructuredSecurities.makePayments for one path and by the compute backends (utils.waterfall_backends) for
+many paths at once. The built-in 'Sequential' and 'Pro Rata' specs are the two modes of StructuredSecurities.
+
+A step is a dict, tranches are numbered in order of subordination:
+
+    {'pay': 'interest'}                                 interest due of every tranche, in order
+    {'pay': 'principal'}                                principal due of the pool to every tranche, in order
+    {'pay': 'principal', 'allocation': 'pro rata'}      principal due times the face percent of every tranche
+    {'pay': 'turbo'}                                    all the cash left as principal, in order, until paid off
+    {'pay': 'reserve', 'target': 0.02}                  keep at most target x total face in the reserve account
+                                                        and release the rest of the cash left to the residual
+
+and may also have
+    'tranches': [0]             only these tranches
+    'from': 24                  only from period 24 on (a lockout before it)
+    'when': ('OC', 0, 1.25)     only while a coverage test is breached (below the level), or passes with
+                                ('OC', 0, 1.25, False). OC = collateral balance / notional of tranches 0..k,
+                                IC = cash available / interest due of tranches 0..k, both at the start of the period
+
+Without a reserve step all the cash left goes to the reserve account and comes back the next period, as it always
+has. A principal step is skipped in a period where no cash is left when it starts, like makePayments always did
+"""
+import numpy as np
+import logging
+
+# opcodes of the compiled program
+INTEREST, CASH_FLAG, PRINCIPAL, TURBO, RESERVE, TEST = range(6)
+# tests
+OC, IC = 0, 1
+# columns of a program row
+OP, TRANCHE, PARAM, SLOT, GUARD, GUARD_VALUE, FROM, KIND = range(8)
+
+
+class WaterfallSpec(object):
+    def __init__(self, steps, name='Custom'):
+        self._steps = [dict(step) for step in steps]
+        self._name = name
+        for step in self._steps:
+            if step.get('pay') not in ('interest', 'principal', 'turbo', 'reserve'):
+                logging.error('Unknown waterfall step {}'.format(step))
+                raise ValueError('Unknown waterfall step {}'.format(step))
+            if step.get('allocation', 'sequential') not in ('sequential', 'pro rata'):
+                logging.error('Unknown principal allocation {}'.format(step['allocation']))
+                raise ValueError('Unknown principal allocation {}'.format(step['allocation']))
+            if 'when' in step and step['when'][0] not in ('OC', 'IC'):
+                logging.error('Unknown coverage test {}'.format(step['when']))
+                raise ValueError('Unknown coverage test {}'.format(step['when']))
+
+    # the program for the given tranches (in order of subordination): an array with one row per operation,
+    # see the column names above. Tests come first so that they see the start of the period, every principal
+    # step starts by flagging whether there is cash left
+    def compile(self, tranches):
+        total_face = sum(tranche.face for tranche in tranches)
+        tests = []
+        for step in self._steps:
+            if 'when' in step and tuple(step['when'][:3]) not in tests:
+                tests.append(tuple(step['when'][:3]))
+        rows = [[TEST, k, level, slot, -1, 0, 0, OC if kind == 'OC' else IC]
+                for slot, (kind, k, level) in enumerate(tests)]
+        slots = len(tests)
+        for step in self._steps:
+            guard, guard_value = -1, 0
+            if 'when' in step:
+                guard = tests.index(tuple(step['when'][:3]))
+                guard_value = 1 if len(step['when']) < 4 or step['when'][3] else 0
+            start = step.get('from', 0)
+            chosen = step.get('tranches', range(len(tranches)))
+            if step['pay'] == 'interest':
+                rows += [[INTEREST, k, 0, -1, guard, guard_value, start, 0] for k in chosen]
+            elif step['pay'] == 'principal':
+                pro_rata = step.get('allocation', 'sequential') == 'pro rata'
+                rows.append([CASH_FLAG, -1, 0, slots, guard, guard_value, start, 0])
+                rows += [[PRINCIPAL, k, tranches[k].face_percent if pro_rata else 1.0, slots, guard, guard_value,
+                          start, 0] for k in chosen]
+                slots += 1
+            elif step['pay'] == 'turbo':
+                rows += [[TURBO, k, 0, -1, guard, guard_value, start, 0] for k in chosen]
+            else:
+                rows.append([RESERVE, -1, step['target'] * total_face, -1, guard, guard_value, start, 0])
+        return np.array(rows, dtype=float).reshape(-1, 8)
+
+    # whether the program needs the collateral balance of the pool (an OC test)
+    @property
+    def needsCollateral(self):
+        return any(step.get('when', ('',))[0] == 'OC' for step in self._steps)
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def steps(self):
+        return self._steps
+
+
+Sequential = WaterfallSpec([{'pay': 'interest'}, {'pay': 'principal'}], 'Sequential')
+ProRata = WaterfallSpec([{'pay': 'interest'}, {'pay': 'principal', 'allocation': 'pro rata'}], 'Pro Rata')
+builtinSpecs = {'Sequential': Sequential, 'Pro Rata': ProRata}
+
+
+# Run one period of a compiled program on arrays of paths: the scalar path is the same with one path.
+# The state arrays (paths x tranches: notional, interest due, principal shortfall; paths: reserve) are updated in
+# place; returns interest paid, principal paid (paths x tranches), the interest shortfall and the cash released.
+# active masks the paths still running, period is the period number, cash, principal_due and collateral (paths)
+# are the pool figures of the period
+def runProgram(program, period, active, cash, principal_due, collateral, notional, interest_due, principal_shortfall,
+               reserve):
+    paths, count = notional.shape
+    interest_paid, principal_paid = np.zeros((paths, count)), np.zeros((paths, count))
+    interest_shortfall = np.zeros((paths, count))
+    slots = int(program[:, SLOT].max(initial=-1)) + 1
+    flags = np.zeros((slots, paths), dtype=bool)
+    cash_left = cash + reserve
+    available = cash_left.copy()
+    released = np.zeros(paths)
+    for row in program:
+        op, k = int(row[OP]), int(row[TRANCHE])
+        run = active & (period >= row[FROM])
+        if row[GUARD] >= 0:
+            run = run & (flags[int(row[GUARD])] == bool(row[GUARD_VALUE]))
+        if op == TEST:
+            covered = notional[:, :k + 1].sum(axis=1) if row[KIND] == OC else interest_due[:, :k + 1].sum(axis=1)
+            numerator = collateral if row[KIND] == OC else available
+            with np.errstate(divide='ignore', invalid='ignore'):
+                flags[int(row[SLOT])] = np.where(covered > 0, numerator / covered, np.inf) < row[PARAM]
+        elif op == INTEREST:
+            due = interest_due[:, k]
+            pay = run & (due != 0) & (interest_paid[:, k] == 0)
+            paid = np.minimum(due, cash_left)
+            interest_paid[:, k] = np.where(pay, paid, interest_paid[:, k])
+            interest_shortfall[:, k] = np.where(pay, due - paid, interest_shortfall[:, k])
+            cash_left = np.where(pay, cash_left - paid, cash_left)
+        elif op == CASH_FLAG:
+            flags[int(row[SLOT])] = cash_left != 0
+        elif op == PRINCIPAL:
+            pay = run & flags[int(row[SLOT])] & (notional[:, k] != 0) & (principal_paid[:, k] == 0)
+            due = np.minimum(notional[:, k], principal_due * row[PARAM] + principal_shortfall[:, k])
+            paid = np.minimum(due, cash_left)
+            notional[:, k] = np.where(pay, notional[:, k] - paid, notional[:, k])
+            principal_shortfall[:, k] = np.where(pay, due - paid, principal_shortfall[:, k])
+            cash_left = np.where(pay, cash_left - paid, cash_left)
+            principal_paid[:, k] = np.where(pay, paid, principal_paid[:, k])
+        elif op == TURBO:
+            pay = run & (notional[:, k] != 0)
+            paid = np.minimum(notional[:, k], cash_left)
+            notional[:, k] = np.where(pay, notional[:, k] - paid, notional[:, k])
+            principal_shortfall[:, k] = np.where(pay, np.minimum(principal_shortfall[:, k], notional[:, k]),
+                                                 principal_shortfall[:, k])
+            cash_left = np.where(pay, cash_left - paid, cash_left)
+            principal_paid[:, k] = np.where(pay, principal_paid[:, k] + paid, principal_paid[:, k])
+        elif op == RESERVE:
+            kept = np.where(run, np.minimum(cash_left, row[PARAM]), cash_left)
+            released = released + np.where(run, cash_left - kept, 0)
+            cash_left = kept
+    reserve[:] = np.where(active, cash_left, reserve)
+    return interest_paid, principal_paid, interest_shortfall, released
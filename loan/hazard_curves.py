@@ -0,0 +1,79 @@
+"""
+HazardCurves gives a LoanPool per-period default (CDR) and prepayment (CPR) rates instead of the step probabilities of
+Loan.default_dict. Rates are annual, as quoted, and turned into monthly ones: MDR = 1 - (1 - CDR) ^ (1 / 12), and the
+single monthly mortality SMM = 1 - (1 - CPR) ^ (1 / 12).
+
+A curve is a single rate for every period, or a list of rates for periods 1, 2, ... whose last rate carries on.
+cdr and cpr may also be dicts of curves keyed by the class name of a loan or of its asset, e.g.
+{'FixedMortgage': ..., 'Car': ...}; the closest class wins (the loan's own classes first, then the asset's), so
+'Loan' covers every loan. Loans without a CDR curve keep Loan.default_dict, loans without a CPR curve never prepay.
+
+The curves are applied to the whole pool at once by PoolSchedule: every loan draws a default period and a
+prepayment period per path and whichever comes first ends the loan (a default wins in the same period)
+"""
+import numpy as np
+import logging
+
+
+class HazardCurves(object):
+    def __init__(self, cdr=None, cpr=None):
+        for curves in (cdr, cpr):
+            for curve in (curves.values() if isinstance(curves, dict) else [curves]):
+                rates = np.asarray(curve if curve is not None else 0, dtype=float)
+                if np.any((rates < 0) | (rates >= 1)):
+                    logging.error('Hazard rates must be in [0, 1)')
+                    raise ValueError('Hazard rates must be in [0, 1)')
+        self._cdr = cdr
+        self._cpr = cpr
+
+    # annual rate(s) to monthly
+    @staticmethod
+    def monthlyRate(annualRate):
+        return 1 - (1 - np.asarray(annualRate, dtype=float)) ** (1 / 12)
+
+    # the CPR curve of a PSA prepayment speed: 0.2% in period 1 rising by 0.2% a period to 6% from period 30 on,
+    # times speed / 100
+    @staticmethod
+    def PSA(speed=100, periods=360):
+        return np.minimum(0.002 * np.arange(1, periods + 1), 0.06) * speed / 100
+
+    # the curve of one loan from a curve or a dict of curves, None if there is none for it
+    @staticmethod
+    def _curveOf(curves, loan):
+        if not isinstance(curves, dict):
+            return curves
+        for cls in type(loan).__mro__ + type(loan.asset).__mro__:
+            if cls.__name__ in curves:
+                return curves[cls.__name__]
+        return None
+
+    # a curve as monthly rates for periods 0..periods-1 (nothing happens in period 0)
+    @classmethod
+    def _monthlyCurve(cls, curve, periods):
+        rates = np.zeros(periods)
+        annual = np.atleast_1d(np.asarray(curve, dtype=float))
+        if periods > 1:
+            rates[1:] = cls.monthlyRate(annual[np.minimum(np.arange(periods - 1), len(annual) - 1)])
+        return rates
+
+    # The loans grouped by their curves: the group of every loan and, for every group, the monthly default rates
+    # (None for Loan.default_dict) and monthly prepayment rates (None for no prepayment) of periods 0..periods-1
+    def groups(self, loans, periods):
+        keys, curves, group = {}, [], np.zeros(len(loans), dtype=int)
+        for i, loan in enumerate(loans):
+            cdr, cpr = self._curveOf(self._cdr, loan), self._curveOf(self._cpr, loan)
+            key = (id(cdr), id(cpr))
+            if key not in keys:
+                keys[key] = len(curves)
+                curves.append((self._monthlyCurve(cdr, periods) if cdr is not None else None,
+                               self._monthlyCurve(cpr, periods) if cpr is not None else None))
+            group[i] = keys[key]
+        return group, curves
+
+    @property
+    def cdr(self):
+        return self._cdr
+
+    @property
+    def cpr(self):
+        return self._cpr
@@ -1,5 +1,6 @@
 from asset.asset_base import Asset
 import logging
+import numpy as np
 from utils.memoize import Memoize
 from datetime import datetime, timedelta
 
@@ -61,6 +62,27 @@ class Loan(object):
             #               f'annuity)')
             return balance
 
+    # Vectorized counterparts of calcMonthlyPmt and calcBalance: the same formulas evaluated with numpy, so a whole
+    # column of loans (or of periods) is amortized in one call; the arguments may be scalars or broadcastable arrays
+    @classmethod
+    def calcMonthlyPmtArray(cls, term, rate, face):
+        term, rate, face = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (term, rate, face)))
+        monthly_rate = Loan.monthlyRate(rate)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            pmt = (monthly_rate * face) / (1 - (1 + monthly_rate) ** -term)
+        return np.where(rate > 0, pmt, 0.0)  # zero rate has no payment, same as calcMonthlyPmt
+
+    @classmethod
+    def calcBalanceArray(cls, term, rate, face, T):
+        term, rate, face, T = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (term, rate, face, T)))
+        monthly_rate = Loan.monthlyRate(rate)
+        growth = (1 + monthly_rate) ** T
+        with np.errstate(divide='ignore', invalid='ignore'):
+            balance = face * growth - cls.calcMonthlyPmtArray(term, rate, face) * ((growth - 1) / monthly_rate)
+        balance = np.where(rate > 0, balance, face)
+        balance = np.where(T == 0, face, balance)
+        return np.where((T > term) | (T < 0), 0.0, balance)  # out of range periods have no balance
+
     # this is the object-level method to calculate monthly payment
     # delegate to the class-level method calcMonthlyPmt
     def monthlyPayment(self, period):
@@ -127,6 +149,7 @@ class Loan(object):
             return 0
 
     default_dict = {1: 0.0005, 11: 0.001, 60: 0.002, 120: 0.004, 180: 0.002, 210: 0.001}
+    recovery_multiplier = 0.6  # share of the asset value recovered when a loan defaults
 
     # This method will determine whether the loan defaults
     def checkDefault(self, num):
@@ -136,7 +159,7 @@ class Loan(object):
     # This method should return the
     # current asset value for the given period, times a recovery multiplier
     def recoveryValue(self, T):
-        recovery_value = self._asset.value(T) * 0.6
+        recovery_value = self._asset.value(T) * self.recovery_multiplier
         # logging.debug(
         #     f'calculating the recovery value at T = {T}: {recovery_value} = asset value {self._asset.value(T)} * '
         #     f'recovery multiplier 0.6')
@@ -232,6 +255,10 @@ class Loan(object):
     def face(self, iface):
         self._face = iface
 
+    @property
+    def asset(self):
+        return self._asset
+
     @property
     def default_status(self):
         return self._default
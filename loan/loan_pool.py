@@ -1,154 +1,271 @@
-from loan.loan_base import Loan
-from loan.auto_loan import AutoLoan
-from loan.mortgage import FixedMortgage
-from asset.asset_cars import Car, Civic, Lexus, Lambourghini
-from asset.asset_houses import VacationHome, PrimaryHome
-from functools import reduce
-import logging
-import random
-import numpy as np
-
-# these dicts are to read the csv and create the loans in class
-loanNameToClass = {
-    'Auto Loan': AutoLoan,
-    'Fixed Mortgage': FixedMortgage
-}
-
-assetNameToClass = {
-    'Lambourghini': Lambourghini,
-    'Car': Car,
-    'Lexus': Lexus,
-    'Civic': Civic,
-    'VacationHome': VacationHome,
-    'PrimaryHome': PrimaryHome,
-}
-
-
-class LoanPool(object):
-    # the loans will be in list, because a pool usually contains multiple loans
-    def __init__(self, loans):
-        self._loans = loans
-
-    # This is to make LoanPool class to be an iterable
-    # be able to loop over a LoanPool object’s individual Loan objects
-    def __iter__(self):
-        for loan in self._loans:
-            yield loan  # generator
-
-    # This is a class method that would write to the csv
-    @classmethod
-    def writeLoansToCSV(cls, loanPool, filename):
-        lines = []
-
-        for loan in loanPool:
-            lines.append(','.join([loan.__class__.__name__, loan.asset.__class__.__name__,
-                                   str(loan.asset.initialValue), str(loan.face),
-                                   str(loan.rate), str(loan.start), str(loan.maturity)]))
-
-        outputString = '\n'.join(lines)
-
-        with open(filename, 'w') as fp:
-            fp.write(outputString)
-
-    # This is a class method that would create the loan
-    @classmethod
-    def createLoan(cls, loanType, principal, rate, term, assetName, assetValue):
-        assetCls = assetNameToClass.get(assetName)
-        if assetCls:
-            asset = assetCls(float(assetValue))
-            loanCls = loanNameToClass.get(loanType)
-            if loanCls:
-                loan = loanCls(int(term), float(rate), float(principal), asset)
-                return loan
-        else:
-            logging.error('Invalid loan type entered.')
-
-    # returns the number of ‘active’ loans. Active loans are loans that have a
-    # balance greater than zero.
-    def activeLoanCount(self, T):
-        # use list comprehension to create a list for loans that have balance > 0
-        active_list = [loan for loan in self._loans if loan.balance(T) > 0]
-        return len(active_list)  # return the length of the active loan list
-
-    # This function determines that it is in default if it gets a 0
-    # logic of this checkDefaults: the default probability = the probability that 0 will be selected
-    def checkDefaults(self, T):
-        required_key = max(period for period in Loan.default_dict.keys() if period <= T)  # using generator expression
-        default_prob = Loan.default_dict[required_key]  # retrieve the prob from the dict
-        random_range = round(1 / default_prob) - 1  # random range should be reduced by one to include 0
-        recovery_value = 0
-        for loan in self._loans:
-            if not loan.default_status:  # check only when defaulted flag is false
-                loan.checkDefault(random.randint(0, random_range))  # update the loan default status
-                if loan.default_status:  # if loan is default, return the recovery value of the asset
-                    recovery_value += loan.recoveryValue(T)
-        return recovery_value  # return all the defaulted loan's asset recovery value
-
-    # This is to calculate Weighted Average Rate (WAR) of the loans
-    def WAR(self, T):
-        # use the reduce function with callable lambda to calculate the sum
-        # numerator: sum of each loan with the rate * face
-        # denominator: sum of the face value of each loan
-        logging.debug('calculating the WAR...')
-        wr_sum = reduce(lambda total, loan: total + (loan.face * loan.getRate(T)), self._loans, 0) / \
-                 reduce(lambda total, loan: total + loan.face, self._loans, 0)
-        war = round(wr_sum * 100, 2)  # round the weighted average rate to the nearest hundredths.
-        return str(war) + ' %'
-
-    # This is to calculate the Weighted Average Maturity (WAM)
-    def WAM(self):
-        # use the reduce function with callable lambda to calculate the sum
-        # numerator: sum of each loan with the rate * term in months/12
-        # denominator: sum of the face value of each loan
-        logging.debug('calculating the WAM...')
-        wam_sum = reduce(lambda total, loan: total + (loan.face * loan.term / 12), self._loans, 0) / \
-                  reduce(lambda total, loan: total + loan.face, self._loans, 0)
-        return round(wam_sum, 3)
-
-    # sum up all the face/principal amount of the loans in the pool
-    # using list comprehension
-    def totalPrincipal(self):
-        total_principal = sum(loan.face for loan in self._loans)
-        # logging.debug('calculating the total principal = sum of each face value in the pool')
-        return total_principal
-
-    # sum up all the payment amounts of the loans in the pool
-    # using generator expression
-    def totalPayments(self):
-        return sum(loan.totalPayments() for loan in self._loans)
-
-    # for total interest, instead of calling the function for each loan
-    # I decide to simply use total payments - total principal in the pool
-    def totalInterest(self):
-        return self.totalPayments() - self.totalPrincipal()
-
-    # find the principal due at given period T
-    # using generator expression
-    def principalDue(self, T):
-        return sum(loan.principalDue(T) for loan in self._loans)
-
-    # find the total payment due at given period T
-    # using generator expression
-    def paymentDue(self, T):
-        return sum(loan.monthlyPayment(T) for loan in self._loans)
-
-    # find the interest due at given period T
-    # using generator expression
-    def interestDue(self, T):
-        return sum(loan.interestDue(T) for loan in self._loans)
-
-    # find the balance outstanding at given period T
-    # using generator expression
-    def balance(self, T):
-        return sum(loan.balance(T) for loan in self._loans)
-
-    # This function will return a list of lists of the data in each loan
-    def getWaterfall(self, T):
-        res_lst = []
-        for loan in self._loans:
-            res_lst.append([loan.balance(T), loan.monthlyPayment(T), loan.principalDue(T), loan.interestDue(T)])
-        return res_lst
-
-    def reset(self):
-        for loan in self._loans:
-            loan.reset()
+from loan.loan_base import Loan
+from loan.auto_loan import AutoLoan
+from loan.mortgage import MortgageMixin, FixedMortgage
+from asset.asset_cars import Car, Civic, Lexus, Lambourghini
+from asset.asset_houses import VacationHome, PrimaryHome
+import csv
+import logging
+import numpy as np
+from utils.random_streams import newSeed, pathGenerator
+
+# these dicts are to read the csv and create the loans in class
+loanNameToClass = {
+    'Auto Loan': AutoLoan,
+    'Fixed Mortgage': FixedMortgage
+}
+
+assetNameToClass = {
+    'Lambourghini': Lambourghini,
+    'Car': Car,
+    'Lexus': Lexus,
+    'Civic': Civic,
+    'VacationHome': VacationHome,
+    'PrimaryHome': PrimaryHome,
+}
+
+
+class LoanPool(object):
+    # the loans will be in list, because a pool usually contains multiple loans
+    # hazard: optional HazardCurves (CDR/CPR curves) used instead of Loan.default_dict, see loan.hazard_curves
+    def __init__(self, loans, hazard=None):
+        self._loans = loans
+        self._defaultTimes = None  # the default period of each loan on the current path, see drawDefaults
+        self._prepayTimes = None  # the prepayment period of each loan on the current path, with hazard curves
+        self._hazard = hazard
+        self._schedule = None  # the PoolSchedule of the loans and hazard curves, built when first needed
+
+    # This is to make LoanPool class to be an iterable
+    # be able to loop over a LoanPool object’s individual Loan objects
+    def __iter__(self):
+        for loan in self._loans:
+            yield loan  # generator
+
+    # This is a class method that would write to the csv
+    @classmethod
+    def writeLoansToCSV(cls, loanPool, filename):
+        lines = []
+
+        for loan in loanPool:
+            lines.append(','.join([loan.__class__.__name__, loan.asset.__class__.__name__,
+                                   str(loan.asset.initialValue), str(loan.face),
+                                   str(loan.rate), str(loan.start), str(loan.maturity)]))
+
+        outputString = '\n'.join(lines)
+
+        with open(filename, 'w') as fp:
+            fp.write(outputString)
+
+    # This is a class method that would create the loan
+    @classmethod
+    def createLoan(cls, loanType, principal, rate, term, assetName, assetValue):
+        assetCls = assetNameToClass.get(assetName)
+        if assetCls:
+            asset = assetCls(float(assetValue))
+            loanCls = loanNameToClass.get(loanType)
+            if loanCls:
+                loan = loanCls(int(term), float(rate), float(principal), asset)
+                return loan
+        else:
+            logging.error('Invalid loan type entered.')
+
+    # This is a class method that would read a loan tape csv laid out like 'Loan Test/Loans.csv'
+    # (Loan #, Loan Type, Balance, Rate, Term, Asset, Asset Value) and create the LoanPool
+    @classmethod
+    def readLoansFromCSV(cls, filename):
+        with open(filename, 'r', encoding='utf-8-sig') as fp:
+            reader = csv.reader(fp)
+            next(reader)  # we don't want to load the header
+            return cls([cls.createLoan(row[1], row[2], row[3], row[4], row[5], row[6]) for row in reader if row[1]])
+
+    # returns the number of ‘active’ loans. Active loans are loans that have a
+    # balance greater than zero.
+    def activeLoanCount(self, T):
+        # use list comprehension to create a list for loans that have balance > 0
+        active_list = [loan for loan in self._loans if loan.balance(T) > 0]
+        return len(active_list)  # return the length of the active loan list
+
+    # Draw the default period of every loan for simulation path `path` of master seed `seed`, from that path's own
+    # random stream (utils.random_streams), so the path can be regenerated on its own
+    # With hazard curves the default and prepayment periods come from the PoolSchedule (see PoolSchedule.eventTimes)
+    def drawDefaults(self, seed, path):
+        if self._hazard is not None:
+            schedule = self.schedule()
+            uniforms = pathGenerator(seed, path).random(schedule.randomsPerPath)
+            self._defaultTimes, self._prepayTimes = schedule.eventTimes(uniforms)
+            return
+        periods = int(max((loan.term for loan in self._loans), default=0)) + 1
+        uniforms = pathGenerator(seed, path).random(len(self._loans))
+        self._defaultTimes = self.defaultTimes(uniforms, periods)
+
+    # the PoolSchedule of the loans with the hazard curves of the pool, built once
+    # (imported here: loan.pool_schedule imports this module)
+    def schedule(self):
+        if self._schedule is None:
+            from loan.pool_schedule import PoolSchedule
+            self._schedule = PoolSchedule(self)
+        return self._schedule
+
+    # A loan defaults in the period drawn for it by drawDefaults (a path of a fresh seed is drawn if there is none).
+    # The odds are the same as checking each loan every period with the default probability of Loan.default_dict
+    def checkDefaults(self, T):
+        if self._defaultTimes is None:
+            self.drawDefaults(newSeed(), 0)
+        recovery_value = 0
+        for loan, default_time in zip(self._loans, self._defaultTimes):
+            if not loan.default_status:  # check only when defaulted flag is false
+                loan.checkDefault(0 if default_time == T else 1)  # update the loan default status
+                if loan.default_status:  # if loan is default, return the recovery value of the asset
+                    recovery_value += loan.recoveryValue(T)
+        return recovery_value  # return all the defaulted loan's asset recovery value
+
+    # the per-period default probability used by checkDefaults for T = 0..periods-1 (nothing defaults at T = 0)
+    # a loan defaults with probability 1 / round(1 / p), i.e. when randint(0, round(1 / p) - 1) would give 0
+    # tilt multiplies the probabilities, for importance sampling (capped below 1)
+    @staticmethod
+    def defaultProbabilities(periods, tilt=1.0):
+        probabilities = np.zeros(periods)
+        for T in range(1, periods):
+            required_key = max(period for period in Loan.default_dict.keys() if period <= T)
+            probabilities[T] = 1 / round(1 / Loan.default_dict[required_key])
+        return np.minimum(probabilities * tilt, 0.999) if tilt != 1.0 else probabilities
+
+    # cumulative probability of having defaulted by the end of each period T = 0..periods-1
+    @classmethod
+    def defaultCDF(cls, periods, tilt=1.0):
+        return 1 - np.cumprod(1 - cls.defaultProbabilities(periods, tilt))
+
+    # Inverse CDF sampling of default periods from uniforms on [0, 1): a loan defaults at the first period whose
+    # cumulative default probability exceeds its uniform; loans that never default get period = periods
+    @classmethod
+    def defaultTimes(cls, uniforms, periods, cdf=None):
+        cdf = cdf if cdf is not None else cls.defaultCDF(periods)
+        return np.searchsorted(cdf[1:periods], uniforms, side='right') + 1
+
+    # This is to calculate Weighted Average Rate (WAR) of the loans
+    # face-weighted rate at T from the columns of the pool, see PoolAnalytics.WAR
+    def WAR(self, T):
+        logging.debug('calculating the WAR...')
+        war = round(self.analytics().WAR(T) * 100, 2)  # round to the nearest hundredths
+        return str(war) + ' %'
+
+    # This is to calculate the Weighted Average Maturity (WAM)
+    # face-weighted term in years
+    def WAM(self):
+        logging.debug('calculating the WAM...')
+        return round(self.analytics().WAM(), 3)
+
+    # sum up all the face/principal amount of the loans in the pool
+    # using list comprehension
+    def totalPrincipal(self):
+        total_principal = sum(loan.face for loan in self._loans)
+        # logging.debug('calculating the total principal = sum of each face value in the pool')
+        return total_principal
+
+    # sum up all the payment amounts of the loans in the pool
+    # the payments of every loan at once from the columns of the pool, see PoolAnalytics.payments
+    def totalPayments(self):
+        return float(self.analytics().payments().sum())
+
+    # the PoolAnalytics of the loans: the pool as columns for WAR, WAM, totals and stratification tables
+    # (imported here: loan.pool_analytics imports this module)
+    def analytics(self, ages=None):
+        from loan.pool_analytics import PoolAnalytics
+        return PoolAnalytics.fromLoanPool(self, ages)
+
+    # for total interest, instead of calling the function for each loan
+    # I decide to simply use total payments - total principal in the pool
+    def totalInterest(self):
+        return self.totalPayments() - self.totalPrincipal()
+
+    # find the principal due at given period T
+    # using generator expression
+    def principalDue(self, T):
+        return sum(loan.principalDue(T) for loan in self._loans)
+
+    # find the total payment due at given period T
+    # using generator expression
+    def paymentDue(self, T):
+        return sum(loan.monthlyPayment(T) for loan in self._loans)
+
+    # find the interest due at given period T
+    # using generator expression
+    def interestDue(self, T):
+        return sum(loan.interestDue(T) for loan in self._loans)
+
+    # find the balance outstanding at given period T
+    # using generator expression
+    def balance(self, T):
+        return sum(loan.balance(T) for loan in self._loans)
+
+    # This function will return a list of lists of the data in each loan
+    def getWaterfall(self, T):
+        res_lst = []
+        for loan in self._loans:
+            res_lst.append([loan.balance(T), loan.monthlyPayment(T), loan.principalDue(T), loan.interestDue(T)])
+        return res_lst
+
+    # The LTV (scheduled balance / depreciated asset value) and equity (as equity(T)) of every loan in periods
+    # 0..periods-1 (to the longest term by default), two arrays of loans x periods built a block of loans at a time.
+    # ltvOut and equityOut are arrays of that shape to write them into instead, e.g. numpy.lib.format.open_memmap
+    # files, so a large pool never holds the surfaces in memory (see loan.pool_surfaces)
+    def surfaces(self, periods=None, ltvOut=None, equityOut=None):
+        from loan.pool_surfaces import surfaceBlocks, ltvAndEquity
+        periods = periods or int(max((loan.term for loan in self._loans), default=0)) + 1
+        ltv = ltvOut if ltvOut is not None else np.empty((len(self._loans), periods))
+        equity = equityOut if equityOut is not None else np.empty((len(self._loans), periods))
+        for low, balance, value in surfaceBlocks(self._loans, periods):
+            ltv[low:low + len(balance)], equity[low:low + len(balance)] = ltvAndEquity(balance, value)
+        return ltv, equity
+
+    # Per-period statistics of the LTV and equity of the loans still active (share underwater, negative equity,
+    # WALTV, LTV quantiles, ...), streamed over blocks of blockLoans loans so the surfaces are never built whole.
+    # Returns a SurfaceStatistics, its summary() has the arrays (see loan.pool_surfaces)
+    def surfaceStatistics(self, periods=None, bins=None, blockLoans=None):
+        from loan.pool_surfaces import SurfaceStatistics, surfaceBlocks, BLOCK_LOANS
+        periods = periods or int(max((loan.term for loan in self._loans), default=0)) + 1
+        statistics = SurfaceStatistics(periods, bins)
+        for _, balance, value in surfaceBlocks(self._loans, periods, blockLoans or BLOCK_LOANS):
+            statistics.add(balance, value)
+        return statistics
+
+    # The PMI column of the whole pool as an array: one row per loan, one column per period 0..max term.
+    # Fixed mortgages are done in one vectorized call from their PMI cutoffs, variable mortgages fall back to
+    # their own PMI(); other loans get a row of zeros. This is the no-default schedule (defaults stop PMI)
+    def PMISchedule(self):
+        periods = int(max((loan.term for loan in self._loans), default=0)) + 1
+        schedule = np.zeros((len(self._loans), periods))
+        T = np.arange(periods)
+        fixed = [i for i, loan in enumerate(self._loans) if isinstance(loan, FixedMortgage)]
+        if fixed:
+            terms = np.array([self._loans[i].term for i in fixed], dtype=float)
+            faces = np.array([self._loans[i].face for i in fixed], dtype=float)
+            cutoffs = MortgageMixin.calcPMICutoff(terms, [self._loans[i].rate for i in fixed], faces,
+                                                  [self._loans[i].asset.initialValue for i in fixed])
+            charged = (T >= 1) & (T < cutoffs[:, None]) & (T <= terms[:, None])
+            schedule[fixed] = np.where(charged, MortgageMixin.pmiRate * faces[:, None], 0)
+        for i, loan in enumerate(self._loans):
+            if isinstance(loan, MortgageMixin) and not isinstance(loan, FixedMortgage):
+                schedule[i] = [loan.PMI(t) if t <= loan.term else 0 for t in T]
+        return schedule
+
+    # the default and prepayment periods of every loan on the current path, drawn by drawDefaults
+    # (a path of a fresh seed is drawn if there is none); the prepayment periods are None without prepayment
+    def pathEvents(self):
+        if self._defaultTimes is None:
+            self.drawDefaults(newSeed(), 0)
+        return self._defaultTimes, self._prepayTimes
+
+    @property
+    def hazard(self):
+        return self._hazard
+
+    @hazard.setter
+    def hazard(self, ihazard):
+        self._hazard = ihazard
+        self._schedule = None
+
+    def reset(self):
+        self._defaultTimes = None
+        self._prepayTimes = None
+        for loan in self._loans:
+            loan.reset()
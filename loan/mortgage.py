@@ -1,17 +1,71 @@
+from loan.loan_base import Loan
 from loan.loan import FixedRateLoan, VariableRateLoan
 from asset.asset_houses import HouseBase
 import logging
+import numpy as np
 from utils.memoize import Memoize
 
 
 class MortgageMixin(object):
-    def __init__(self, start, maturity, rate, face, home):
+    # PMI is 0.0075% of the face per month, charged while the loan-to-value ratio is above 80%
+    pmiRate = 0.000075
+    pmiLTV = 0.8
+
+    def __init__(self, term, rate, face, home):
         if isinstance(home, HouseBase):
-            super(MortgageMixin, self).__init__(start, maturity, rate, face, home)
+            super(MortgageMixin, self).__init__(term, rate, face, home)
         else:
             # log an error prior to raising the exception.
             logging.error('Home attribute needs to be a HomeBase type.')
             raise TypeError('Home attribute needs to be a HomeBase type.')
+        self._pmiCutoff = None  # the (key, cutoff) pair cached by pmiCutoff
+
+    # The balance of a fixed-rate schedule only goes down, so the LTV crosses 80% exactly once. This class-level
+    # method solves for that first period T with balance(T) / home value <= 0.8 analytically:
+    # balance(T) <= L  <=>  (1 + r)^T >= (pmt / r - L) / (pmt / r - face)
+    # then nudges the answer by one period where float rounding puts it on the wrong side of the boundary.
+    # PMI is charged for 1 <= T < cutoff. Works on scalars or whole numpy columns of loans.
+    @classmethod
+    def calcPMICutoff(cls, term, rate, face, homeValue):
+        term, rate, face, homeValue = np.broadcast_arrays(*(np.asarray(x, dtype=float)
+                                                            for x in (term, rate, face, homeValue)))
+        limit = cls.pmiLTV * homeValue
+        monthly_rate = Loan.monthlyRate(rate)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            annuity = face / (1 - (1 + monthly_rate) ** -term)  # pmt / r
+            cutoff = np.ceil(np.log((annuity - limit) / (annuity - face)) / np.log1p(monthly_rate))
+        cutoff = np.where(face <= limit, 1, cutoff)  # already below 80% before the first payment
+        cutoff = np.where(np.isfinite(cutoff), cutoff, term + 1)  # never crosses (zero rate or zero value)
+        cutoff = np.clip(cutoff, 1, term + 1)
+
+        def aboveLTV(T):
+            with np.errstate(divide='ignore', invalid='ignore'):
+                return Loan.calcBalanceArray(term, rate, face, T) / homeValue > cls.pmiLTV
+
+        cutoff = np.where((cutoff > 1) & ~aboveLTV(cutoff - 1), cutoff - 1, cutoff)
+        cutoff = np.where((cutoff <= term) & aboveLTV(cutoff), cutoff + 1, cutoff)
+        cutoff = cutoff.astype(int)
+        return int(cutoff) if cutoff.ndim == 0 else cutoff
+
+    # the per-loan cutoff, computed once and cached; it is only recomputed if the term, rate, face or home value
+    # change. Variable rate loans have no closed form, so binary search the balance table instead
+    @property
+    def pmiCutoff(self):
+        key = (self.term, str(self._rate), self._face, self._asset.initialValue)
+        if self._pmiCutoff is None or self._pmiCutoff[0] != key:
+            if isinstance(self._rate, dict):
+                low, high = 1, int(self.term) + 1
+                while low < high:
+                    mid = (low + high) // 2
+                    if self.balance(mid) / self._asset.initialValue > self.pmiLTV:
+                        low = mid + 1
+                    else:
+                        high = mid
+                cutoff = low
+            else:
+                cutoff = self.calcPMICutoff(self.term, self._rate, self._face, self._asset.initialValue)
+            self._pmiCutoff = (key, cutoff)
+        return self._pmiCutoff[1]
 
     def PMI(self, T):
         if T > self.term or T <= 0:
@@ -19,18 +73,10 @@ class MortgageMixin(object):
             # a friendly info to the user
             logging.info('Entered T is greater than term')
             return 0  # if T entered is larger than the term or <= 0, return 0
-        # if LTV is larger than 80%, the borrower has to pay the PMI
-        LTV = self.balance(T) / self._asset.initialValue
-        logging.debug(f'calculating the LTV at {T}: {LTV} = {self.balance(T)} (balance) / {self._asset.initialValue} '
-                      f'(asset initial value)')
-        if LTV > 0.8:
-            logging.debug(f'{LTV} is larger than 0.8, so PMI is incurred at T = {T}')
-            m_PMI = 0.000075 * self._face
-            logging.debug(f'calculating PMI at {T}: {m_PMI} = {self._face} * 000075')
-            return m_PMI
-        else:  # else no PMI would be incurred
-            logging.debug(f'{LTV} is less than 0.8, so PMI = 0 at T = {T}')
+        # a defaulted loan has no balance, so no PMI
+        if self._default or T >= self.pmiCutoff:
             return 0
+        return self.pmiRate * self._face
 
     # The monthly payment is the payment of the loan + the PMI, depending on the period
     def monthlyPayment(self, T):
@@ -0,0 +1,203 @@
+"""
+PoolAnalytics keeps a loan tape as columns (face, rate, term, asset value, loan and asset class of every loan) and
+works out the pool statistics and stratification tables from them with numpy, as numbers rather than the formatted
+strings of LoanPool.WAR. The columns are built in one pass over a LoanPool, or read straight from a loan tape csv
+without creating the loans at all, so a tape of a million loans is summarised in well under a second once read.
+
+Everything is of the scheduled (no default) pool at period T, the same as the LoanPool methods: a loan flagged as
+defaulted has no balance, rates are the rates of getRate(T) (0 outside 1..term)
+"""
+from loan.loan_base import Loan
+from loan.mortgage import MortgageMixin
+from loan.loan_pool import loanNameToClass
+import numpy as np
+import logging
+
+
+class PoolAnalytics(object):
+    # loanType and assetClass are the class names of every loan and asset; ages are the months each loan has been
+    # paying before period 0 (seasoning, 0 when not given); variable holds the loans with a variable rate (a dict)
+    # by position, their figures come from the loans themselves
+    def __init__(self, face, rate, term, assetValue, loanType, assetClass, ages=None, defaulted=None, variable=None):
+        self._face = np.asarray(face, dtype=float)
+        self._rate = np.asarray(rate, dtype=float)
+        self._term = np.asarray(term, dtype=float)
+        self._assetValue = np.asarray(assetValue, dtype=float)
+        if not len(self._face) == len(self._rate) == len(self._term) == len(self._assetValue) == len(loanType) \
+                == len(assetClass):
+            logging.error('Every column of the loan tape should have one value per loan')
+            raise ValueError('Every column of the loan tape should have one value per loan')
+        self._loanType, self._loanTypes = self._codes(loanType)
+        self._assetClass, self._assetClasses = self._codes(assetClass)
+        self._ages = np.zeros(len(self._face)) if ages is None else np.asarray(ages, dtype=float)
+        self._defaulted = np.zeros(len(self._face), dtype=bool) if defaulted is None else np.asarray(defaulted, bool)
+        self._variable = variable or {}
+        self._mortgage = np.isin(self._loanType, [code for code, name in enumerate(self._loanTypes)
+                                                  if name in self._mortgageClasses()])
+
+    # The columns of a LoanPool, in one pass over its loans
+    @classmethod
+    def fromLoanPool(cls, loanpool, ages=None):
+        columns = [(loan.face, loan.rate if not isinstance(loan.rate, dict) else 0.0, loan.term,
+                    loan.asset.initialValue, loan.__class__.__name__, loan.asset.__class__.__name__,
+                    loan.default_status) for loan in loanpool]
+        variable = {i: loan for i, loan in enumerate(loanpool) if isinstance(loan.rate, dict)}
+        face, rate, term, asset_value, loan_type, asset_class, defaulted = \
+            zip(*columns) if columns else [()] * 7
+        return cls(face, rate, term, asset_value, loan_type, asset_class, ages, defaulted, variable)
+
+    # The columns of a loan tape csv laid out like 'Loan Test/Loans.csv' (Loan #, Loan Type, Balance, Rate, Term,
+    # Asset, Asset Value), see LoanPool.readLoansFromCSV, without creating the loans. numpy parses the numbers
+    # (a second pass over the file is still far quicker than converting strings); rows without a loan type are
+    # skipped, which leaves blanks the number pass cannot read, so then the numbers come from the strings
+    @classmethod
+    def fromCSV(cls, filename, ages=None):
+        options = dict(delimiter=',', skiprows=1, encoding='utf-8-sig', ndmin=2)
+        names = np.loadtxt(filename, usecols=(1, 5), dtype=str, **options)
+        loans = names[:, 0] != ''
+        try:
+            numbers = np.loadtxt(filename, usecols=(2, 3, 4, 6), **options)[loans]
+        except ValueError:
+            numbers = np.loadtxt(filename, usecols=(2, 3, 4, 6), dtype=str, **options)[loans].astype(float)
+        names = names[loans]
+        for name in set(names[:, 0]):
+            if name not in loanNameToClass:
+                logging.error('Invalid loan type {} in {}'.format(name, filename))
+                raise ValueError('Invalid loan type {} in {}'.format(name, filename))
+        loan_type = [loanNameToClass[name].__name__ for name in names[:, 0]]
+        return cls(numbers[:, 0], numbers[:, 1], numbers[:, 2], numbers[:, 3], loan_type, names[:, 1], ages)
+
+    # integer codes of a column of names and the names in order of their codes
+    @staticmethod
+    def _codes(names):
+        index = {}
+        codes = np.array([index.setdefault(name, len(index)) for name in names], dtype=int)
+        return codes, list(index)
+
+    # the names of the loan classes that pay PMI
+    @staticmethod
+    def _mortgageClasses():
+        classes, names = [MortgageMixin], set()
+        while classes:
+            cls = classes.pop()
+            names.add(cls.__name__)
+            classes.extend(cls.__subclasses__())
+        return names
+
+    # the rate of every loan at T, as Loan.getRate
+    def rates(self, T):
+        rates = np.where((0 < T) & (T <= self._term), self._rate, 0.0)
+        for i, loan in self._variable.items():
+            rates[i] = loan.getRate(T)
+        return rates
+
+    # the balance of every loan at T, as Loan.balance (0 once the loan is flagged as defaulted)
+    def balances(self, T):
+        balances = Loan.calcBalanceArray(self._term, self._rate, self._face, T)
+        for i, loan in self._variable.items():
+            balances[i] = loan.balance(T)
+        return np.where(self._defaulted, 0.0, balances)
+
+    # The total payments of every loan as Loan.totalPayments: the monthly payments of periods 0..term-1 (nothing is
+    # paid at 0) and, for mortgages, the PMI charged in those periods
+    def payments(self):
+        payments = Loan.calcMonthlyPmtArray(self._term, self._rate, self._face) * np.maximum(self._term - 1, 0)
+        if self._mortgage.any():
+            cutoffs = MortgageMixin.calcPMICutoff(self._term[self._mortgage], self._rate[self._mortgage],
+                                                  self._face[self._mortgage], self._assetValue[self._mortgage])
+            months = np.maximum(np.minimum(cutoffs, self._term[self._mortgage]) - 1, 0)
+            payments[self._mortgage] += MortgageMixin.pmiRate * self._face[self._mortgage] * months
+        for i, loan in self._variable.items():
+            payments[i] = loan.totalPayments()
+        return payments
+
+    # face-weighted rate at T, a decimal, without working out the rest of the summary
+    def WAR(self, T=1):
+        return self._weighted(self.rates(T), self._face)
+
+    # face-weighted term in years, as LoanPool.WAM
+    def WAM(self):
+        return self._weighted(self._term / 12, self._face)
+
+    # The pool statistics at period T (the first payment period by default):
+    #   'loans', 'activeLoans' (not defaulted and before their term: the balance left at the term is only rounding,
+    #   which LoanPool.activeLoanCount still counts), 'totalPrincipal', 'balance', 'totalPayments', 'totalInterest',
+    #   'WAR' (face-weighted rate at T, a decimal), 'WAM' (face-weighted term in years, as LoanPool.WAM),
+    #   'WART' (balance-weighted remaining term in months) and 'WALA' (balance-weighted loan age in months)
+    def summary(self, T=1):
+        balances = self.balances(T)
+        total_face, total_balance = self._face.sum(), balances.sum()
+        total_payments = self.payments().sum()
+        return {'loans': len(self._face), 'activeLoans': int(np.count_nonzero((T < self._term) & ~self._defaulted)),
+                'totalPrincipal': float(total_face), 'balance': float(total_balance),
+                'totalPayments': float(total_payments), 'totalInterest': float(total_payments - total_face),
+                'WAR': self.WAR(T), 'WAM': self.WAM(),
+                'WART': self._weighted(np.maximum(self._term - T, 0), balances),
+                'WALA': self._weighted(self._ages + T, balances)}
+
+    # Stratification tables of the pool at period T by 'loanType', 'assetClass', 'rate' (buckets of rateBucket,
+    # keyed by their lower bound) and 'term' (buckets of termBucket months). Every table is a list of
+    # [key, count, balance, share of balance, WAR] rows in order of key, WAR weighted by balance
+    def stratify(self, T=1, rateBucket=0.01, termBucket=12):
+        if rateBucket <= 0 or termBucket <= 0:
+            logging.error('The rate and term buckets should be positive')
+            raise ValueError('The rate and term buckets should be positive')
+        balances, rates = self.balances(T), self.rates(T)
+        rate_bucket = np.floor(self._rate / rateBucket + 1e-9).astype(int)
+        term_bucket = np.floor(self._term / termBucket).astype(int)
+        tables = {'loanType': (self._loanType, self._loanTypes),
+                  'assetClass': (self._assetClass, self._assetClasses),
+                  'rate': self._bucketCodes(rate_bucket, rateBucket),
+                  'term': self._bucketCodes(term_bucket, termBucket)}
+        return {name: self._table(codes, keys, balances, rates) for name, (codes, keys) in tables.items()}
+
+    # codes 0.. of the buckets a column falls in and the lower bound of each bucket
+    @staticmethod
+    def _bucketCodes(buckets, width):
+        keys, codes = np.unique(buckets, return_inverse=True)
+        return codes, [round(float(key * width), 10) for key in keys]
+
+    # one stratification table from the codes of every loan and the key of every code
+    @staticmethod
+    def _table(codes, keys, balances, rates):
+        strata = len(keys)
+        count = np.bincount(codes, minlength=strata)
+        balance = np.bincount(codes, balances, minlength=strata)
+        rate_balance = np.bincount(codes, balances * rates, minlength=strata)
+        total = balance.sum()
+        rows = [[key, int(count[i]), float(balance[i]), float(balance[i] / total) if total > 0 else 0.0,
+                 float(rate_balance[i] / balance[i]) if balance[i] > 0 else 0.0] for i, key in enumerate(keys)]
+        return sorted(rows, key=lambda row: row[0])
+
+    # weighted average, 0 without weight
+    @staticmethod
+    def _weighted(values, weights):
+        total = weights.sum()
+        return float(np.dot(values, weights) / total) if total > 0 else 0.0
+
+    def __len__(self):
+        return len(self._face)
+
+    @property
+    def face(self):
+        return self._face
+
+    @property
+    def rate(self):
+        return self._rate
+
+    @property
+    def term(self):
+        return self._term
+
+    @property
+    def assetValue(self):
+        return self._assetValue
+
+    @property
+    def loanTypes(self):
+        return self._loanTypes
+
+    @property
+    def assetClasses(self):
+        return self._assetClasses
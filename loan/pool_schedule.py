@@ -0,0 +1,404 @@
+"""
+PoolSchedule lays out the no-default cash flows of a LoanPool as numpy arrays: one row per loan and one column per
+period 0..max term. Each default path only changes which rows are still paying, so the pool cash flows of many
+simulation paths can be built from these arrays without calling the loan methods again.
+
+The default periods follow Loan.default_dict, or the CDR curves of the HazardCurves of the pool; with CPR curves
+every loan also draws a prepayment period, and a loan that prepays pays off its balance in that period
+"""
+import numpy as np
+import os
+from loan.loan_base import Loan
+from loan.mortgage import MortgageMixin
+from loan.loan_pool import LoanPool
+
+
+class PoolSchedule(object):
+    # periods pads the schedule to at least that many columns, so schedules of parts of a pool line up
+    # hazard (HazardCurves) replaces the hazard curves of the pool
+    def __init__(self, loanpool, periods=None, hazard=None):
+        loans = list(loanpool)
+        self._periods = max(int(max((loan.term for loan in loans), default=0)) + 1, periods or 0)
+        T = np.arange(self._periods)
+        shape = (len(loans), self._periods)
+        self._payment = np.zeros(shape)  # monthly payment, PMI included
+        self._principal = np.zeros(shape)  # principal due
+        self._interest = np.zeros(shape)  # interest due
+        self._lastActive = np.zeros(len(loans), dtype=int)  # last period with a balance above 0
+        self._face = np.array([loan.face for loan in loans], dtype=float)
+
+        # fixed rate loans are amortized column-wise in one go, anything else asks the loan itself
+        fixed = np.array([not isinstance(loan.rate, dict) for loan in loans], dtype=bool)
+        if fixed.any():
+            terms = np.array([loan.term for loan in loans], dtype=float)[fixed]
+            rates = np.array([loan.rate if not isinstance(loan.rate, dict) else 0 for loan in loans])[fixed]
+            faces = np.array([loan.face for loan in loans], dtype=float)[fixed]
+            paying = (T >= 1) & (T <= terms[:, None])
+            pmt = Loan.calcMonthlyPmtArray(terms, rates, faces)[:, None]
+            # interest due at T is charged on the balance at T - 1
+            interest = Loan.monthlyRate(rates)[:, None] * Loan.calcBalanceArray(terms[:, None], rates[:, None],
+                                                                              faces[:, None], T - 1)
+            self._interest[fixed] = np.where(paying, interest, 0)
+            self._principal[fixed] = np.where(paying, pmt - interest, 0)
+            self._payment[fixed] = np.where(paying, pmt, 0)
+            balance_at_term = Loan.calcBalanceArray(terms, rates, faces, terms)
+            self._lastActive[fixed] = np.where(balance_at_term > 0, terms, terms - 1)
+        for i, loan in enumerate(loans):
+            if not fixed[i]:
+                self._interest[i] = [loan.interestDue(t) for t in T]
+                self._principal[i] = [loan.principalDue(t) for t in T]
+                self._payment[i] = [loan.monthlyPayment(t) if t > 0 else 0 for t in T]
+                self._lastActive[i] = max((t for t in T if loan.balance(t) > 0), default=0)
+        # mortgages pay PMI on top of the amortizing payment
+        if any(isinstance(loan, MortgageMixin) for loan in loans):
+            pmi = loanpool.PMISchedule()
+            self._payment[fixed, :pmi.shape[1]] += pmi[fixed]
+
+        # the recovery value if the loan defaults at T: asset value at T times the recovery multiplier
+        # loans keep being checked for default after they mature, so this runs over every period
+        self._values = np.array([loan.asset.initialValue for loan in loans], dtype=float)
+        self._depreciation = np.array([loan.asset.monthlyDeprRate() for loan in loans], dtype=float)
+        self._recovery = self.recoverySchedule()
+
+        # monthly default and prepayment rates by group of loans with the same curves (one group without hazard
+        # curves), and the cumulative probability of having defaulted by the end of each period
+        hazard = hazard if hazard is not None else getattr(loanpool, 'hazard', None)
+        if hazard is None:
+            self._group = np.zeros(len(loans), dtype=int)
+            curves = [(None, None)]
+        else:
+            self._group, curves = hazard.groups(loans, self._periods)
+        self._defaultHazard = np.array([LoanPool.defaultProbabilities(self._periods) if default is None else default
+                                        for default, _ in curves]).reshape(-1, self._periods)
+        self._defaultCDF = self.hazardCDF(self._defaultHazard)
+        if any(prepay is not None for _, prepay in curves):
+            self._prepayCDF = self.hazardCDF(np.array([prepay if prepay is not None else np.zeros(self._periods)
+                                                       for _, prepay in curves]))
+        else:
+            self._prepayCDF = None
+        self._balance = None  # scheduled balance, built when first needed
+
+    # move the loans x periods arrays (payment, principal, interest, recovery and the scheduled balance) to
+    # memory-mapped .npy files in directory, read-only, so the schedules of many parts of a pool can be kept without
+    # holding them in memory; returns self
+    def spill(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self._balance = self.balance
+        for name in ('payment', 'principal', 'interest', 'recovery', 'balance'):
+            path = os.path.join(directory, name + '.npy')
+            np.save(path, getattr(self, '_' + name))
+            setattr(self, '_' + name, np.load(path, mmap_mode='r'))
+        return self
+
+    # cumulative probability of the event by the end of each period from monthly rates (groups x periods), the
+    # rates times tilt (capped below 1) with a tilt, the same as LoanPool.defaultCDF
+    @staticmethod
+    def hazardCDF(rates, tilt=1.0):
+        rates = np.minimum(rates * tilt, 0.999) if tilt != 1.0 else rates
+        return 1 - np.cumprod(1 - rates, axis=-1)
+
+    # The recovery value of every loan if it defaults at T (loans x periods) with the given recovery multiplier
+    # (Loan.recovery_multiplier by default) and the monthly depreciation rates of the assets times depreciationScale
+    def recoverySchedule(self, multiplier=None, depreciationScale=1.0):
+        multiplier = multiplier if multiplier is not None else Loan.recovery_multiplier
+        T = np.arange(self._periods)
+        return self._values[:, None] * (1 - self._depreciation[:, None] * depreciationScale) ** T * multiplier
+
+    # The recovery cash of each path (paths x periods) for the default periods of shape (paths, loans) and a
+    # recovery schedule like recoverySchedule(); the recovery part of the cash that poolCashFlows gives
+    def recoveryCash(self, default_times, recovery):
+        default_times = np.atleast_2d(default_times)
+        cash = np.zeros((len(default_times), self._periods))
+        path, loan = np.nonzero(default_times < self._periods)
+        period = default_times[path, loan]
+        np.add.at(cash, (path, period), recovery[loan, period])
+        return cash
+
+    # the default period of every loan from uniforms of shape (paths, loans), see LoanPool.defaultTimes;
+    # loans that survive the whole schedule get period = number of periods, i.e. never
+    # with a tilt the default probabilities are scaled up, see logLikelihoodRatio
+    def defaultTimes(self, uniforms, tilt=1.0):
+        cdf = self._defaultCDF if tilt == 1.0 else self.hazardCDF(self._defaultHazard, tilt)
+        return self._eventTimes(uniforms, cdf)
+
+    # the prepayment period of every loan from uniforms of shape (paths, loans), the same way; a loan can only
+    # prepay while it has a balance, so later periods mean never
+    def prepaymentTimes(self, uniforms):
+        prepay_times = self._eventTimes(uniforms, self._prepayCDF)
+        return np.where(prepay_times <= self._lastActive, prepay_times, self._periods)
+
+    def _eventTimes(self, uniforms, cdf):
+        if len(cdf) == 1:
+            return LoanPool.defaultTimes(uniforms, self._periods, cdf[0])
+        times = np.empty(np.shape(uniforms), dtype=int)
+        for group in range(len(cdf)):
+            members = self._group == group
+            times[..., members] = LoanPool.defaultTimes(uniforms[..., members], self._periods, cdf[group])
+        return times
+
+    # The default and prepayment periods of every loan from uniforms of shape (paths, randomsPerPath): the first
+    # column of each loan places its default and, with prepayment, the next ones its prepayment. Whichever comes
+    # first ends the loan, a default in the same period wins, and the other is set to never.
+    # Returns (default_times, prepay_times), prepay_times is None without prepayment
+    def eventTimes(self, uniforms, tilt=1.0):
+        loans = len(self._lastActive)
+        return self.competingRisks(self.defaultTimes(uniforms[..., :loans], tilt), uniforms[..., loans:2 * loans])
+
+    # the default periods of defaultTimes against the prepayment periods of the uniforms (paths, loans), as
+    # eventTimes; returns (default_times, None) without prepayment
+    def competingRisks(self, default_times, uniforms):
+        if self._prepayCDF is None:
+            return default_times, None
+        prepay_times = self.prepaymentTimes(uniforms)
+        prepay_times = np.where(prepay_times < default_times, prepay_times, self._periods)
+        return np.where(prepay_times < self._periods, self._periods, default_times), prepay_times
+
+    # The probability that each loan defaults in period t, prepays in period t (both loans x periods) and that it
+    # does neither (loans): the competing risks of eventTimes, where a default in the same period wins and a loan
+    # only prepays while it has a balance
+    def outcomeProbabilities(self):
+        default_cdf = self._defaultCDF[self._group]
+        default = np.diff(default_cdf, prepend=0, axis=1)
+        prepay = np.zeros(default.shape)
+        if self._prepayCDF is not None:
+            prepay_cdf = self._prepayCDF[self._group]
+            T = np.arange(self._periods)
+            last = self._lastActive[:, None]
+            prepay_cdf = np.where(T <= last, prepay_cdf, np.take_along_axis(prepay_cdf, last, axis=1))
+            not_prepaid_before = np.concatenate([np.ones((len(prepay_cdf), 1)), 1 - prepay_cdf[:, :-1]], axis=1)
+            default = default * not_prepaid_before
+            prepay = np.diff(prepay_cdf, prepend=0, axis=1) * (1 - default_cdf)
+        never = np.maximum(1 - default.sum(axis=1) - prepay.sum(axis=1), 0)
+        return default, prepay, never
+
+    # The expected pool cash flows over the default (and prepayment) distribution, as one path of poolCashFlows:
+    # every scheduled payment weighted by the probability that the loan has not ended before that period, plus the
+    # recovery values and prepaid balances weighted by the probability of the loan ending that way then.
+    # Returns cash available and principal due (1 x periods) and the last period (1), the last active period
+    # collateral=True also returns the expected pool balance (1 x periods), like poolBalance: every scheduled balance
+    # weighted by the probability that the loan has not ended by the end of that period
+    def expectedCashFlows(self, collateral=False):
+        default, prepay, _ = self.outcomeProbabilities()
+        ended = np.cumsum(default + prepay, axis=1)
+        # a loan pays in the period it ends in, and its principal is due until it defaults or after it prepays
+        paying = 1 - (ended - default - prepay)
+        principal_due = 1 - (ended - prepay)
+        cash = (self._payment * paying + self._recovery * default).sum(axis=0)
+        principal = (self._principal * principal_due).sum(axis=0)
+        if self._prepayCDF is not None:
+            cash += (self.balance * prepay).sum(axis=0)
+            principal += (self.balance * prepay).sum(axis=0)
+        last_period = np.array([max(self._lastActive.max(initial=0), 1)])
+        if collateral:
+            return cash[None, :], principal[None, :], last_period, (self.balance * (1 - ended)).sum(axis=0)[None, :]
+        return cash[None, :], principal[None, :], last_period
+
+    # Log of the likelihood ratio of each path, nominal over tilted default probabilities, for default periods drawn
+    # with defaultTimes(uniforms, tilt). Weighting each path by exp() of it makes averages over tilted paths unbiased
+    # estimates of the nominal ones
+    def logLikelihoodRatio(self, default_times, tilt):
+        default_times = np.atleast_2d(default_times)
+
+        # log probability of every outcome: defaulting in period 1..periods-1, or never (the last entry)
+        def logOutcomes(cdf):
+            with np.errstate(divide='ignore'):
+                return np.log(np.append(np.diff(cdf), 1 - cdf[-1]))
+
+        log_ratio = np.array([logOutcomes(cdf) - logOutcomes(tilted) for cdf, tilted
+                              in zip(self._defaultCDF, self.hazardCDF(self._defaultHazard, tilt))])
+        # outcomes are indexed from period 1, so default period d is entry d - 1 and never is the last entry
+        return log_ratio[self._group, default_times - 1].sum(axis=1)
+
+    # Build the pool cash flows of each path from the default periods of shape (paths, loans).
+    # A loan pays in full up to and including the period it defaults in, the recovery value comes in that period,
+    # and it is out of the principal due from then on (the same order doWaterfall uses).
+    # Returns the cash available, the principal due (both paths x periods) and the last period of each path,
+    # which is the last period that still starts with an active loan
+    # out = (cash, principal) writes into preallocated arrays instead of new ones, and a scratch array of
+    # events x periods bounds the memory of the default events: they are taken that many at a time
+    # prepay_times (see eventTimes): a loan pays its scheduled payment and the rest of its balance (as principal) in
+    # the period it prepays, and nothing after
+    def poolCashFlows(self, default_times, out=None, scratch=None, prepay_times=None):
+        default_times = np.atleast_2d(default_times)
+        if out is None:
+            out = (np.empty((len(default_times), self._periods)), np.empty((len(default_times), self._periods)))
+        cash, principal = out
+        cash[:] = self._payment.sum(axis=0)
+        principal[:] = self._principal.sum(axis=0)
+        path, loan = np.nonzero(default_times < self._periods)  # the default events
+        prepaid_path, prepaid_loan = np.nonzero(prepay_times < self._periods) if prepay_times is not None \
+            else (path[:0], loan[:0])
+        if scratch is None:
+            scratch = np.empty((max(len(path), len(prepaid_path)), self._periods))
+        self._removeEvents(cash, principal, path, loan, default_times[path, loan], False, scratch)
+        prepaid_period = prepay_times[prepaid_path, prepaid_loan] if prepay_times is not None else path[:0]
+        self._removeEvents(cash, principal, prepaid_path, prepaid_loan, prepaid_period, True, scratch)
+        period = default_times[path, loan]
+        np.add.at(cash, (path, period), self._recovery[loan, period])
+        if len(prepaid_path):
+            prepaid = self.balance[prepaid_loan, prepaid_period]
+            np.add.at(cash, (prepaid_path, prepaid_period), prepaid)
+            np.add.at(principal, (prepaid_path, prepaid_period), prepaid)
+            default_times = np.minimum(default_times, prepay_times)
+        last_period = np.maximum(np.minimum(self._lastActive, default_times).max(axis=1, initial=0), 1)
+        return cash, principal, last_period
+
+    # take the scheduled payments after the period of each event out of cash, and the principal due from the
+    # period of a default (after the period of a prepayment) on out of principal, a block of scratch rows at a time
+    def _removeEvents(self, cash, principal, path, loan, period, prepaid, scratch):
+        T = np.arange(self._periods)
+        block = max(len(scratch), 1)
+        for low in range(0, len(path), block):
+            block_path, block_loan, block_period = path[low:low + block], loan[low:low + block], \
+                period[low:low + block, None]
+            lost = scratch[:len(block_path)]
+            np.take(self._payment, block_loan, axis=0, out=lost)
+            lost *= T > block_period
+            np.subtract.at(cash, block_path, lost)
+            np.take(self._principal, block_loan, axis=0, out=lost)
+            lost *= (T > block_period) if prepaid else (T >= block_period)
+            np.subtract.at(principal, block_path, lost)
+
+    # The pool series of one path from the default (and prepayment) period of every loan, each an array over the
+    # periods: 'payment' (scheduled payments made), 'principal' (principal due), 'interest', 'recovery',
+    # 'prepayment' (balances paid off), 'active' (loans still paying) and 'balance' (the pool balance), in the order
+    # of poolCashFlows and poolBalance: cash available is payment + recovery + prepayment, principal due is
+    # principal + prepayment. The rows of the loans are summed by the period they end in, so the cost is one pass
+    # over the schedule whatever the number of defaults, and the series of parts of a pool add up to the whole
+    def pathAggregates(self, default_times, prepay_times=None):
+        T = np.arange(self._periods)
+        loans = np.arange(len(default_times))
+        ends = np.minimum(default_times if prepay_times is None else np.minimum(default_times, prepay_times),
+                          self._periods)
+        order = np.argsort(ends, kind='stable')
+        periods, starts = np.unique(ends[order], return_index=True)
+
+        # the rows of every loan that is still in the pool in period T: ending in T or after (through) or after T
+        def still(rows, through=True):
+            by_end = np.zeros((self._periods + 1, self._periods))  # the rows summed by end period, last = never
+            if len(order):
+                by_end[periods] = np.add.reduceat(rows[order], starts, axis=0)
+            from_end = np.cumsum(by_end[::-1], axis=0)[::-1]
+            return from_end[T if through else T + 1, T]
+
+        defaulted = loans[default_times < self._periods]
+        prepaid = loans[prepay_times < self._periods] if prepay_times is not None else loans[:0]
+        default_period, prepay_period = default_times[defaulted], prepay_times[prepaid] if len(prepaid) else \
+            loans[:0]
+        # a defaulting loan pays in its period but its principal is not due any more
+        principal = still(self._principal) - np.bincount(default_period, self._principal[defaulted, default_period],
+                                                         minlength=self._periods)
+        last = np.minimum(self._lastActive, ends)
+        return {'payment': still(self._payment), 'principal': principal, 'interest': still(self._interest),
+                'recovery': np.bincount(default_period, self._recovery[defaulted, default_period],
+                                        minlength=self._periods),
+                'prepayment': np.bincount(prepay_period, self.balance[prepaid, prepay_period],
+                                          minlength=self._periods),
+                'active': np.cumsum(np.bincount(last, minlength=self._periods)[::-1])[::-1],
+                'balance': still(self.balance, through=False)}
+
+    # The pool balance (collateral) of each path in every period, paths x periods, as doWaterfall sees it after the
+    # defaults of the period: the scheduled balances of the loans that have not defaulted yet
+    # a loan that prepays has no balance from that period on
+    def poolBalance(self, default_times, prepay_times=None):
+        default_times = np.atleast_2d(default_times)
+        if prepay_times is not None:
+            default_times = np.minimum(default_times, prepay_times)
+        T = np.arange(self._periods)
+        scheduled = self.balance
+        balance = np.tile(scheduled.sum(axis=0), (len(default_times), 1))
+        path, loan = np.nonzero(default_times < self._periods)
+        if len(path):
+            period = default_times[path, loan]
+            np.add.at(balance, path, np.where(T >= period[:, None], -scheduled[loan], 0))
+        return balance
+
+    # The waterfall of every loan on one path, like LoanPool.getWaterfall for each period: periods x loans x
+    # [balance, monthly payment, principal due, interest due]. A loan shows nothing from the period it defaults in,
+    # and in the period it prepays its payment and principal include the balance it pays off
+    def loanWaterfall(self, default_times, prepay_times=None):
+        T = np.arange(self._periods)
+        prepay_times = prepay_times if prepay_times is not None else np.full(len(default_times), self._periods)
+        alive = (T < default_times[:, None]) & (T <= prepay_times[:, None])
+        prepaid = np.where(T == prepay_times[:, None], self.balance, 0)
+        balance = np.where(alive & (T < prepay_times[:, None]), self.balance, 0)
+        balance[:, 0] = self._face
+        return np.stack([balance, np.where(alive, self._payment + prepaid, 0),
+                         np.where(alive, self._principal + prepaid, 0), np.where(alive, self._interest, 0)],
+                        axis=2).transpose(1, 0, 2)
+
+    # Number of loans that default on each path (before the schedule runs out), and its analytic expectation
+    def defaultCount(self, default_times):
+        return (np.atleast_2d(default_times) < self._periods).sum(axis=1)
+
+    def expectedDefaultCount(self):
+        return np.bincount(self._group, minlength=len(self._defaultCDF)) @ self._defaultCDF[:, -1]
+
+    # Pool loss on each path: for every default, the scheduled payments the loan no longer makes less its recovery
+    # value; and its analytic expectation over the default period distribution
+    def defaultLoss(self, default_times):
+        default_times = np.atleast_2d(default_times)
+        path, loan = np.nonzero(default_times < self._periods)
+        loss = np.zeros(len(default_times))
+        np.add.at(loss, path, self._lossOnDefault()[loan, default_times[path, loan]])
+        return loss
+
+    def expectedDefaultLoss(self):
+        # probability of defaulting in each period
+        default_probability = np.diff(self._defaultCDF, prepend=0, axis=1)[self._group]
+        return (self._lossOnDefault() * default_probability).sum()
+
+    # loans x periods: the loss if the loan defaults in that period
+    def _lossOnDefault(self):
+        remaining = np.cumsum(self._payment[:, ::-1], axis=1)[:, ::-1] - self._payment  # paid after that period
+        return remaining - self._recovery
+
+    @property
+    def periods(self):
+        return self._periods
+
+    @property
+    def payment(self):
+        return self._payment
+
+    @property
+    def principal(self):
+        return self._principal
+
+    @property
+    def interest(self):
+        return self._interest
+
+    @property
+    def recovery(self):
+        return self._recovery
+
+    @property
+    def lastActive(self):
+        return self._lastActive
+
+    # scheduled balance of every loan at the end of each period (no defaults or prepayments)
+    @property
+    def balance(self):
+        if self._balance is None:
+            self._balance = np.maximum(self._face[:, None] - np.cumsum(self._principal, axis=1), 0)
+        return self._balance
+
+    # the group of every loan and the cumulative default (and prepayment, None without) probability of each group,
+    # groups x periods
+    @property
+    def group(self):
+        return self._group
+
+    @property
+    def defaultCDF(self):
+        return self._defaultCDF
+
+    @property
+    def prepayCDF(self):
+        return self._prepayCDF
+
+    # uniforms every path needs for eventTimes: one per loan, two with prepayment
+    @property
+    def randomsPerPath(self):
+        return len(self._lastActive) * (2 if self._prepayCDF is not None else 1)
@@ -0,0 +1,133 @@
+"""
+LTV and equity surfaces of a pool: the scheduled balance over the depreciated asset value of every loan in every
+period (loans x periods), and the equity left over, as Loan.equity does it one loan and period at a time. The
+surfaces are built a block of loans at a time from the amortization (Loan.calcBalanceArray) and depreciation tables,
+so they can be written into an array on disk (e.g. numpy.lib.format.open_memmap) or only summarised per period by
+SurfaceStatistics, without the whole matrix ever being in memory.
+
+SurfaceStatistics keeps per-period sums and a histogram of the LTV of the loans still active in each period, so two
+summaries of different loans merge into the summary of both
+"""
+from loan.loan_base import Loan
+import numpy as np
+import logging
+
+# loans per block of the surfaces
+BLOCK_LOANS = 4096
+# the LTV bins of the per-period distributions: 0 to 200% by 5%, an LTV above the last edge counts in the last bin
+ltvBins = np.linspace(0, 2, 41)
+
+
+# The scheduled balance and asset value of the loans in periods T, two arrays of loans x periods. Balances are as
+# Loan.balance (0 after the term or once the loan is flagged as defaulted), values as Asset.value. A loan is paid off
+# at its term: the rounding the closed form leaves there (either sign) is taken as 0, so it is not an active loan
+def balancesAndValues(loans, T):
+    fixed = np.array([not isinstance(loan.rate, dict) for loan in loans], dtype=bool)
+    terms = np.array([loan.term for loan in loans], dtype=float)[:, None]
+    rates = np.array([loan.rate if fixed[i] else 0.0 for i, loan in enumerate(loans)], dtype=float)[:, None]
+    faces = np.array([loan.face for loan in loans], dtype=float)[:, None]
+    balance = Loan.calcBalanceArray(terms, rates, faces, T)
+    for i in np.nonzero(~fixed)[0]:
+        balance[i] = [loans[i].balance(t) for t in T]
+    balance[(T == terms) | np.array([loan.default_status for loan in loans], dtype=bool)[:, None]] = 0
+    values = np.array([loan.asset.initialValue for loan in loans], dtype=float)[:, None]
+    depreciation = np.array([loan.asset.monthlyDeprRate() for loan in loans], dtype=float)[:, None]
+    return balance, values * (1 - depreciation) ** T
+
+
+# LTV (balance / asset value, inf for a balance on no value) and equity (asset value less balance, not below 0)
+def ltvAndEquity(balance, value):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ltv = np.where(value > 0, balance / value, np.where(balance > 0, np.inf, 0.0))
+    return ltv, np.maximum(value - balance, 0)
+
+
+# (first loan, balance, value) of every block of blockLoans loans over periods 0..periods-1
+def surfaceBlocks(loans, periods, blockLoans=BLOCK_LOANS):
+    T = np.arange(periods)
+    for low in range(0, len(loans), blockLoans):
+        yield (low,) + balancesAndValues(loans[low:low + blockLoans], T)
+
+
+class SurfaceStatistics(object):
+    # per-period statistics over periods periods of the loans added; bins are the edges of the LTV histogram
+    def __init__(self, periods, bins=None):
+        self._periods = periods
+        self._bins = np.asarray(bins if bins is not None else ltvBins, dtype=float)
+        if len(self._bins) < 2 or np.any(np.diff(self._bins) <= 0):
+            logging.error('The LTV bins should be at least two increasing edges')
+            raise ValueError('The LTV bins should be at least two increasing edges')
+        self._sums = {name: np.zeros(periods) for name in ('active', 'balance', 'value', 'equity', 'underwater',
+                                                            'underwaterBalance', 'negativeEquity', 'balanceLTV')}
+        self._histogram = np.zeros((periods, len(self._bins) - 1))
+
+    # add the balance and value (loans x periods) of a block of loans; only the loans with a balance count
+    def add(self, balance, value):
+        active = balance > 0
+        underwater = active & (balance > value)
+        ltv, equity = ltvAndEquity(balance, value)
+        self._sums['active'] += active.sum(axis=0)
+        self._sums['balance'] += balance.sum(axis=0)
+        self._sums['value'] += np.where(active, value, 0).sum(axis=0)
+        self._sums['equity'] += np.where(active, equity, 0).sum(axis=0)
+        self._sums['underwater'] += underwater.sum(axis=0)
+        self._sums['underwaterBalance'] += np.where(underwater, balance, 0).sum(axis=0)
+        self._sums['negativeEquity'] += np.where(underwater, balance - value, 0).sum(axis=0)
+        self._sums['balanceLTV'] += np.where(active & np.isfinite(ltv), balance * ltv, 0).sum(axis=0)
+        bins = len(self._bins) - 1
+        index = np.clip(np.searchsorted(self._bins, ltv, side='right') - 1, 0, bins - 1)
+        period = np.broadcast_to(np.arange(self._periods), ltv.shape)
+        self._histogram += np.bincount((period * bins + index)[active],
+                                       minlength=self._periods * bins).reshape(self._periods, bins)
+        return self
+
+    # the statistics of both sets of loans; the other one is not changed
+    def merge(self, other):
+        for name in self._sums:
+            self._sums[name] += other._sums[name]
+        self._histogram += other._histogram
+        return self
+
+    # the q quantile of the LTV of the active loans in every period, from the histogram (linear within a bin)
+    def quantile(self, q):
+        cumulative = np.cumsum(self._histogram, axis=1)
+        total = cumulative[:, -1]
+        target = q * total
+        index = np.minimum((cumulative < target[:, None]).sum(axis=1), len(self._bins) - 2)
+        before = np.where(index > 0, cumulative[np.arange(self._periods), index - 1], 0)
+        count = self._histogram[np.arange(self._periods), index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            within = np.where(count > 0, (target - before) / count, 0)
+        quantile = self._bins[index] + within * (self._bins[index + 1] - self._bins[index])
+        return np.where(total > 0, quantile, np.nan)
+
+    # arrays over the periods: 'active' loans, their 'balance', asset 'value' and 'equity', the 'underwater' loans
+    # (balance above the asset value), the 'underwaterShare' of the active loans and 'underwaterBalanceShare' of the
+    # balance, the 'negativeEquity' of the underwater loans, the 'poolLTV' (balance / value), the balance-weighted
+    # 'WALTV' and the LTV quantiles ('LTV 50%', ...)
+    def summary(self, quantiles=(0.5, 0.9, 0.99)):
+        sums = self._sums
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = {name: sums[name] for name in ('active', 'balance', 'value', 'equity', 'underwater',
+                                                    'negativeEquity')}
+            result['underwaterShare'] = np.where(sums['active'] > 0, sums['underwater'] / sums['active'], 0.0)
+            result['underwaterBalanceShare'] = np.where(sums['balance'] > 0,
+                                                        sums['underwaterBalance'] / sums['balance'], 0.0)
+            result['poolLTV'] = np.where(sums['value'] > 0, sums['balance'] / sums['value'], 0.0)
+            result['WALTV'] = np.where(sums['balance'] > 0, sums['balanceLTV'] / sums['balance'], 0.0)
+        for q in quantiles:
+            result['LTV {:g}%'.format(q * 100)] = self.quantile(q)
+        return result
+
+    @property
+    def periods(self):
+        return self._periods
+
+    @property
+    def bins(self):
+        return self._bins
+
+    # active loans per period (rows) and LTV bin (columns)
+    @property
+    def histogram(self):
+        return self._histogram
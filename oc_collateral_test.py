@@ -0,0 +1,85 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from liabilities.waterfall_spec import WaterfallSpec
+from simulations.chunked_simulation import simulateWaterfallChunked
+from simulations.pool_paths import simulatePoolPaths
+from simulations.result_cache import ResultCache
+from simulations.scenario_grid import runScenarioGrid
+from simulations.simulation_distributed import SimulationCoordinator, startLocalWorkers, runSimulationDistributed
+import numpy as np
+import logging
+import os
+import tempfile
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check that a waterfall spec with an OC test runs wherever the pool paths are built: the scenario
+grid, the result cache (also when the paths of the pool were cached without their balance before), the chunked
+simulation (with chunks of loans, whose balances are added up) and the distributed workers all give the averages of
+simulatePoolPaths(..., collateral=True) with the same seed
+'''
+
+NSIM = 200  # number of paths
+SEED = 2040  # master seed of the paths
+LOANS = 300  # loans of the csv used
+TOLERANCE = 1e-9  # largest difference allowed in DIRR and AL
+TRANCHES = [(0.8, 0.05, 0), (0.2, 0.08, 1)]
+# the senior tranche takes all the cash left while its OC is below 1.3
+STEPS = [{'pay': 'interest'}, {'pay': 'principal'}, {'pay': 'turbo', 'tranches': [0], 'when': ('OC', 0, 1.3)}]
+BUDGET = 2 ** 18  # memory budget of the chunked simulation in bytes, small enough to split the loans
+
+
+def securities(loanpool, spec=True):
+    structured_securities = StructuredSecurities(loanpool.totalPrincipal())
+    for face_percent, rate, subordination in TRANCHES:
+        structured_securities.addTranche(face_percent, rate, subordination)
+    if spec:
+        structured_securities.spec = WaterfallSpec(STEPS, 'OC turbo')
+    return structured_securities
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    reference = np.array(simulatePoolPaths(pool1, NSIM, seed=SEED, collateral=True).averageDIRR_AL(securities(pool1)))
+    plain = np.array(simulatePoolPaths(pool1, NSIM, seed=SEED).averageDIRR_AL(securities(pool1, False)))
+    print(f'OC turbo: {reference.tolist()}')
+    print(f'without the spec: {plain.tolist()}')
+    results = {}
+
+    table = runScenarioGrid(pool1, [{'tranches': TRANCHES}, {'tranches': TRANCHES, 'spec': STEPS}], NSIM, 2, SEED)
+    results['runScenarioGrid'] = [row[5:7] for row in table if row[0] == 1]
+
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory)
+        # the paths are cached without their balance first
+        cache.simulateWaterfall(pool1, securities(pool1, False), NSIM, SEED)
+        results['ResultCache'] = cache.simulateWaterfall(pool1, securities(pool1), NSIM, SEED)
+        cache.close()
+
+    results['simulateWaterfallChunked'] = simulateWaterfallChunked(pool1, securities(pool1), NSIM, BUDGET, SEED)
+
+    coordinator = SimulationCoordinator(pool1, shardSize=50)
+    workers = startLocalWorkers(coordinator, 2)
+    results['runSimulationDistributed'] = runSimulationDistributed(coordinator, securities(pool1), NSIM, SEED)
+    coordinator.stopWorkers(len(workers))
+    for worker in workers:
+        worker.join()
+
+    failures = []
+    for name, result in results.items():
+        diff = np.abs(np.array(result, dtype=float) - reference).max()
+        print(f'{name:<28s}{diff:.3e}')
+        failures += [name] if diff > TOLERANCE else []
+    if np.abs(reference - plain).max() < TOLERANCE:
+        failures.append('the OC test never turns on')
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('Every path builder keeps the pool balance for the OC test')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from simulations.path_store import PathStore
+from simulations.pool_paths import simulatePoolPaths
+from simulations.simulate_waterfall import simulatePathMetrics
+from simulations.simulation_parallel import runSimulationParallel
+from utils.waterfall import doWaterfall
+import numpy as np
+import logging
+import os
+import tempfile
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the PathStore: the metrics simulateWaterfall records are the ones it returns, the flows of a
+stored path are the flows of doWaterfall rerun on that path, runSimulationParallel records the same store from its
+processes (paths numbered from a start that is not 0), PoolPaths.pathDIRR_AL records the same flows as the
+loan-by-loan waterfall, and worstPaths gives the paths with the worst metrics of a tranche, worst first
+'''
+
+NSIM = 30  # number of paths
+START = 100  # number of the first path
+SEED = 2036  # master seed of the paths
+LOANS = 100  # loans of the csv used
+TOLERANCE = 1e-9  # largest difference allowed in flows and metrics
+ARRAYS = ['interest', 'principal', 'balance', 'metrics', 'lastPeriod']  # arrays of a store compared
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    schedule = PoolSchedule(pool1)
+    failures = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        serial = PathStore.create(os.path.join(directory, 'serial'), NSIM, structured_securities, schedule.periods,
+                                  SEED, START)
+        path_metrics = simulatePathMetrics(pool1, structured_securities, NSIM, SEED, START, store=serial)
+        diff = np.abs(serial.metrics[:, :, :2] - path_metrics).max()
+        print(f'recorded against returned metrics: {diff:.3e}')
+        failures += ['metrics'] if diff > TOLERANCE else []
+
+        # rerun the loans of one path and compare its tranche flows, periods x tranches x [balance, ..., principal]
+        diff = 0.0
+        for path in [START, START + NSIM // 2, START + NSIM - 1]:
+            pool1.reset()
+            structured_securities.reset()
+            pool1.drawDefaults(SEED, path)
+            waterfall = np.array(doWaterfall(pool1, structured_securities)[1], dtype=float)
+            stored = PathStore(os.path.join(directory, 'serial')).path(path)
+            last = stored['lastPeriod'] + 1
+            diff = max(diff, np.abs(stored['interest'][:, :last] - waterfall[:, :, 2].T).max(),
+                       np.abs(stored['principal'][:, :last] - waterfall[:, :, 4].T).max(),
+                       np.abs(stored['balance'][:, :last] - waterfall[:, :, 0].T).max(),
+                       float(last != len(waterfall)))
+        print(f'stored paths against doWaterfall: {diff:.3e}')
+        failures += ['flows'] if diff > TOLERANCE else []
+
+        parallel = PathStore.create(os.path.join(directory, 'parallel'), NSIM, structured_securities,
+                                    schedule.periods, SEED, START)
+        runSimulationParallel(pool1, structured_securities, NSIM, 3, SEED, START, store=parallel)
+        parallel = PathStore(os.path.join(directory, 'parallel'))
+        diff = max(np.abs(getattr(parallel, name) - getattr(serial, name)).max() for name in ARRAYS)
+        print(f'runSimulationParallel store against simulateWaterfall store: {diff:.3e}')
+        failures += ['parallel'] if diff > TOLERANCE else []
+
+        arrays = PathStore.create(os.path.join(directory, 'arrays'), NSIM, structured_securities, schedule.periods,
+                                  SEED, START)
+        simulatePoolPaths(pool1, NSIM, schedule, seed=SEED, start=START).pathDIRR_AL(structured_securities,
+                                                                                   store=arrays, start=START)
+        diff = max(np.abs(getattr(arrays, name) - getattr(serial, name)).max() for name in ARRAYS)
+        print(f'PoolPaths store against simulateWaterfall store: {diff:.3e}')
+        failures += ['PoolPaths'] if diff > TOLERANCE else []
+
+        for tranche in range(2):
+            for metric, column in [('DIRR', 0), ('AL', 1), ('loss', 2)]:
+                worst = serial.worstPaths(tranche, 0.1, metric)
+                values = serial.metrics[:, tranche, column]
+                expected = np.sort(values)[::-1][:len(worst)]
+                if len(worst) != 3 or not np.array_equal(values[worst - START], expected):
+                    failures.append('worstPaths of tranche {} by {}'.format(tranche, metric))
+        del serial, parallel, arrays
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The stored paths are the simulated ones')
+
+
+if __name__ == '__main__':
+    main()
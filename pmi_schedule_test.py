@@ -0,0 +1,73 @@
+from asset.asset_houses import PrimaryHome
+from asset.asset_cars import Car
+from loan.mortgage import FixedMortgage
+from loan.auto_loan import AutoLoan
+from loan.loan_base import Loan
+from loan.loan_pool import LoanPool
+import numpy as np
+import logging
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the precomputed PMI of the mortgages against the LTV of every period: the cutoff
+(MortgageMixin.calcPMICutoff) is the first period whose balance is at most 80% of the home value, found here by
+walking the balance of every period, and the vectorized LoanPool.PMISchedule is the same as asking every loan
+for its PMI() period by period. The balance and payment arrays (Loan.calcBalanceArray, calcMonthlyPmtArray) are
+compared with calcBalance and calcMonthlyPmt too
+'''
+
+TOLERANCE = 1e-6  # largest difference allowed in balances and payments
+
+
+def main():
+    rng = np.random.default_rng(26)
+    loans = []
+    for i in range(200):
+        term = int(rng.choice([60, 120, 180, 360]))
+        rate = float(rng.choice([0.02, 0.045, 0.07, 0.12]))
+        face = float(rng.uniform(50000, 500000))
+        # home values from well under to well over the face, so some loans never pay PMI and some always do
+        loans.append(FixedMortgage(term, rate, face, PrimaryHome(face * float(rng.uniform(0.9, 1.6)))))
+    loans += [AutoLoan(60, 0.05, 20000, Car(25000)) for _ in range(5)]
+    pool1 = LoanPool(loans)
+
+    failures = []
+    for i, loan in enumerate(loans[:200]):
+        # the first period with an LTV of at most 80%, walking every period (term + 1 if it never gets there)
+        cutoff = next((T for T in range(1, loan.term + 1)
+                       if loan.balance(T) / loan.asset.initialValue <= FixedMortgage.pmiLTV), loan.term + 1)
+        if loan.pmiCutoff != cutoff:
+            failures.append('cutoff of loan {}: {} instead of {}'.format(i, loan.pmiCutoff, cutoff))
+
+    schedule = pool1.PMISchedule()
+    reference = np.zeros(schedule.shape)
+    for i, loan in enumerate(loans):
+        if isinstance(loan, FixedMortgage):
+            reference[i, :loan.term + 1] = [loan.PMI(T) for T in range(loan.term + 1)]
+    pmi_diff = np.abs(schedule - reference).max()
+    print(f'PMISchedule against PMI(): {pmi_diff:.3e}')
+    failures += ['PMISchedule'] if pmi_diff > TOLERANCE else []
+
+    T = np.arange(361)
+    balance_diff = payment_diff = 0.0
+    for loan in loans:
+        balances = Loan.calcBalanceArray(loan.term, loan.rate, loan.face, T[:loan.term + 1])
+        reference = [Loan.calcBalance(loan.term, loan.rate, loan.face, t) for t in range(loan.term + 1)]
+        balance_diff = max(balance_diff, np.abs(balances - reference).max())
+        payment_diff = max(payment_diff, abs(Loan.calcMonthlyPmtArray(loan.term, loan.rate, loan.face) -
+                                             Loan.calcMonthlyPmt(loan.term, loan.rate, loan.face)))
+    print(f'calcBalanceArray against calcBalance: {balance_diff:.3e}')
+    print(f'calcMonthlyPmtArray against calcMonthlyPmt: {payment_diff:.3e}')
+    failures += ['calcBalanceArray'] if balance_diff > TOLERANCE else []
+    failures += ['calcMonthlyPmtArray'] if payment_diff > TOLERANCE else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The PMI schedule matches the LTV of every period')
+
+
+if __name__ == '__main__':
+    main()
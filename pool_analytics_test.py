@@ -0,0 +1,80 @@
+from asset.asset_houses import PrimaryHome, VacationHome
+from loan.loan_pool import LoanPool
+from loan.mortgage import FixedMortgage
+from loan.pool_analytics import PoolAnalytics
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check PoolAnalytics against asking every loan, the way the LoanPool methods worked before they used
+it: the WAR, WAM, total principal, balance and total payments (PMI of the mortgages included) of the summary, and the
+count, balance and WAR of every stratum of the stratification tables, at a few periods. WAR and WAM of the analytics
+(which LoanPool.WAR and LoanPool.WAM give, without the rest of the summary) are those of the summary. The columns read
+straight from the csv (fromCSV) are also the same as the columns of the pool of the loans read from it
+'''
+
+LOANS = 300  # loans of the csv used
+MORTGAGES = 40  # mortgages added to them
+PERIODS = [1, 12, 30, 59]  # periods compared
+TOLERANCE = 1e-9  # largest relative difference allowed
+
+
+def main():
+    filename = os.path.join('Loan Test', 'Loans.csv')
+    loans = list(LoanPool.readLoansFromCSV(filename))
+    rng = np.random.default_rng(2044)
+    mortgages = [FixedMortgage(int(rng.choice([120, 180, 360])), float(rng.uniform(0.02, 0.08)), face,
+                               (PrimaryHome if i % 2 else VacationHome)(face * float(rng.uniform(0.9, 1.5))))
+                 for i, face in enumerate(rng.uniform(50000, 400000, MORTGAGES))]
+    pool1 = LoanPool(loans[:LOANS] + mortgages)
+    analytics = pool1.analytics()
+    failures = []
+
+    def relative(value, reference):
+        return abs(value - reference) / max(abs(reference), 1)
+
+    faces = np.array([loan.face for loan in pool1])
+    print(f'{"T":<6s}{"WAR":<12s}{"WAM":<12s}{"principal":<12s}{"balance":<12s}{"payments":<12s}{"strata"}')
+    for T in PERIODS:
+        summary = analytics.summary(T)
+        rates = np.array([loan.getRate(T) for loan in pool1])
+        balances = np.array([loan.balance(T) for loan in pool1])
+        diffs = [relative(summary['WAR'], np.dot(faces, rates) / faces.sum()),
+                 relative(summary['WAM'], np.dot(faces, [loan.term / 12 for loan in pool1]) / faces.sum()),
+                 relative(summary['totalPrincipal'], faces.sum()),
+                 relative(summary['balance'], balances.sum()),
+                 relative(summary['totalPayments'], sum(loan.totalPayments() for loan in pool1))]
+        # every stratum of the loan type table against the loans of that class
+        strata = 0.0
+        for key, count, balance, share, WAR in analytics.stratify(T)['loanType']:
+            members = np.array([loan.__class__.__name__ == key for loan in pool1])
+            weighted = np.dot(balances[members], rates[members]) / balances[members].sum() \
+                if balances[members].sum() > 0 else 0.0
+            strata = max(strata, float(count != members.sum()), relative(balance, balances[members].sum()),
+                         relative(share, balances[members].sum() / balances.sum()), relative(WAR, weighted))
+        diffs.append(strata)
+        failures += ['WAR and WAM at {}'.format(T)] if analytics.WAR(T) != summary['WAR'] or \
+            analytics.WAM() != summary['WAM'] or pool1.WAR(T) != str(round(summary['WAR'] * 100, 2)) + ' %' or \
+            pool1.WAM() != round(summary['WAM'], 3) else []
+        print(f'{T:<6d}' + ''.join(f'{diff:<12.3e}' for diff in diffs))
+        failures += ['T = {}'.format(T)] if max(diffs) > TOLERANCE else []
+
+    from_csv, from_pool = PoolAnalytics.fromCSV(filename), LoanPool(loans).analytics()
+    diff = max(relative(value, from_pool.summary(T)[name]) for T in PERIODS
+               for name, value in from_csv.summary(T).items())
+    tables = all(from_csv.stratify(T) == from_pool.stratify(T) for T in PERIODS)
+    print(f'fromCSV against the loans of the csv: {diff:.3e}, same tables: {tables}')
+    failures += ['fromCSV'] if diff > TOLERANCE or not tables else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The pool analytics are the figures of the loans')
+
+
+if __name__ == '__main__':
+    main()
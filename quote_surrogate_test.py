@@ -0,0 +1,116 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from simulations.checkpoint import MonteCheckpoint
+from simulations.monte import runMonte
+from simulations.pool_paths import simulatePoolPaths
+from simulations.quote_surrogate import QuoteSurrogate, structureGrid
+import numpy as np
+import logging
+import os
+import tempfile
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the runMonte checkpoints a QuoteSurrogate takes in. A checkpoint run on the seed of the
+surrogate starts on the very pool paths of the surrogate, so its first iteration is the same as simulating those rates
+and has no standard error, and the later iterations (fresh paths) have one. A checkpoint of another seed is recorded
+with the standard error of its difference from the pool paths: that error is close to the one of the paths the
+iterations actually ran on, and the iterations are within a few of it. A checkpoint of another pool, or one without
+its pool, is a ValueError. Then a quote of the surrogate trained on a grid is compared with solving the rates on the
+pool paths
+'''
+
+NSIM = 100  # paths of the surrogate and of the checkpoint run on its seed
+OTHER_NSIM = 80  # paths of every iteration of the checkpoint of another seed
+SEED = 2050  # seed of the surrogate
+OTHER_SEED = 2051  # seed of the other checkpoint
+LOANS = 100  # loans of the csv used
+TOLERANCE = 0.005  # tolerance of the runMonte checkpoints
+QUOTE_TOLERANCE = 0.0005  # tolerance of the quotes
+DIFFERENCE = 1e-9  # largest difference allowed in DIRR and AL
+ERRORS = 4  # how many standard errors a checkpoint iteration may be from the pool paths
+GRID = structureGrid([0.75, 0.8, 0.85], [0.04, 0.06, 0.08, 0.1], [0.04, 0.07, 0.1, 0.13])
+
+
+def main():
+    loans = list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))
+    pool1 = LoanPool(loans[:LOANS])
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    failures = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        same, other = os.path.join(directory, 'same.pkl'), os.path.join(directory, 'other.pkl')
+        runMonte(pool1, StructuredSecurities(pool1.totalPrincipal()), TOLERANCE, NSIM, checkpoint=same, seed=SEED)
+        runMonte(pool1, StructuredSecurities(pool1.totalPrincipal()), TOLERANCE, OTHER_NSIM, checkpoint=other,
+                 seed=OTHER_SEED)
+
+        surrogate = QuoteSurrogate(pool1, NSIM, SEED)
+        surrogate.addCheckpoint(same, structured_securities)
+        samples = next(iter(surrogate._samples.values()))
+        history = MonteCheckpoint.load(same).history
+        trial = StructuredSecurities(pool1.totalPrincipal())
+        for face_percent, rate in zip([0.8, 0.2], history[0][0]):
+            trial.addTranche(face_percent, rate, len(trial.trancheList))
+        diff = np.abs(np.ravel(surrogate.simulate(trial)) - samples['outputs'][0]).max()
+        errors = np.array(samples['errors'][:len(history)])
+        print(f'checkpoint on the seed of the surrogate: first iteration {diff:.3e} from the pool paths, standard '
+              f'errors {errors.max(axis=1).round(6).tolist()}')
+        failures += ['same paths'] if diff > DIFFERENCE or errors[0].any() or not errors[1:].all() else []
+
+        surrogate = QuoteSurrogate(pool1, NSIM, SEED)
+        surrogate.addCheckpoint(other, structured_securities)
+        samples = next(iter(surrogate._samples.values()))
+        print(f'{"iteration":<12s}{"largest error (SE)":<22s}{"recorded over actual SE"}')
+        for i, (rates, DIRR_AL, _, paths) in enumerate(MonteCheckpoint.load(other).history):
+            trial.trancheList = []
+            for face_percent, rate in zip([0.8, 0.2], rates):
+                trial.addTranche(face_percent, rate, len(trial.trancheList))
+            fixed = np.ravel(surrogate.simulate(trial))
+            recorded = np.array(samples['errors'][i])
+            # the standard error of the paths the iteration ran on and of the pool paths of the surrogate
+            ran = simulatePoolPaths(pool1, paths, seed=OTHER_SEED, start=i * paths).pathDIRR_AL(trial)
+            own = simulatePoolPaths(pool1, NSIM, seed=SEED).pathDIRR_AL(trial)
+            actual = np.sqrt(ran.var(axis=0, ddof=1) / paths + own.var(axis=0, ddof=1) / NSIM).ravel()
+            moved = actual > 0
+            error = (np.abs(np.ravel(DIRR_AL) - fixed)[moved] / recorded[moved]).max()
+            ratio = recorded[moved] / actual[moved]
+            print(f'{i:<12d}{error:<22.2f}{ratio.min():.2f} to {ratio.max():.2f}')
+            failures += ['iteration {}'.format(i)] if error > ERRORS or ratio.min() < 0.5 or ratio.max() > 2 else []
+
+        different = LoanPool(loans[LOANS:2 * LOANS])
+        elsewhere, unknown = os.path.join(directory, 'elsewhere.pkl'), os.path.join(directory, 'unknown.pkl')
+        runMonte(different, StructuredSecurities(different.totalPrincipal()), 0.05, 20, checkpoint=elsewhere,
+                 seed=SEED)
+        MonteCheckpoint([0.05, 0.08], TOLERANCE, NSIM, SEED).save(unknown)
+        for name, filename in [('another pool', elsewhere), ('no pool', unknown)]:
+            try:
+                surrogate.addCheckpoint(filename, structured_securities)
+                message = 'no error'
+            except ValueError as error:
+                message = str(error).replace(filename, os.path.basename(filename))
+            print(f'a checkpoint of {name}: {message}')
+            failures += [name] if message == 'no error' else []
+
+    surrogate = QuoteSurrogate(pool1, NSIM, SEED)
+    surrogate.train(structured_securities, GRID)
+    quote = surrogate.quote(StructuredSecurities(pool1.totalPrincipal()), QUOTE_TOLERANCE)
+    simulated = QuoteSurrogate(pool1, NSIM, SEED, maxRateError=0).quote(StructuredSecurities(pool1.totalPrincipal()),
+                                                                         QUOTE_TOLERANCE)
+    rates, simulated_rates = [np.array([tranche[-1] for tranche in res['result']]) for res in (quote, simulated)]
+    rate_errors = np.array([error[-1] for error in quote['error']])
+    print(f'quote {rates.round(5).tolist()} (simulated: {quote["simulated"]}, {quote["seconds"]:.3f}s), on the pool '
+          f'paths {simulated_rates.round(5).tolist()}, estimated error {rate_errors.round(5).tolist()}')
+    # the rates solved to the quote tolerance may be that far apart as well
+    failures += ['quote'] if np.any(np.abs(rates - simulated_rates) > ERRORS * rate_errors + 2 * QUOTE_TOLERANCE) \
+        or not simulated['simulated'] else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The checkpoints of the pool come in with their standard errors')
+
+
+if __name__ == '__main__':
+    main()
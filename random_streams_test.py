@@ -0,0 +1,65 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from simulations.simulate_waterfall import simulateWaterfall, simulatePathMetrics
+from simulations.simulation_parallel import runSimulationParallel
+from utils.random_streams import pathGenerator, pathUniforms, loanGenerator
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the per-path random streams: with the same master seed, simulateWaterfall gives the same
+result every time, runSimulationParallel gives the same result as simulateWaterfall whatever the number of
+processes, a run of paths split in two (start) is the same as the run in one go, a single path can be regenerated
+on its own, and the loan streams never repeat the path streams
+'''
+
+NSIM = 12  # paths per simulation
+SEED = 2032  # master seed of the paths
+LOANS = 40  # loans of the csv used, simulateWaterfall asks every loan every period
+
+
+def securities(pool1):
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    return structured_securities
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    failures = []
+
+    serial = simulateWaterfall(pool1, securities(pool1), NSIM, SEED)
+    again = simulateWaterfall(pool1, securities(pool1), NSIM, SEED)
+    print(f'simulateWaterfall:     {serial}')
+    failures += ['repeat'] if again != serial else []
+    for numProcesses in [1, 3]:
+        parallel = runSimulationParallel(pool1, securities(pool1), NSIM, numProcesses, SEED)
+        print(f'{numProcesses} process(es):        {parallel}')
+        failures += ['{} processes'.format(numProcesses)] if parallel != serial else []
+
+    whole = simulatePathMetrics(pool1, securities(pool1), NSIM, SEED)
+    split = np.concatenate([simulatePathMetrics(pool1, securities(pool1), 5, SEED),
+                            simulatePathMetrics(pool1, securities(pool1), NSIM - 5, SEED, start=5)])
+    single = simulatePathMetrics(pool1, securities(pool1), 1, SEED, start=7)
+    print(f'split run: {np.abs(whole - split).max():.3e}, path 7 alone: {np.abs(whole[7] - single[0]).max():.3e}')
+    failures += ['split run'] if not np.array_equal(whole, split) else []
+    failures += ['single path'] if not np.array_equal(whole[7], single[0]) else []
+
+    uniforms = pathUniforms(SEED, 3, 4, 10)
+    failures += ['pathUniforms'] if not np.array_equal(uniforms[2], pathGenerator(SEED, 5).random(10)) else []
+    failures += ['loan streams'] if np.array_equal(loanGenerator(SEED, 5).random(10),
+                                                   pathGenerator(SEED, 5).random(10)) else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('Every path comes from its own stream')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+from loan.hazard_curves import HazardCurves
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from liabilities.waterfall_spec import WaterfallSpec
+from simulations.pool_paths import simulatePoolPaths
+from simulations.rep_lines import RepLinePool, compressionError
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the rep-line compression. On a pool whose lines are copies of the same loan the compression
+is exact in distribution: the rep-line paths and the loan-level paths (simulatePoolPaths) have the same expected pool
+cash flows (PoolSchedule.expectedCashFlows), with defaults and prepayments, so their averages agree with it and with
+each other within a few standard errors, and so does the DIRR and AL of compressionError. The pool balance of the
+rep-line paths is the expected balance too, so compressionError runs a waterfall spec with an OC test and agrees with
+the loan-level run. On a slice of the csv pool, where the loans of a line differ, compressionError is printed to see
+the approximation error next to the noise
+'''
+
+NSIM = 4000  # number of paths
+SEED = 2043  # master seed of the paths
+COPIES = 40  # copies of every loan of the exact pool
+LINES = 5  # loans of the csv copied, one line each
+LOANS = 600  # loans of the csv for the approximation
+ERRORS = 4  # how many standard errors the averages may be apart
+HAZARD = HazardCurves(cdr=0.05, cpr=HazardCurves.PSA(100))
+ROUNDING = 1e-6  # dollars the average of equal flows may be off by
+STEPS = [{'pay': 'interest'}, {'pay': 'principal'}, {'pay': 'turbo', 'tranches': [0], 'when': ('OC', 0, 1.3)}]
+
+
+def main():
+    loans = list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))
+    pool1 = LoanPool([loan for loan in loans[:LINES] for _ in range(COPIES)], HAZARD)
+    rep_lines = RepLinePool(pool1)
+    failures = []
+    print(f'{len(rep_lines)} lines of {rep_lines.counts.tolist()} loans')
+    failures += ['lines'] if len(rep_lines) != LINES or list(rep_lines.counts) != [COPIES] * LINES else []
+
+    expected_cash, expected_principal, _, expected_balance = PoolSchedule(pool1).expectedCashFlows(collateral=True)
+    print(f'{"paths":<14s}{"cash error (SE)":<18s}{"principal error (SE)":<24s}{"balance error (SE)"}')
+    for name, paths in [('loan level', simulatePoolPaths(pool1, NSIM, seed=SEED, collateral=True)),
+                        ('rep lines', rep_lines.simulatePoolPaths(NSIM, SEED, collateral=True))]:
+        errors = []
+        for flows, expected in [(paths.cash, expected_cash[0]), (paths.principal, expected_principal[0])]:
+            error = flows.std(axis=0, ddof=1) / np.sqrt(NSIM)
+            errors.append((np.abs(flows.mean(axis=0) - expected) / np.where(error > 0, error, np.inf)).max())
+        # the balance of period 0 is the same on every path, so its standard error is only rounding
+        error = np.maximum(paths.collateral.std(axis=0, ddof=1) / np.sqrt(NSIM), ROUNDING)
+        errors.append((np.abs(paths.collateral.mean(axis=0) - expected_balance[0]) / error).max())
+        print(f'{name:<14s}{errors[0]:<18.2f}{errors[1]:<24.2f}{errors[2]:.2f}')
+        # the largest of some 60 periods, so a little more room than for a single number
+        failures += [name] if max(errors) > ERRORS + 1 else []
+
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    res = compressionError(pool1, structured_securities, NSIM, seed=SEED)
+    error = np.abs(res['error']) / np.sqrt(np.square(res['standardError'][0]) + np.square(res['standardError'][1]))
+    print(f'compressionError of the copies: largest error {error.max():.2f} SE')
+    failures += ['compressionError'] if error.max() > ERRORS else []
+
+    structured_securities.spec = WaterfallSpec(STEPS, 'OC turbo')
+    res = compressionError(pool1, structured_securities, NSIM, seed=SEED)
+    error = np.abs(res['error']) / np.sqrt(np.square(res['standardError'][0]) + np.square(res['standardError'][1]))
+    print(f'compressionError of the copies with an OC test: largest error {error.max():.2f} SE')
+    failures += ['compressionError with OC'] if error.max() > ERRORS else []
+
+    pool2 = LoanPool(loans[:LOANS])
+    structured_securities = StructuredSecurities(pool2.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    res = compressionError(pool2, structured_securities, NSIM // 4, seed=SEED)
+    error = np.abs(res['error']) / np.sqrt(np.square(res['standardError'][0]) + np.square(res['standardError'][1]))
+    print(f'compressionError of {LOANS} csv loans in {res["lines"]} lines: largest error {error.max():.2f} SE, '
+          f'{res["seconds"][0]:.2f}s against {res["seconds"][1]:.2f}s')
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The rep lines have the cash flows of their loans')
+
+
+if __name__ == '__main__':
+    main()
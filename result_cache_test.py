@@ -0,0 +1,73 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from simulations.result_cache import ResultCache
+from simulations.simulate_waterfall import simulateWaterfall
+from simulations.pool_paths import simulatePoolPaths
+from simulations.monte import runMonte
+import numpy as np
+import logging
+import tempfile
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the ResultCache against the functions it stands in for: the cached simulateWaterfall and
+runMonte give the same results as simulateWaterfall and runMonte with the same seed, a second call is answered from
+the cache (and still adds the runMonte tranches to the structured securities), and the stored pool paths topped up
+for a larger NSIM are the same as simulating all of them at once
+'''
+
+NSIM = 10  # paths per simulation
+SEED = 2029  # master seed of the paths
+LOANS = 40  # loans of the csv used, the reference functions ask every loan every period
+TOLERANCE = 1e-9  # largest difference allowed in DIRR, AL and rates
+
+
+def securities(pool1):
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    return structured_securities
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ResultCache(directory)
+
+        cached = cache.simulateWaterfall(pool1, securities(pool1), NSIM, SEED)
+        diff = np.abs(np.array(cached) - simulateWaterfall(pool1, securities(pool1), NSIM, SEED)).max()
+        print(f'simulateWaterfall: {diff:.3e}')
+        failures += ['simulateWaterfall'] if diff > TOLERANCE else []
+
+        reference = runMonte(pool1, StructuredSecurities(pool1.totalPrincipal()), 0.005, NSIM, seed=SEED)
+        for attempt in ['simulated', 'cached']:
+            structured_securities = StructuredSecurities(pool1.totalPrincipal())
+            cached = cache.runMonte(pool1, structured_securities, 0.005, NSIM, seed=SEED)
+            diff = max(abs(a - b) for tranche, reference_tranche in zip(cached, reference)
+                       for a, b in zip(tranche[:2] + tranche[3:], reference_tranche[:2] + reference_tranche[3:]))
+            rates = [tranche.rate for tranche in structured_securities.trancheList]
+            print(f'runMonte ({attempt}): {diff:.3e}, tranche rates {rates}')
+            if diff > TOLERANCE or [tranche[2] for tranche in cached] != [tranche[2] for tranche in reference] \
+                    or rates != [tranche[3] for tranche in cached]:
+                failures.append('runMonte ' + attempt)
+
+        cache.poolPaths(pool1, NSIM, SEED + 1)
+        topped_up = cache.poolPaths(pool1, 3 * NSIM, SEED + 1)
+        at_once = simulatePoolPaths(pool1, 3 * NSIM, seed=SEED + 1)
+        diff = max(np.abs(topped_up.cash - at_once.cash).max(), np.abs(topped_up.lastPeriod - at_once.lastPeriod).max())
+        print(f'topped up paths: {diff:.3e}')
+        failures += ['topped up paths'] if diff > TOLERANCE else []
+        cache.close()
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The cached results match the simulations')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+from loan.loan_pool import LoanPool
+from simulations.scenario_grid import runScenarioGrid, buildStructuredSecurities
+from simulations.simulate_waterfall import simulateWaterfall
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check runScenarioGrid against simulateWaterfall: every scenario of the grid runs its tranche
+waterfall over one shared set of pool paths, which are the same paths simulateWaterfall draws for the same seed,
+so the DIRR and AL of every tranche of every scenario should be the same as running that scenario on its own
+'''
+
+NSIM = 20  # number of paths
+SEED = 2027  # master seed of the paths
+LOANS = 100  # loans of the csv used, simulateWaterfall asks every loan every period
+TOLERANCE = 1e-9  # largest difference allowed in DIRR and AL
+SCENARIOS = [{'tranches': [(0.8, 0.05, 0), (0.2, 0.08, 1)], 'mode': 'Sequential'},
+             {'tranches': [(0.8, 0.05, 0), (0.2, 0.08, 1)], 'mode': 'Pro Rata'},
+             {'tranches': [(0.7, 0.04, 0), (0.2, 0.07, 1), (0.1, 0.12, 2)], 'mode': 'Sequential'},
+             {'tranches': [(0.9, 0.05, 0), (0.1, 0.1, 1)],
+              'spec': [{'pay': 'interest'}, {'pay': 'principal', 'from': 6}]}]
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    table = runScenarioGrid(pool1, SCENARIOS, NSIM, 2, seed=SEED)
+
+    failures = []
+    print(f'{"scenario":<10s}{"tranches":<10s}{"DIRR/AL diff":<14s}')
+    for index, scenario in enumerate(SCENARIOS):
+        rows = [row for row in table if row[0] == index]
+        reference = simulateWaterfall(pool1, buildStructuredSecurities(pool1.totalPrincipal(), scenario), NSIM, SEED)
+        diff = np.abs(np.array([row[5:7] for row in rows]) - np.array(reference)).max()
+        print(f'{index:<10d}{len(rows):<10d}{diff:<14.3e}')
+        if len(rows) != len(scenario['tranches']) or diff > TOLERANCE:
+            failures.append('scenario {}'.format(index))
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('Every scenario of the grid matches simulateWaterfall')
+
+
+if __name__ == '__main__':
+    main()
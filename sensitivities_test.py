@@ -0,0 +1,106 @@
+from loan.loan_base import Loan
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from simulations.pool_paths import PoolPaths, simulatePoolPaths
+from simulations.sensitivities import bumpSensitivities
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check bumpSensitivities against running the bumped cases directly: the base case is
+simulatePoolPaths with the same seed, the recovery and the default bumps up are simulatePoolPaths on a new
+PoolSchedule with Loan.recovery_multiplier or Loan.default_dict bumped (a 25% default bump keeps every 1 / probability
+of Loan.default_dict a whole number, so the bumped probabilities are exactly the ones of the bumped dict) and the
+coupon bumps are the base paths with a tranche rate bumped. The standard errors of the paired differences are also
+compared with those of bumping on independent paths, which they should beat. A coupon bump whose run fails leaves
+the tranches with the coupons they had
+'''
+
+NSIM = 1000  # number of paths
+SEED = 2041  # master seed of the paths
+LOANS = 300  # loans of the csv used
+TOLERANCE = 1e-9  # largest difference allowed in DIRR and AL
+BUMPS = {'default': 0.25, 'recovery': 0.05, 'depreciation': 0.1, 'coupon': 0.0025}
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    res = bumpSensitivities(pool1, structured_securities, NSIM, BUMPS, seed=SEED)
+    sensitivities = res['sensitivities']
+    failures = []
+
+    def direct(schedule=None):
+        return np.array(simulatePoolPaths(pool1, NSIM, schedule if schedule is not None else PoolSchedule(pool1),
+                                          seed=SEED).averageDIRR_AL(structured_securities))
+
+    checks = {'base': (res['base'], direct())}
+    multiplier, default_dict = Loan.recovery_multiplier, dict(Loan.default_dict)
+    Loan.recovery_multiplier = multiplier + BUMPS['recovery']
+    checks['recovery up'] = (sensitivities['recovery']['up'], direct())
+    Loan.recovery_multiplier = multiplier
+    Loan.default_dict = {period: probability * (1 + BUMPS['default']) for period, probability in default_dict.items()}
+    checks['default up'] = (sensitivities['default']['up'], direct())
+    Loan.default_dict = default_dict
+    for k, tranche in enumerate(structured_securities.trancheList):
+        rate = tranche.rate
+        for sign, side in [(1, 'up'), (-1, 'down')]:
+            tranche.rate = rate + sign * BUMPS['coupon']
+            checks['coupon {} {}'.format(k, side)] = (sensitivities['coupon {}'.format(k)][side], direct())
+        tranche.rate = rate
+    for name, (bumped, reference) in checks.items():
+        diff = np.abs(np.array(bumped)[:, :2].astype(float) - reference).max()
+        print(f'{name:<16s}{diff:.3e}')
+        failures += [name] if diff > TOLERANCE else []
+
+    # the recovery bump on independent paths: the up and down runs each with a seed of their own
+    independent = []
+    for sign, seed in [(1, SEED + 1), (-1, SEED + 2)]:
+        Loan.recovery_multiplier = multiplier + sign * BUMPS['recovery']
+        independent.append(simulatePoolPaths(pool1, NSIM, seed=seed).pathDIRR_AL(structured_securities))
+    Loan.recovery_multiplier = multiplier
+    independent_error = np.sqrt(independent[0].var(axis=0, ddof=1) + independent[1].var(axis=0, ddof=1)) / (
+        2 * BUMPS['recovery'] * np.sqrt(NSIM))
+    paired_error = np.array(sensitivities['recovery']['standardError'])
+    # a metric the bump does not move on any path has no paired error at all
+    ratio = independent_error[paired_error > 0] / paired_error[paired_error > 0]
+    print(f'recovery delta standard error, independent over paired paths: at least {ratio.min():.1f} '
+          f'({int((paired_error == 0).sum())} of {paired_error.size} paired errors are 0)')
+    failures += ['standard error'] if np.any(paired_error >= independent_error) else []
+
+    # the runs of the bumped coupons fail: the pool cases run first, then the coupons
+    class Failed(Exception):
+        pass
+
+    def failingCoupons(paths, *args, **kwargs):
+        if len(paths.cash) == NSIM:
+            raise Failed()
+        return pathDIRR_AL(paths, *args, **kwargs)
+
+    rates = [tranche.rate for tranche in structured_securities.trancheList]
+    pathDIRR_AL, PoolPaths.pathDIRR_AL = PoolPaths.pathDIRR_AL, failingCoupons
+    try:
+        bumpSensitivities(pool1, structured_securities, NSIM, BUMPS, seed=SEED)
+    except Failed:
+        pass
+    finally:
+        PoolPaths.pathDIRR_AL = pathDIRR_AL
+    kept = [tranche.rate for tranche in structured_securities.trancheList]
+    print(f'tranche rates after a failed coupon bump: {kept}, before {rates}')
+    failures += ['failed coupon bump'] if kept != rates else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The bumped cases are the ones run directly')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+from asset.asset_base import Asset
+from loan.hazard_curves import HazardCurves
+from loan.loan import FixedRateLoan
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from liabilities.waterfall_spec import WaterfallSpec
+from utils.sharded_waterfall import doWaterfallSharded
+from utils.waterfall import doWaterfall
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check doWaterfallSharded against doWaterfall on the same path of the pool, for a pool without and
+with hazard curves and a waterfall spec with an OC test: the tranche waterfall, the reserve account and the metrics
+are the same up to rounding whether the shards run in this process, in threads or in processes, and so is the balance
+of the pool series and of the loan waterfall. A shard whose loan fails in a process raises a RuntimeError that names
+the loans of the shard and the error, instead of the run stopping without saying why
+'''
+
+SEED = 2047  # master seed of the path
+PATH = 3  # path of the seed run
+LOANS = 400  # loans of the csv used
+SHARD = 70  # loans of every shard
+TOLERANCE = 1e-6  # largest difference allowed in the tranche waterfall (dollars) and the metrics
+RUNS = {'in this process': {'numProcesses': 1}, 'threads': {'numProcesses': 3, 'threads': True},
+        'processes': {'numProcesses': 3}}
+STEPS = [{'pay': 'interest'}, {'pay': 'principal'}, {'pay': 'turbo', 'tranches': [0], 'when': ('OC', 0, 1.3)}]
+
+
+def securities(loanpool, spec):
+    structured_securities = StructuredSecurities(loanpool.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    if spec:
+        structured_securities.spec = WaterfallSpec(STEPS, 'OC turbo')
+    return structured_securities
+
+
+# the largest difference of the tranche waterfalls, reserve accounts and metrics of two runs
+def difference(sharded, reference):
+    diffs = [np.abs(np.array(sharded[1], dtype=float) - np.array(reference[1], dtype=float)).max(),
+             np.abs(np.array(sharded[2]) - np.array(reference[2])).max()]
+    for metric, reference_metric in zip(sharded[3], reference[3]):
+        diffs += [abs(value - reference_value) for value, reference_value in zip(metric, reference_metric)
+                  if isinstance(value, float) and value != reference_value]
+    return max(diffs)
+
+
+def main():
+    loans = list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS]
+    failures = []
+
+    print(f'{"pool":<16s}{"spec":<10s}{"run":<18s}{"difference"}')
+    for name, hazard in [('no hazard', None), ('hazard curves', HazardCurves(cdr=0.05, cpr=HazardCurves.PSA(100)))]:
+        for spec in [False, True]:
+            pool1 = LoanPool(loans, hazard)
+            pool1.reset()  # the loans defaulted by the loan-level waterfall of the last run
+            pool1.drawDefaults(SEED, PATH)
+            runs = {run: doWaterfallSharded(pool1, securities(pool1, spec), shardSize=SHARD, **kwargs)
+                    for run, kwargs in RUNS.items()}
+            # the loan-level waterfall checks the defaults of the loans, so it runs last
+            reference = doWaterfall(pool1, securities(pool1, spec))
+            # the balance of the loans, period by period
+            balance = np.array([sum(loan[0] for loan in period) for period in reference[0]])
+            for run, sharded in runs.items():
+                periods = min(len(sharded[0]['balance']), len(balance))
+                diff = max(difference(sharded, reference),
+                           np.abs(sharded[0]['balance'][1:periods] - balance[1:periods]).max())
+                print(f'{name:<16s}{str(spec):<10s}{run:<18s}{diff:.3e}')
+                failures += ['{} {} {}'.format(name, spec, run)] if diff > TOLERANCE else []
+
+    # an asset without a depreciation rate fails in the PoolSchedule of its shard
+    broken = LoanPool(loans[:SHARD * 2] + [FixedRateLoan(60, 0.05, 10000, Asset(12000))] + loans[SHARD * 2:SHARD * 3])
+    broken.drawDefaults(SEED, PATH)
+    try:
+        doWaterfallSharded(broken, securities(broken, False), numProcesses=2, shardSize=SHARD)
+        message = 'no error'
+    except RuntimeError as error:
+        message = str(error)
+    print(f'a broken loan in a process: {message}')
+    failures += ['broken shard'] if 'loans {}..{}'.format(SHARD * 2, SHARD * 3 - 1) not in message or \
+        'NotImplementedError' not in message else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The sharded waterfall is the waterfall of the pool')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from simulations.simulation_distributed import SimulationCoordinator, startLocalWorkers, _WorkerManager
+from simulations.pool_paths import simulatePoolPaths
+from multiprocessing import AuthenticationError
+import threading
+import logging
+import time
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the coordinator and workers of the distributed simulation on localhost: the exact partial
+sums sent back by the workers give the same averages, to the last bit, as the same paths simulated in one go, also
+when a worker takes a shard and goes away before claiming it, or claims it and stops sending heartbeats. A
+simulation without any worker fails instead of waiting forever, and a worker without the coordinator's random
+authkey cannot connect
+'''
+
+NSIM = 250  # paths per simulation
+SEED = 2031  # master seed of the paths
+LOANS = 100  # loans of the csv used
+WORKER_TIMEOUT = 2.0  # seconds without a heartbeat before a worker counts as gone
+
+
+def securities(pool1):
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    return structured_securities
+
+
+# take a shard off the queue and go away, after claiming it if claim is True (a worker dying mid shard)
+def loseShard(coordinator, claim):
+    manager = _WorkerManager(address=coordinator.address, authkey=coordinator.authkey)
+    manager.connect()
+    job, shard = manager.tasks().get(timeout=10)[:2]
+    if claim:
+        manager.results().put(('claim', 'ghost', (job, shard), None))
+    return shard
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    reference = simulatePoolPaths(pool1, NSIM, seed=SEED).averageDIRR_AL(securities(pool1))
+    failures = []
+
+    coordinator = SimulationCoordinator(pool1, shardSize=50, workerTimeout=WORKER_TIMEOUT)
+    for claim in [False, True]:
+        # the simulation runs in a thread, a shard is lost before any worker is started
+        result = {}
+        thread = threading.Thread(target=lambda: result.update(
+            average=coordinator.simulate(securities(pool1), NSIM, SEED, 0)))
+        thread.start()
+        lost = loseShard(coordinator, claim)
+        workers = startLocalWorkers(coordinator, 2)
+        thread.join()
+        coordinator.stopWorkers(len(workers))
+        for worker in workers:
+            worker.join()
+        print(f'shard {lost} lost {"after" if claim else "before"} its claim: {result["average"]}')
+        failures += ['lost shard'] if result['average'] != reference else []
+    print(f'in one go: {reference}')
+
+    for name, options in [('no workers', {}), ('job timeout', {'jobTimeout': 0.5})]:
+        idle = SimulationCoordinator(pool1, workerTimeout=WORKER_TIMEOUT if not options else 60, **options)
+        started = time.time()
+        try:
+            idle.simulate(securities(pool1), NSIM, SEED, 0)
+            failures.append(name)
+        except RuntimeError as error:
+            print(f'{name}: failed after {time.time() - started:.1f}s with "{error}"')
+
+    intruder = _WorkerManager(address=coordinator.address, authkey=b'abs')
+    try:
+        intruder.connect()
+        failures.append('authkey')
+    except AuthenticationError:
+        print('a worker with the wrong authkey is refused')
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The distributed simulation matches the paths simulated in one go')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+A batch of many deals on one pool of worker processes. Every deal is cut into shards of paths whose number follows
+its estimated cost (loans x periods x NSIM), so a large deal is spread over every process and a small one is a single
+shard, and the shards of all the deals are queued on the same processes, largest deals first, so the cores stay busy
+until the whole batch is done instead of runMonteParallel starting and stopping its own processes deal by deal.
+
+A deal is a dict: {'name': ..., 'loanpool': LoanPool, 'structured_securities': StructuredSecurities, 'NSIM': ...}
+with an optional 'seed' and 'tolerance'. With a tolerance the tranche rates are solved like runMonte (the runMonte
+tranches are added to the structured securities) and every iteration is sharded the same way, otherwise the tranches
+the structured securities already have are simulated once like simulateWaterfall. Every deal needs a
+StructuredSecurities of its own.
+
+The paths of a deal are the paths of its seed, so the results are the same as runMonteParallel or simulateWaterfall
+with that seed. The results and timings of every deal go to a json summary file
+"""
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from simulations.simulate_waterfall import simulatePathMetrics, averageDIRR_AL
+from simulations.pool_paths import simulatePoolPaths
+from simulations.monte import _solveRates
+from liabilities.tranche_base import Tranche
+from utils.random_streams import newSeed
+import numpy as np
+import multiprocessing
+import threading
+import json
+import math
+import time
+import logging
+
+# shards per process a batch is cut into, so the last shards to finish are small
+SHARDS_PER_PROCESS = 4
+
+_loanPools = None  # the loan pool of every deal, set once in each worker process
+
+
+def _initWorker(loan_pools):
+    global _loanPools
+    _loanPools = loan_pools
+
+
+# Check every deal before anything is planned or started: a LoanPool, a StructuredSecurities of its own (the
+# tranche rates of a deal are set on it while it runs), a whole number of paths above 0 and a tolerance above 0
+def validateDeals(deals):
+    seen = set()
+    for index, deal in enumerate(deals):
+        name = deal.get('name', str(index)) if isinstance(deal, dict) else str(index)
+        if not isinstance(deal, dict) or not isinstance(deal.get('loanpool'), LoanPool) or \
+                not isinstance(deal.get('structured_securities'), StructuredSecurities):
+            logging.error('Deal {} needs a LoanPool and a StructuredSecurities'.format(name))
+            raise ValueError('Deal {} needs a LoanPool and a StructuredSecurities'.format(name))
+        if id(deal['structured_securities']) in seen:
+            logging.error('Deal {} shares its StructuredSecurities with another deal'.format(name))
+            raise ValueError('Deal {} shares its StructuredSecurities with another deal'.format(name))
+        seen.add(id(deal['structured_securities']))
+        if not isinstance(deal.get('NSIM'), (int, np.integer)) or isinstance(deal['NSIM'], bool) or deal['NSIM'] < 1:
+            logging.error('Deal {} needs a whole number of paths NSIM above 0'.format(name))
+            raise ValueError('Deal {} needs a whole number of paths NSIM above 0'.format(name))
+        if deal.get('tolerance') is not None and not deal['tolerance'] > 0:
+            logging.error('The tolerance of deal {} should be above 0'.format(name))
+            raise ValueError('The tolerance of deal {} should be above 0'.format(name))
+
+
+# the cost of a deal in loan-periods simulated, what the shards are sized by
+def estimateCost(deal):
+    loans = list(deal['loanpool'])
+    periods = int(max((loan.term for loan in loans), default=0)) + 1
+    return len(loans) * periods * deal['NSIM']
+
+
+# The path shards of every deal: the batch is cut into about SHARDS_PER_PROCESS shards per process of equal cost,
+# every deal into as many of them as its cost takes (at least one, at most one per path). Returns the (first path,
+# paths) of the shards of every deal
+def planShards(deals, numProcesses):
+    costs = [estimateCost(deal) for deal in deals]
+    target = max(sum(costs) / (numProcesses * SHARDS_PER_PROCESS), 1)
+    plans = []
+    for deal, cost in zip(deals, costs):
+        count = int(min(max(math.ceil(cost / target), 1), max(deal['NSIM'], 1)))
+        bounds = np.linspace(0, deal['NSIM'], count + 1).astype(int)
+        plans.append([(int(low), int(high - low)) for low, high in zip(bounds[:-1], bounds[1:]) if high > low])
+    return plans
+
+
+# one shard of a deal in a worker: [DIRR, AL] of each tranche on each path, and the cpu seconds it took
+def _runShard(index, structured_securities, NSIM, seed, start, backend):
+    started = time.process_time()
+    loanpool = _loanPools[index]
+    if backend is None:
+        path_metrics = simulatePathMetrics(loanpool, structured_securities, NSIM, seed, start)
+    else:
+        pool_paths = simulatePoolPaths(loanpool, NSIM, seed=seed, start=start,
+                                       collateral=structured_securities.spec.needsCollateral)
+        path_metrics = pool_paths.pathDIRR_AL(structured_securities, backend=backend)
+    return path_metrics, time.process_time() - started
+
+
+# Run the deals on numProcesses processes (all cores by default) and write the summary to summaryFile (json) when
+# one is given. backend runs the shards with the array engine on that compute backend (see
+# utils.waterfall_backends) instead of doWaterfall, on the same paths. Returns the summary: a dict of 'deals' (one
+# dict per deal with its 'name', 'result' - [DIRR, AL, rating] of each tranche, plus the rate when solved -, 'seed',
+# 'iterations', 'paths', 'shards', 'estimatedCost', 'seconds' from start to finish, 'cpuSeconds' of its shards, or
+# the 'error' it failed with), 'processes', 'seconds' and 'utilization' (cpu seconds over process seconds)
+# The deals are checked first (validateDeals), a ValueError before any process starts
+def runBatch(deals, numProcesses=None, summaryFile=None, backend=None):
+    validateDeals(deals)
+    numProcesses = numProcesses or multiprocessing.cpu_count()
+    plans = planShards(deals, numProcesses)
+    summaries = [{'name': deal.get('name', str(index)), 'NSIM': deal['NSIM'], 'shards': len(plan),
+                  'estimatedCost': estimateCost(deal), 'cpuSeconds': 0.0, 'paths': 0, 'iterations': 0}
+                 for index, (deal, plan) in enumerate(zip(deals, plans))]
+    started = time.time()
+    with multiprocessing.Pool(numProcesses, initializer=_initWorker,
+                              initargs=([deal['loanpool'] for deal in deals],)) as pool:
+        threads = [threading.Thread(target=_runDeal, args=(pool, index, deal, plans[index], summaries[index],
+                                                            backend))
+                   for index, deal in enumerate(deals)]
+        # the most expensive deals queue their shards first
+        for index in sorted(range(len(deals)), key=lambda index: -summaries[index]['estimatedCost']):
+            threads[index].start()
+        for thread in threads:
+            thread.join()
+    seconds = time.time() - started
+
+    summary = {'deals': summaries, 'processes': numProcesses, 'seconds': seconds,
+               'utilization': sum(deal['cpuSeconds'] for deal in summaries) / (seconds * numProcesses)
+               if seconds > 0 else 0.0}
+    if summaryFile is not None:
+        with open(summaryFile, 'w') as fp:
+            json.dump(summary, fp, indent=2, default=float)
+    return summary
+
+
+# one deal in a thread of its own: every simulation it needs is queued on the pool as shards and waited for, so
+# the threads of all the deals keep the processes busy together
+def _runDeal(pool, index, deal, plan, summary, backend):
+    started = time.time()
+    structured_securities = deal['structured_securities']
+
+    def simulate(seed, start):
+        shards = [pool.apply_async(_runShard, (index, structured_securities, size, seed, start + low, backend))
+                  for low, size in plan]
+        results = [shard.get() for shard in shards]
+        summary['cpuSeconds'] += sum(seconds for _, seconds in results)
+        summary['paths'] += deal['NSIM']
+        summary['iterations'] += 1
+        return averageDIRR_AL(np.concatenate([path_metrics for path_metrics, _ in results]))
+
+    try:
+        seed = summary['seed'] = deal.get('seed') if deal.get('seed') is not None else newSeed()
+        if deal.get('tolerance') is not None:
+            result = _solveRates(structured_securities, deal['tolerance'], deal['NSIM'], simulate, seed=seed)
+        else:
+            result = [DIRR_AL + [Tranche.DIRR_Rating(DIRR_AL[0])] for DIRR_AL in simulate(seed, 0)]
+        summary['result'] = result
+    except Exception as e:
+        logging.error('Deal {} failed: {}'.format(summary['name'], e))
+        summary['error'] = str(e)
+    summary['seconds'] = time.time() - started
@@ -0,0 +1,97 @@
+"""
+MonteCheckpoint persists the state of a runMonte / runMonteParallel solve: the current tranche rates, the iteration
+history, and the random number generator state, which is the master seed plus the number of paths simulated so far
+(every path has its own stream, see utils.random_streams). A run that dies can be resumed from its last checkpoint
+and continues with exactly the paths it would have simulated, and a converged run can warm start a new run with a
+different tolerance or NSIM. It also keeps the content hash of the loan pool (ResultCache.describePool) when the run
+knew it, so its iterations are only used with that pool
+"""
+import os
+import pickle
+
+
+class MonteCheckpoint(object):
+    def __init__(self, rates, tolerance, NSIM, seed, pool=None):
+        self._rates = list(rates)  # the rates the next iteration will simulate with
+        self._tolerance = tolerance
+        self._NSIM = NSIM
+        self._seed = seed  # master seed of the run
+        self._pool = pool  # content hash of the loan pool, None when not known
+        self._history = []  # one [rates, DIRR_AL, diff, NSIM] per finished iteration
+        self._paths = 0  # paths simulated over all iterations, the next iteration starts at this path
+        self._converged = False
+
+    # record a finished iteration, rates being the rates for the next one
+    def record(self, simulated_rates, DIRR_AL, diff, rates, NSIM):
+        self._history.append([list(simulated_rates), [list(tranche) for tranche in DIRR_AL], diff, NSIM])
+        self._paths += NSIM
+        self._rates = list(rates)
+
+    # start a new run from the last rates of this one, e.g. with a tighter tolerance or a larger NSIM
+    def warmStart(self, tolerance, NSIM):
+        self._tolerance = tolerance
+        self._NSIM = NSIM
+        self._converged = False
+
+    # write to a temporary file first and swap it in, so a crash while saving never leaves a broken checkpoint
+    def save(self, filename):
+        with open(filename + '.tmp', 'wb') as fp:
+            pickle.dump(self, fp)
+        os.replace(filename + '.tmp', filename)
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as fp:
+            return pickle.load(fp)
+
+    # load the checkpoint if the file exists, otherwise None
+    @classmethod
+    def loadIfExists(cls, filename):
+        if filename is not None and os.path.exists(filename):
+            return cls.load(filename)
+        return None
+
+    @property
+    def rates(self):
+        return self._rates
+
+    @property
+    def tolerance(self):
+        return self._tolerance
+
+    @property
+    def NSIM(self):
+        return self._NSIM
+
+    @property
+    def seed(self):
+        return self._seed
+
+    # checkpoints saved before the pool was kept have none
+    @property
+    def pool(self):
+        return getattr(self, '_pool', None)
+
+    @pool.setter
+    def pool(self, ipool):
+        self._pool = ipool
+
+    @property
+    def iteration(self):
+        return len(self._history)
+
+    @property
+    def history(self):
+        return self._history
+
+    @property
+    def paths(self):
+        return self._paths
+
+    @property
+    def converged(self):
+        return self._converged
+
+    @converged.setter
+    def converged(self, iconverged):
+        self._converged = iconverged
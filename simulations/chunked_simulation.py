@@ -0,0 +1,117 @@
+"""
+Array simulation of the waterfall within a memory budget. Building all NSIM paths x loans x periods at once does not
+fit in memory for large pools, so the work is split into chunks of paths and, when the PoolSchedule of the whole pool
+does not fit either, chunks of loans whose pool cash flows are added up. The chunk sizes come from the budget
+(chunkPlan), the buffers of a chunk are allocated once and reused by every chunk, and the per-path [DIRR, AL] are
+summed exactly as they come, so peak memory does not depend on NSIM. The schedule of every loan chunk is built once;
+with more than one they are spilled to memory-mapped files (PoolSchedule.spill) that every path chunk reads back.
+
+The paths are the same as simulatePoolPaths with the same seed, and without loan chunks the result is the same to
+the last bit as PoolPaths.averageDIRR_AL over all of them (with loan chunks the pool cash flows are summed in a
+different order, which only changes the rounding)
+"""
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from simulations.pool_paths import PoolPaths
+from simulations.simulate_waterfall import ExactSum
+from liabilities.structured_securities import StructuredSecurities
+from utils.random_streams import newSeed, pathGenerator
+import numpy as np
+import logging
+import os
+import tempfile
+
+# bytes per loan x period of a PoolSchedule: its four arrays plus the temporaries of building them
+SCHEDULE_BYTES = 12 * 8
+# bytes per path x loan of a chunk: uniforms, default periods, the default mask and event indices, worst case
+PATH_LOAN_BYTES = 56
+# bytes per path x period of a chunk: cash and principal due
+PATH_PERIOD_BYTES = 2 * 8
+# bytes per path x period of a chunk for waterfall specs with an OC test: the pool balance and that of a loan chunk
+COLLATERAL_BYTES = 2 * 8
+
+
+# The chunk sizes for a pool within memoryBudget bytes: half of the budget for the schedule of a chunk of loans,
+# the rest for the path chunk and the scratch rows of default events (an eighth of the budget); collateral=True
+# leaves room for the pool balance of the paths too
+# returns a dict of 'loans', 'paths', 'events' per chunk and the 'bytes' they need
+def chunkPlan(loans, periods, memoryBudget, collateral=False):
+    path_period_bytes = PATH_PERIOD_BYTES + (COLLATERAL_BYTES if collateral else 0)
+    loan_chunk = min(loans, int(memoryBudget / 2 // (SCHEDULE_BYTES * periods)))
+    event_chunk = int(memoryBudget / 8 // (8 * periods))
+    path_budget = memoryBudget - loan_chunk * SCHEDULE_BYTES * periods - event_chunk * 8 * periods
+    path_chunk = int(path_budget // (loan_chunk * PATH_LOAN_BYTES + periods * path_period_bytes)) \
+        if loan_chunk > 0 else 0
+    if loan_chunk < 1 or path_chunk < 1 or event_chunk < 1:
+        logging.error('A memory budget of {} bytes is too small for {} periods'.format(memoryBudget, periods))
+        raise ValueError('The memory budget is too small')
+    used = (loan_chunk * SCHEDULE_BYTES * periods + event_chunk * 8 * periods
+            + path_chunk * (loan_chunk * PATH_LOAN_BYTES + periods * path_period_bytes))
+    return {'loans': loan_chunk, 'paths': path_chunk, 'events': event_chunk, 'bytes': used}
+
+
+# The average [DIRR, AL] of each tranche over NSIM paths, like simulateWaterfall, in at most about memoryBudget bytes
+def simulateWaterfallChunked(loanpool, structured_securities, NSIM, memoryBudget, seed=None, start=0):
+    if not isinstance(loanpool, LoanPool) or not isinstance(structured_securities, StructuredSecurities):
+        logging.error('Please enter the correct class type')
+    if loanpool.hazard is not None and loanpool.hazard.cpr is not None:
+        logging.error('The chunked simulation does not draw prepayments, the pool has CPR curves')
+        raise ValueError('The chunked simulation does not draw prepayments')
+    seed = seed if seed is not None else newSeed()
+    loans = list(loanpool)
+    periods = int(max((loan.term for loan in loans), default=0)) + 1
+    collateral = structured_securities.spec.needsCollateral
+    plan = chunkPlan(len(loans), periods, memoryBudget, collateral)
+    loan_chunks = [LoanPool(loans[low:low + plan['loans']], loanpool.hazard)
+                   for low in range(0, len(loans), plan['loans'])]
+    # one schedule per loan chunk, built once; with more than one they go to disk so only one is in memory at a time
+    with tempfile.TemporaryDirectory() as directory:
+        schedules = [PoolSchedule(loan_chunks[0], periods)] if len(loan_chunks) == 1 else \
+            [PoolSchedule(loan_chunk, periods).spill(os.path.join(directory, str(i)))
+             for i, loan_chunk in enumerate(loan_chunks)]
+        res = _simulateChunks(schedules, structured_securities, NSIM, plan, periods, seed, start, collateral)
+        # close the mapped files before the directory is removed
+        del schedules
+    return res
+
+
+# the path chunks of simulateWaterfallChunked over the schedules of the loan chunks; collateral=True also adds up
+# the pool balance of the paths
+def _simulateChunks(schedules, structured_securities, NSIM, plan, periods, seed, start, collateral=False):
+    # the buffers of a chunk, reused by every chunk
+    path_chunk = min(plan['paths'], NSIM)
+    uniforms = np.empty((path_chunk, plan['loans']))
+    cash, principal = np.empty((path_chunk, periods)), np.empty((path_chunk, periods))
+    chunk_cash, chunk_principal = np.empty((path_chunk, periods)), np.empty((path_chunk, periods))
+    last_period = np.empty(path_chunk, dtype=int)
+    balance = np.empty((path_chunk, periods)) if collateral else None
+    scratch = np.empty((min(plan['events'], path_chunk * plan['loans']), periods))
+
+    sums = [[ExactSum(), ExactSum()] for _ in structured_securities.trancheList]
+    for low in range(0, NSIM, path_chunk):
+        size = min(path_chunk, NSIM - low)
+        # every path draws the uniforms of its loans from its own stream, one loan chunk after another
+        generators = [pathGenerator(seed, start + low + i) for i in range(size)]
+        cash[:size] = 0
+        principal[:size] = 0
+        last_period[:size] = 1
+        if collateral:
+            balance[:size] = 0
+        for loan_schedule in schedules:
+            count = len(loan_schedule.lastActive)
+            for i, generator in enumerate(generators):
+                generator.random(count, out=uniforms[i, :count])
+            default_times = loan_schedule.defaultTimes(uniforms[:size, :count])
+            _, _, chunk_last = loan_schedule.poolCashFlows(default_times, (chunk_cash[:size], chunk_principal[:size]),
+                                                           scratch)
+            cash[:size] += chunk_cash[:size]
+            principal[:size] += chunk_principal[:size]
+            np.maximum(last_period[:size], chunk_last, out=last_period[:size])
+            if collateral:
+                balance[:size] += loan_schedule.poolBalance(default_times)
+        path_metrics = PoolPaths(cash[:size], principal[:size], last_period[:size],
+                                 balance[:size] if collateral else None).pathDIRR_AL(structured_securities)
+        for i, tranche_sums in enumerate(sums):
+            tranche_sums[0].add(path_metrics[:, i, 0])
+            tranche_sums[1].add(path_metrics[:, i, 1])
+    return [[tranche_sum.value() / NSIM for tranche_sum in tranche_sums] for tranche_sums in sums]
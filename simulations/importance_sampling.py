@@ -0,0 +1,77 @@
+"""
+Importance sampling for the rare losses of senior tranches. At the Loan.default_dict rates the senior tranche almost
+never takes a loss, so its average DIRR is decided by a handful of paths. Here the per-period default probabilities
+are multiplied by `tilt`, so bad paths come up more often, and each path is weighted by its likelihood ratio so the
+weighted averages (self-normalised, over the sum of the weights) are consistent for the nominal DIRR and AL.
+
+The defaults of every loan in the pool are tilted, so the likelihood ratio of a path is a product over all loans and
+a large tilt leaves a few paths with all the weight. To keep the weights bounded the paths are drawn from a defensive
+mixture: each path is nominal with probability `defensive` and tilted otherwise (decided by one extra uniform of its
+own stream), and weighted by nominal over mixture probability, which is at most 1 / defensive.
+
+Along with the estimates it reports their standard errors, the effective sample size of the weights, and the variance
+reduction against plain Monte Carlo with the same number of paths (the plain variance is estimated from the weighted
+paths too)
+"""
+from loan.pool_schedule import PoolSchedule
+from simulations.pool_paths import PoolPaths
+from simulations.monte import _solveRates
+from utils.random_streams import newSeed, pathUniforms
+import logging
+import numpy as np
+
+
+# Returns a dict with 'DIRR_AL' (weighted average [DIRR, AL] per tranche), 'standardError', 'varianceReduction'
+# (both per tranche, per DIRR and AL) and 'effectiveSampleSize'
+def simulateWaterfallIS(loanpool, structured_securities, NSIM, tilt=1.2, defensive=0.2, seed=None, start=0,
+                        schedule=None):
+    if not 0 < defensive <= 1:
+        logging.error('defensive should be in (0, 1], got {}'.format(defensive))
+        raise ValueError('defensive should be in (0, 1]')
+    schedule = schedule if schedule is not None else PoolSchedule(loanpool)
+    seed = seed if seed is not None else newSeed()
+    loans = len(schedule.lastActive)
+    uniforms = pathUniforms(seed, start, NSIM, schedule.randomsPerPath + 1)
+    tilted = uniforms[:, -1] >= defensive
+    default_times = np.where(tilted[:, None], schedule.defaultTimes(uniforms[:, :loans], tilt),
+                             schedule.defaultTimes(uniforms[:, :loans]))
+    # nominal over mixture density: 1 / (defensive + (1 - defensive) * tilted over nominal)
+    # only the default periods are tilted, so with prepayment the ratio is that of the default periods drawn
+    # before the loans that prepay first are taken out
+    log_ratio = schedule.logLikelihoodRatio(default_times, tilt)
+    default_times, prepay_times = schedule.competingRisks(default_times, uniforms[:, loans:-1])
+    log_weights = -np.logaddexp(np.log(defensive), np.log1p(-defensive) - log_ratio if defensive < 1
+                                else np.full(NSIM, -np.inf))
+    weights = np.exp(log_weights)
+    path_metrics = PoolPaths(*schedule.poolCashFlows(default_times, prepay_times=prepay_times)).pathDIRR_AL(
+        structured_securities)
+
+    # self-normalised: with all paths paying about the same (a senior DIRR) the plain weighted mean would carry the
+    # whole spread of the weights, sum(w Y) / sum(w) only the spread of Y around the estimate
+    normalized = (weights / weights.sum())[:, None, None]
+    estimate = (normalized * path_metrics).sum(axis=0)
+    deviation = (path_metrics - estimate) ** 2
+    variance = (normalized ** 2 * deviation).sum(axis=0)
+    # the nominal variance of a single path, E[(Y - E[Y])^2] weighted, for plain Monte Carlo with as many paths
+    plain_variance = (normalized * deviation).sum(axis=0) / NSIM
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance_reduction = np.where(variance > 0, plain_variance / variance, np.inf)
+    return {'DIRR_AL': estimate.tolist(), 'standardError': np.sqrt(variance).tolist(),
+            'varianceReduction': variance_reduction.tolist(),
+            'effectiveSampleSize': effectiveSampleSize(log_weights)}
+
+
+# (sum w)^2 / sum w^2, from log weights so that tiny or huge weights do not under or overflow
+def effectiveSampleSize(log_weights):
+    scaled = np.exp(log_weights - log_weights.max())
+    return float(scaled.sum() ** 2 / (scaled ** 2).sum())
+
+
+# runMonte with importance sampled simulations; every iteration draws the next NSIM paths of the seed
+def runMonteIS(loanpool, structured_securities, tolerance, NSIM, tilt=1.2, defensive=0.2, seed=None,
+               checkpoint=None, checkpointEvery=1, initialRates=None, callback=None):
+    schedule = PoolSchedule(loanpool)
+    return _solveRates(structured_securities, tolerance, NSIM,
+                       lambda seed, start: simulateWaterfallIS(loanpool, structured_securities, NSIM, tilt, defensive,
+                                                               seed, start, schedule)['DIRR_AL'],
+                       checkpoint, checkpointEvery, initialRates, callback, seed=seed)
@@ -0,0 +1,146 @@
+"""
+Incremental revaluation of a pool that changes a few loans at a time. The pool cash flows of the simulation paths are
+a sum over the loans: each loan adds its scheduled payments and takes them back from the period it defaults or
+prepays on a path. IncrementalPool keeps those sums (cash, principal due and, for the last period of each path, how
+many loans end in each period) for NSIM paths, and adding or removing loans only adds or takes away their own part,
+so the work goes with the loans that change instead of with the pool. The tranche metrics are then run again from the
+sums, which costs the same for any pool size.
+
+The default and prepayment periods of a loan come from its own random stream (utils.random_streams.loanGenerator) keyed
+by the seed and the key of the loan, rather than from the streams of the paths, so the loans that stay in the pool
+keep their draws and a removed loan takes back exactly what it added. The paths have the same odds as
+simulatePoolPaths, but not the same draws.
+
+The sums are kept over a fixed number of periods (the longest term of the pool, or more); a loan that runs longer
+makes every loan default-checked over the longer horizon, so the sums are then built again from all the loans.
+Adding and taking away floats leaves rounding behind over many changes, rebuild() starts the sums afresh
+"""
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from simulations.pool_paths import PoolPaths
+from utils.random_streams import newSeed, loanGenerator
+import numpy as np
+import logging
+
+# the most loans whose part is worked out at once, bounding the memory of the default events
+BLOCK_LOANS = 1024
+
+
+class IncrementalPool(object):
+    # NSIM paths of the seed over at least periods periods; collateral=True also keeps the pool balance of every
+    # path, for waterfall specs with an OC test. The loans of the pool get the keys 0, 1, 2, ...
+    def __init__(self, loanpool, NSIM, seed=None, periods=None, collateral=False):
+        loans = list(loanpool)
+        self._NSIM = NSIM
+        self._seed = seed if seed is not None else newSeed()
+        self._hazard = getattr(loanpool, 'hazard', None)
+        self._periods = max(int(max((loan.term for loan in loans), default=0)) + 1, periods or 0)
+        self._collateral = collateral
+        self._loans = {}  # key: loan, in the order they were added
+        self._nextKey = 0
+        self._clear()
+        self.add(loans)
+
+    # the sums of no loans
+    def _clear(self):
+        self._cash = np.zeros((self._NSIM, self._periods))
+        self._principal = np.zeros((self._NSIM, self._periods))
+        self._ends = np.zeros((self._NSIM, self._periods), dtype=np.int64)  # loans that end in each period
+        self._balance = np.zeros((self._NSIM, self._periods)) if self._collateral else None
+
+    # Add loans to the pool, keys (ints, one per loan) name them for remove and key their random streams; the next
+    # free keys by default. Returns the keys
+    def add(self, loans, keys=None):
+        loans = list(loans)
+        keys = list(keys) if keys is not None else list(range(self._nextKey, self._nextKey + len(loans)))
+        if len(keys) != len(loans) or len(set(keys)) != len(keys) or any(key in self._loans for key in keys):
+            logging.error('Every loan added needs a key of its own that is not in the pool')
+            raise ValueError('Every loan added needs a key of its own that is not in the pool')
+        self._loans.update(zip(keys, loans))
+        self._nextKey = max([self._nextKey] + [key + 1 for key in keys])
+        periods = int(max((loan.term for loan in loans), default=0)) + 1
+        if periods > self._periods:
+            logging.info('A loan runs past {} periods, rebuilding the pool over {}'.format(self._periods, periods))
+            self._periods = periods
+            self.rebuild()
+        else:
+            self._apply(keys, loans, 1)
+        return keys
+
+    # Take the loans with these keys out of the pool (paid off, repurchased, ...). Returns the loans
+    def remove(self, keys):
+        keys = list(keys)
+        if len(set(keys)) != len(keys) or any(key not in self._loans for key in keys):
+            logging.error('Only loans in the pool can be removed, once each')
+            raise ValueError('Only loans in the pool can be removed, once each')
+        loans = [self._loans.pop(key) for key in keys]
+        self._apply(keys, loans, -1)
+        return loans
+
+    # the sums built again from all the loans in the pool
+    def rebuild(self):
+        self._clear()
+        self._apply(list(self._loans), list(self._loans.values()), 1)
+
+    # add (sign 1) or take away (sign -1) the part of these loans in the sums, a block of loans at a time
+    def _apply(self, keys, loans, sign):
+        for low in range(0, len(loans), BLOCK_LOANS):
+            block_keys, block_loans = keys[low:low + BLOCK_LOANS], loans[low:low + BLOCK_LOANS]
+            schedule = PoolSchedule(LoanPool(block_loans, self._hazard), self._periods)
+            default_times, prepay_times = schedule.eventTimes(self.loanUniforms(block_keys,
+                                                                                schedule.randomsPerPath))
+            cash, principal, _ = schedule.poolCashFlows(default_times, prepay_times=prepay_times)
+            self._cash += sign * cash
+            self._principal += sign * principal
+            # a loan is last active up to the period it ends in
+            ends = np.minimum(schedule.lastActive, default_times if prepay_times is None
+                              else np.minimum(default_times, prepay_times))
+            cells = (np.arange(self._NSIM)[:, None] * self._periods + ends).ravel()
+            self._ends += sign * np.bincount(cells, minlength=self._ends.size).reshape(self._ends.shape)
+            if self._collateral:
+                self._balance += sign * schedule.poolBalance(default_times, prepay_times)
+
+    # The uniforms of the loans with these keys for every path (NSIM x size), laid out as PoolSchedule.eventTimes
+    # wants them: a column per loan for its default, then one per loan for its prepayment when size asks for two
+    def loanUniforms(self, keys, size):
+        per_loan = size // max(len(keys), 1)
+        uniforms = np.empty((self._NSIM, size))
+        for j, key in enumerate(keys):
+            # the default uniforms of a loan come first in its stream, so they do not depend on prepayment
+            uniforms[:, j::len(keys)] = loanGenerator(self._seed, key).random((per_loan, self._NSIM)).T
+        return uniforms
+
+    # the last period of each path: the last period in which a loan ends (at least 1), as PoolSchedule.poolCashFlows
+    def lastPeriod(self):
+        ended = self._ends > 0
+        last = self._periods - 1 - np.argmax(ended[:, ::-1], axis=1)
+        return np.maximum(np.where(ended.any(axis=1), last, 0), 1)
+
+    # the pool cash flows of the paths as PoolPaths, for any StructuredSecurities
+    def paths(self):
+        return PoolPaths(self._cash.copy(), self._principal.copy(), self.lastPeriod(),
+                         self._balance.copy() if self._collateral else None)
+
+    # the average [DIRR, AL] of each tranche over the paths of the pool as it is now
+    def averageDIRR_AL(self, structured_securities, backend='numpy'):
+        return self.paths().averageDIRR_AL(structured_securities, backend=backend)
+
+    def __len__(self):
+        return len(self._loans)
+
+    # the loans in the pool as a LoanPool, in the order they were added
+    @property
+    def loanpool(self):
+        return LoanPool(list(self._loans.values()), self._hazard)
+
+    @property
+    def keys(self):
+        return list(self._loans)
+
+    @property
+    def periods(self):
+        return self._periods
+
+    @property
+    def seed(self):
+        return self._seed
@@ -0,0 +1,69 @@
+"""
+A small blocking client for the local job server in simulations.job_server, standing in for a front end
+"""
+import http.client
+import json
+import socket
+
+
+# http.client over a unix socket
+class _UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super(_UnixHTTPConnection, self).__init__('localhost')
+        self._path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self._path)
+
+
+class JobClient(object):
+    def __init__(self, host='127.0.0.1', port=8765, path=None):
+        self._host = host
+        self._port = port
+        self._path = path  # unix socket of the server, used instead of host:port if given
+
+    def _connect(self):
+        if self._path is not None:
+            return _UnixHTTPConnection(self._path)
+        return http.client.HTTPConnection(self._host, self._port)
+
+    def _request(self, method, url, payload=None):
+        connection = self._connect()
+        body = json.dumps(payload) if payload is not None else None
+        connection.request(method, url, body, {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        result = json.loads(response.read())
+        connection.close()
+        if response.status >= 400:
+            raise RuntimeError(result.get('error'))
+        return result
+
+    # submit a job, returns its id; tranches are (face percent, rate, subordination, coeff), runMonte's by default
+    def submit(self, tape, tranches=None, mode='Sequential', tolerance=0.005, NSIM=100, seed=None):
+        return self._request('POST', '/jobs', {'tape': tape, 'tranches': tranches, 'mode': mode,
+                                               'tolerance': tolerance, 'NSIM': NSIM, 'seed': seed})['id']
+
+    def jobs(self):
+        return self._request('GET', '/jobs')
+
+    def status(self, job_id):
+        return self._request('GET', f'/jobs/{job_id}')
+
+    def cancel(self, job_id):
+        return self._request('DELETE', f'/jobs/{job_id}')
+
+    # yields every progress record of the job as it happens; the last one is the final status and result
+    def events(self, job_id):
+        connection = self._connect()
+        connection.request('GET', f'/jobs/{job_id}/events')
+        response = connection.getresponse()
+        for line in response:
+            yield json.loads(line)
+        connection.close()
+
+    # wait for the job to finish and return its final status
+    def result(self, job_id):
+        for _ in self.events(job_id):
+            pass
+        return self.status(job_id)
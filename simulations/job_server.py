@@ -0,0 +1,266 @@
+"""
+A local asyncio job server for pricing requests. A job is a loan tape csv plus a tranche structure; it is solved the
+way runMonte solves its rates, on one process pool shared by all jobs, with a bounded number of jobs running at once.
+Progress (iteration, rates, diff) is streamed while a job runs, jobs can be cancelled, and results come back as JSON.
+Every worker process keeps the tapes it has loaded and their PoolSchedule, so jobs on the same tape share them.
+
+It speaks plain HTTP on a local TCP port or a unix socket, simulations.job_client.JobClient is the matching client:
+POST   /jobs              {"tape": "Loan Test/Loans.csv", "tranches": [[face percent, rate, subordination, coeff]],
+                           "mode": "Sequential", "tolerance": 0.005, "NSIM": 100, "seed": 1}  ->  {"id": 1}
+GET    /jobs              every job
+GET    /jobs/<id>         status, progress so far, result or error
+GET    /jobs/<id>/events  the progress as newline delimited JSON, streamed until the job is finished
+DELETE /jobs/<id>         cancel the job
+
+run it with: python -m simulations.job_server --port 8765 --workers 4
+"""
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from simulations.monte import _solveRates
+from simulations.pool_paths import simulatePoolPaths
+from utils.random_streams import newSeed
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import multiprocessing
+import os
+import queue
+
+_tapes = {}  # tape file name -> (modified time, LoanPool, PoolSchedule), kept by each worker process
+
+
+class JobCancelled(Exception):
+    pass
+
+
+# the tape's LoanPool and PoolSchedule, loaded once per worker process and reloaded if the file changes
+def _loadTape(tape):
+    modified = os.path.getmtime(tape)
+    if tape not in _tapes or _tapes[tape][0] != modified:
+        loanpool = LoanPool.readLoansFromCSV(tape)
+        _tapes[tape] = (modified, loanpool, PoolSchedule(loanpool))
+    return _tapes[tape][1], _tapes[tape][2]
+
+
+# Solve one job inside a worker process. Every iteration simulates the next NSIM pool paths of the job's seed from the
+# cached schedule, puts its progress on the progress queue and stops if the cancel event has been set
+def _runJob(spec, progress, cancel):
+    loanpool, schedule = _loadTape(spec['tape'])
+    structured_securities = StructuredSecurities(loanpool.totalPrincipal())
+    structured_securities.mode = spec.get('mode', 'Sequential')
+    NSIM = spec.get('NSIM', 100)
+
+    def simulate(seed, start):
+        if cancel.is_set():
+            raise JobCancelled()
+        return simulatePoolPaths(loanpool, NSIM, schedule, seed, start).averageDIRR_AL(structured_securities)
+
+    def callback(iteration, rates, diff):
+        progress.put({'iteration': iteration, 'rates': [float(rate) for rate in rates], 'diff': float(diff)})
+
+    result = _solveRates(structured_securities, spec.get('tolerance', 0.005), NSIM, simulate, callback=callback,
+                         tranches=spec.get('tranches'), seed=spec['seed'])
+    return [{'DIRR': float(DIRR), 'AL': float(AL), 'rating': rating, 'rate': float(rate)}
+            for DIRR, AL, rating, rate in result]
+
+
+# Every record on the progress queue so far, without waiting for more. Each call on a Manager queue is a round trip
+# to the manager process, so the server runs this in a thread rather than in the event loop
+def _drain(progress):
+    records = []
+    while True:
+        try:
+            records.append(progress.get_nowait())
+        except queue.Empty:
+            return records
+
+
+class Job(object):
+    def __init__(self, job_id, spec):
+        self.id = job_id
+        self.spec = spec
+        self.status = 'queued'  # queued, running, done, failed or cancelled
+        self.progress = []
+        self.result = None
+        self.error = None
+        self.cancelEvent = None  # set once the job is running
+        self.changed = asyncio.Condition()
+
+    @property
+    def finished(self):
+        return self.status in {'done', 'failed', 'cancelled'}
+
+    async def notify(self):
+        async with self.changed:
+            self.changed.notify_all()
+
+    def toJSON(self):
+        return {'id': self.id, 'status': self.status, 'spec': self.spec, 'progress': self.progress,
+                'result': self.result, 'error': self.error}
+
+
+class JobServer(object):
+    def __init__(self, maxWorkers=None, maxJobs=None):
+        self._executor = ProcessPoolExecutor(maxWorkers)
+        self._manager = multiprocessing.Manager()
+        self._slots = asyncio.Semaphore(maxJobs or maxWorkers or os.cpu_count())  # jobs running at once
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._server = None
+
+    # listen on a unix socket if a path is given, otherwise on host:port (port 0 picks a free one)
+    # returns the address the server is listening on
+    async def start(self, host='127.0.0.1', port=0, path=None):
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path)
+        else:
+            self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()
+
+    async def serveForever(self):
+        await self._server.serve_forever()
+
+    async def close(self):
+        for job in self._jobs.values():
+            self.cancel(job)
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        self._executor.shutdown(cancel_futures=True)
+        self._manager.shutdown()
+
+    def submit(self, spec):
+        if 'tape' not in spec or not os.path.exists(spec['tape']):
+            raise ValueError('Please enter an existing loan tape')
+        if spec.get('mode', 'Sequential') not in {'Sequential', 'Pro Rata'}:
+            raise ValueError('Please enter a valid mode (Sequential/Pro Rata)')
+        spec = dict(spec)
+        if spec.get('seed') is None:
+            spec['seed'] = newSeed()  # every job gets its own seed, and reports it
+        job = Job(next(self._ids), spec)
+        self._jobs[job.id] = job
+        asyncio.get_running_loop().create_task(self._run(job))
+        return job
+
+    # a queued job is dropped straight away, a running one stops at the end of its current iteration
+    def cancel(self, job):
+        if job.status == 'queued':
+            job.status = 'cancelled'
+            asyncio.get_running_loop().create_task(job.notify())
+        elif job.status == 'running':
+            job.cancelEvent.set()
+
+    async def _run(self, job):
+        async with self._slots:
+            if job.status != 'queued':
+                return
+            job.status = 'running'
+            job.cancelEvent = self._manager.Event()
+            progress = self._manager.Queue()
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self._executor, _runJob, job.spec, progress, job.cancelEvent)
+            while True:
+                done = future.done()
+                records = await loop.run_in_executor(None, _drain, progress)
+                if records:
+                    job.progress.extend(records)
+                    await job.notify()
+                if done:
+                    break
+                await asyncio.wait([future], timeout=0.1)
+            try:
+                job.result = future.result()
+                job.status = 'done'
+            except JobCancelled:
+                job.status = 'cancelled'
+            except Exception as error:
+                logging.error(f'Job {job.id} failed: {error!r}')
+                job.error = repr(error)
+                job.status = 'failed'
+            await job.notify()
+
+    # one HTTP request per connection
+    async def _handle(self, reader, writer):
+        try:
+            method, target, _ = (await reader.readline()).decode().split(' ', 2)
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode().strip()
+                if not line:
+                    break
+                name, value = line.split(':', 1)
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            await self._route(method, target.rstrip('/').split('/')[1:], body, writer)
+        except Exception as error:
+            self._respond(writer, 400, {'error': repr(error)})
+        finally:
+            await writer.drain()
+            writer.close()
+
+    async def _route(self, method, parts, body, writer):
+        job = self._jobs.get(int(parts[1])) if len(parts) > 1 and parts[1].isdigit() else None
+        if parts == ['jobs'] and method == 'POST':
+            try:
+                self._respond(writer, 201, {'id': self.submit(json.loads(body or b'{}')).id})
+            except ValueError as error:
+                self._respond(writer, 400, {'error': str(error)})
+        elif parts == ['jobs'] and method == 'GET':
+            self._respond(writer, 200, [job.toJSON() for job in self._jobs.values()])
+        elif job is None:
+            self._respond(writer, 404, {'error': 'No such job'})
+        elif len(parts) == 2 and method == 'GET':
+            self._respond(writer, 200, job.toJSON())
+        elif len(parts) == 2 and method == 'DELETE':
+            self.cancel(job)
+            self._respond(writer, 202, {'id': job.id, 'status': job.status})
+        elif parts[2:] == ['events'] and method == 'GET':
+            await self._stream(job, writer)
+        else:
+            self._respond(writer, 404, {'error': 'Not found'})
+
+    # send each progress record as it comes in, then the final state of the job
+    async def _stream(self, job, writer):
+        writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: application/x-ndjson\r\nConnection: close\r\n\r\n')
+        sent = 0
+        while True:
+            async with job.changed:
+                if sent == len(job.progress) and not job.finished:
+                    await job.changed.wait()
+            for record in job.progress[sent:]:
+                writer.write(json.dumps(record).encode() + b'\n')
+            sent = len(job.progress)
+            await writer.drain()
+            if job.finished and sent == len(job.progress):
+                break
+        writer.write(json.dumps({'status': job.status, 'result': job.result, 'error': job.error}).encode() + b'\n')
+
+    @staticmethod
+    def _respond(writer, status, payload):
+        body = json.dumps(payload).encode()
+        writer.write(f'HTTP/1.1 {status} {"OK" if status < 400 else "Error"}\r\nContent-Type: application/json\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body)
+
+
+async def main(args):
+    server = JobServer(args.workers, args.max_jobs)
+    address = await server.start(args.host, args.port, args.socket)
+    logging.warning(f'Job server listening on {address}')
+    try:
+        await server.serveForever()
+    finally:
+        await server.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local pricing job server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--socket', default=None, help='serve on this unix socket instead of host:port')
+    parser.add_argument('--workers', type=int, default=None, help='processes in the shared pool')
+    parser.add_argument('--max-jobs', type=int, default=None, help='jobs running at once')
+    asyncio.run(main(parser.parse_args()))
@@ -1,69 +1,138 @@
 from simulations.simulate_waterfall import simulateWaterfall
 from simulations.simulation_parallel import runSimulationParallel
+from simulations.simulation_distributed import runSimulationDistributed
+from simulations.pool_paths import expectedDIRR_AL
+from simulations.checkpoint import MonteCheckpoint
+from utils.random_streams import newSeed
 from liabilities.tranche_base import Tranche
+import copy
+import logging
 
 '''
 For flexibility, I think pass in the tranche percent and rates as two arguments for the function
 might be better. 
-'''
 
+checkpoint: optional file name; the solver state is saved there every checkpointEvery iterations and when it
+converges. If the file already exists the run resumes from it, and if it holds a converged run (or one with a
+different tolerance or NSIM) the new run warm starts from its rates instead of from the initial rates.
+initialRates: optional starting rates of the two tranches, e.g. MonteCheckpoint.load(filename).rates
+callback: optional callback(iteration, rates, diff) called after every iteration, e.g. to report progress
+seed: optional master seed; every iteration simulates the next NSIM paths of it, so a run is reproducible
+warmStart: start from the rates runExpected finds (when no initialRates are given), so the Monte Carlo iterations
+only refine rates that are already close
+'''
 
-def runMonte(loanpool, structured_securities, tolerance, NSIM):
-    # Because we are given the predetermined rates, so initialize inside the functions
-    tranche_percent = [0.8, 0.2]
-    coeff = [1.2, 0.8]  # Tranche A has coeff of 1.2, Tranche B has coeff of 0.8
-    rates = [0.05, 0.08]  # Tranche A has rate of 5%, Tranche B has rate of 8%
-    structured_securities.addTranche(tranche_percent[0], rates[0], 0)
-    structured_securities.addTranche(tranche_percent[1], rates[1], 1)
-    while True:
-        new_rates = []  # reset the new_rates every time
-        yields = []  # Tranche A has rate of 5%, Tranche B has rate of 8%
-        for index, tranche in enumerate(structured_securities.trancheList):
-            tranche.rate = rates[index]  # give each tranche a new rate based on the original or modified rate
-        average_DIRR_AL = simulateWaterfall(loanpool, structured_securities, NSIM)
-        yields.append(Tranche.calculateYield(average_DIRR_AL[0][0], average_DIRR_AL[0][1]))
-        yields.append(Tranche.calculateYield(average_DIRR_AL[1][0], average_DIRR_AL[1][1]))
-        for index, tranches in enumerate(structured_securities.trancheList):
-            new_rates.append(Tranche.newTrancheRate(tranches.rate, coeff[index], yields[index]))
-        diffs = Tranche.diff(tranche_percent, rates, new_rates)
-        if diffs < tolerance:
-            break
-        rates = new_rates  # modify the tranche rate to reflect the yields, return to the while loop
+# the tranches runMonte solves the rates for: (face percent, initial rate, subordination, coeff)
+# Tranche A takes 80% with a rate of 5% and coeff of 1.2, Tranche B takes 20% with a rate of 8% and coeff of 0.8
+defaultTranches = [(0.8, 0.05, 0, 1.2), (0.2, 0.08, 1, 0.8)]
 
-    for index, tranche in enumerate(structured_securities.trancheList):
-        # now append the rating and the rate of each tranche to the result list
-        average_DIRR_AL[index].append(Tranche.DIRR_Rating(average_DIRR_AL[index][0]))
-        average_DIRR_AL[index].append(tranche.rate)
 
-    return average_DIRR_AL  # output the DIRR, Rating, WAL, and rate of each tranche
+def runMonte(loanpool, structured_securities, tolerance, NSIM, checkpoint=None, checkpointEvery=1,
+             initialRates=None, callback=None, seed=None, warmStart=False):
+    if warmStart and initialRates is None:
+        initialRates = expectedRates(loanpool, structured_securities, tolerance)
+    return _solveRates(structured_securities, tolerance, NSIM,
+                       lambda seed, start: simulateWaterfall(loanpool, structured_securities, NSIM, seed, start),
+                       checkpoint, checkpointEvery, initialRates, callback, seed=seed,
+                       pool=poolKey(loanpool) if checkpoint is not None else None)
 
 
 # The only modification here with runMonteParallel is using the runSimulationParallel() instead of
 # the simulateWaterfall to get the average_DIRR_AL
 
-def runMonteParallel(loanpool, structured_securities, tolerance, NSIM, numProcesses):
-    # Because we are given the predetermined rates, so initialize inside the functions
-    tranche_percent = [0.8, 0.2]  # initialize Tranche A to take 80%, could be changed later
-    coeff = [1.2, 0.8]  # Tranche A has coeff of 1.2, Tranche B has coeff of 0.8
-    rates = [0.05, 0.08]  # Tranche A has rate of 5%, Tranche B has rate of 8%
-    structured_securities.addTranche(tranche_percent[0], rates[0], 0)
-    structured_securities.addTranche(tranche_percent[1], rates[1], 1)
+def runMonteParallel(loanpool, structured_securities, tolerance, NSIM, numProcesses, checkpoint=None,
+                     checkpointEvery=1, initialRates=None, callback=None, seed=None, warmStart=False):
+    if warmStart and initialRates is None:
+        initialRates = expectedRates(loanpool, structured_securities, tolerance)
+    # because the tranches are already sorted, so we don't have to worry about the order
+    return _solveRates(structured_securities, tolerance, NSIM,
+                       lambda seed, start: runSimulationParallel(loanpool, structured_securities, NSIM, numProcesses,
+                                                                 seed, start),
+                       checkpoint, checkpointEvery, initialRates, callback, seed=seed,
+                       pool=poolKey(loanpool) if checkpoint is not None else None)
+
+
+# runMonte on the expected pool cash flows (expectedDIRR_AL) instead of simulated paths: every iteration is one
+# deterministic run of the tranche waterfall, so it solves in a fraction of a second. A screening estimate of the
+# [DIRR, AL, rating, rate] of each tranche, the same layout as runMonte
+def runExpected(loanpool, structured_securities, tolerance, initialRates=None, callback=None):
+    schedule = loanpool.schedule()
+    return _solveRates(structured_securities, tolerance, 1,
+                       lambda seed, start: expectedDIRR_AL(loanpool, structured_securities, schedule),
+                       initialRates=initialRates, callback=callback)
+
+
+# the rates runExpected finds, solved on a copy of structured_securities so its tranches are left alone
+def expectedRates(loanpool, structured_securities, tolerance):
+    return [tranche[-1] for tranche in runExpected(loanpool, copy.deepcopy(structured_securities), tolerance)]
+
+
+# runMonte over the workers of a SimulationCoordinator (simulations.simulation_distributed), which already holds
+# the loan pool, so it can scale beyond one machine
+def runMonteDistributed(coordinator, structured_securities, tolerance, NSIM, checkpoint=None, checkpointEvery=1,
+                        initialRates=None, callback=None, seed=None):
+    return _solveRates(structured_securities, tolerance, NSIM,
+                       lambda seed, start: runSimulationDistributed(coordinator, structured_securities, NSIM, seed,
+                                                                    start),
+                       checkpoint, checkpointEvery, initialRates, callback, seed=seed)
+
+
+# the content hash of a loan pool a checkpoint keeps, see ResultCache.describePool
+# (imported here: simulations.result_cache imports this module)
+def poolKey(loanpool):
+    from simulations.result_cache import ResultCache
+    return ResultCache.key(ResultCache.describePool(loanpool))
+
+
+# The fixed point iteration shared by runMonte and runMonteParallel, simulate(seed, start) returns the average DIRR
+# and AL of NSIM paths of the seed starting at path start. tranches defaults to defaultTranches, the tranches are
+# added to structured_securities before solving. pool is the content hash of the loan pool a new checkpoint keeps
+def _solveRates(structured_securities, tolerance, NSIM, simulate, checkpoint=None, checkpointEvery=1,
+                initialRates=None, callback=None, tranches=None, seed=None, pool=None):
+    tranches = sorted(tranches or defaultTranches, key=lambda tranche: tranche[2])  # in order of subordination
+    tranche_percent = [tranche[0] for tranche in tranches]
+    coeff = [tranche[3] for tranche in tranches]
+    rates = initialRates or [tranche[1] for tranche in tranches]
+
+    state = MonteCheckpoint.loadIfExists(checkpoint)
+    if state is None:
+        state = MonteCheckpoint(rates, tolerance, NSIM, seed if seed is not None else newSeed(), pool)
+    else:
+        if pool is not None and state.pool is not None and state.pool != pool:
+            # the iterations of another pool can not go into the history of this one
+            msg = f'Checkpoint {checkpoint} was run on a different loan pool'
+            logging.error(msg)
+            raise ValueError(msg)
+        if state.pool is None:
+            state.pool = pool  # a checkpoint that does not record its pool is taken to be of this one
+        if seed is not None and seed != state.seed:
+            # the paths of a checkpoint always come from its own seed
+            logging.warning(f'Checkpoint {checkpoint} was run with seed {state.seed}, the seed {seed} is ignored')
+        if state.converged or state.tolerance != tolerance or state.NSIM != NSIM:
+            state.warmStart(tolerance, NSIM)  # a new run starting from the rates found last time, on fresh paths
+    # an interrupted run picks up exactly where it stopped: same seed, next path
+
+    for tranche, rate in zip(tranches, state.rates):
+        structured_securities.addTranche(tranche[0], rate, tranche[2])
     while True:
-        new_rates = []  # reset the new_rates every time
-        yields = []  # initialize the yields, reset yields every time
+        rates = state.rates
         for index, tranche in enumerate(structured_securities.trancheList):
             tranche.rate = rates[index]  # give each tranche a new rate based on the original or modified rate
-        # because the tranches are already sorted, so we don't have to worry about the order
-        average_DIRR_AL = runSimulationParallel(loanpool, structured_securities, NSIM, numProcesses)
-        yields.append(Tranche.calculateYield(average_DIRR_AL[0][0], average_DIRR_AL[0][1]))
-        yields.append(Tranche.calculateYield(average_DIRR_AL[1][0], average_DIRR_AL[1][1]))
-        for index, tranches in enumerate(structured_securities.trancheList):
-            # call the class method of newTrancheRate to get the new rates based on current rate, coeff and yields
-            new_rates.append(Tranche.newTrancheRate(tranches.rate, coeff[index], yields[index]))
+        average_DIRR_AL = simulate(state.seed, state.paths)
+        yields = [Tranche.calculateYield(DIRR, AL) for DIRR, AL in average_DIRR_AL]
+        # call the class method of newTrancheRate to get the new rates based on current rate, coeff and yields
+        new_rates = [Tranche.newTrancheRate(tranche.rate, coeff[index], yields[index])
+                     for index, tranche in enumerate(structured_securities.trancheList)]
         diffs = Tranche.diff(tranche_percent, rates, new_rates)
-        if diffs < tolerance:
+        state.converged = diffs < tolerance
+        # once converged the rates stay where they are, otherwise they move to reflect the yields
+        state.record(rates, average_DIRR_AL, diffs, rates if state.converged else new_rates, NSIM)
+        if checkpoint is not None and (state.converged or state.iteration % checkpointEvery == 0):
+            state.save(checkpoint)
+        if callback is not None:
+            callback(state.iteration, rates, diffs)
+        if state.converged:
             break  # if diff calculated is smaller than tolerance, break the loop
-        rates = new_rates  # modify the tranche rate to reflect the yields, return to the while loop
 
     for index, tranche in enumerate(structured_securities.trancheList):
         # now append the rating and the rate of each tranche to the result list
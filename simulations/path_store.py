@@ -0,0 +1,125 @@
+"""
+PathStore keeps the per-path tranche cash flows of a simulation on disk so that single paths can be analysed after
+the run (e.g. the worst 1% of junior outcomes) without running doWaterfall again. The store is a directory of
+preallocated memory-mapped .npy files with a layout fixed when it is created:
+
+    interest, principal, balance    paths x tranches x periods
+    metrics                         paths x tranches x 3 ([DIRR, AL, loss], see simulate_waterfall.iterPathMetrics)
+    last_period                     paths
+
+Path p of the run is row p - start. Every process of a parallel run opens the same files and writes only the rows
+of its own paths, straight into the mapped pages (a PathStore pickles as its directory, not its data)
+"""
+from liabilities.structured_securities import StructuredSecurities
+import numpy as np
+import json
+import os
+import logging
+
+
+class PathStore(object):
+    arrays = ('interest', 'principal', 'balance', 'metrics', 'last_period')
+
+    def __init__(self, directory, mode='r'):
+        self._directory = directory
+        self._mode = mode
+        with open(os.path.join(directory, 'meta.json')) as fp:
+            self._meta = json.load(fp)
+        for name in self.arrays:
+            setattr(self, '_' + name, np.load(os.path.join(directory, name + '.npy'), mmap_mode=mode))
+
+    # pickle as the directory, so worker processes map the same files instead of receiving a copy of the data
+    def __reduce__(self):
+        return PathStore, (self._directory, 'r+')
+
+    def __len__(self):
+        return self._meta['paths']
+
+    # preallocate a store for NSIM paths numbered from start, of the tranches of the structured securities and
+    # `periods` periods (period 0 included: the longest loan term + 1, i.e. PoolSchedule(loanpool).periods)
+    @classmethod
+    def create(cls, directory, NSIM, structured_securities, periods, seed=None, start=0):
+        if not isinstance(structured_securities, StructuredSecurities):
+            logging.error('Please enter the correct class type')
+            raise TypeError('Please enter the correct class type')
+        tranches = len(structured_securities.trancheList)
+        os.makedirs(directory, exist_ok=True)
+        shapes = {'interest': (NSIM, tranches, periods), 'principal': (NSIM, tranches, periods),
+                  'balance': (NSIM, tranches, periods), 'metrics': (NSIM, tranches, 3), 'last_period': (NSIM,)}
+        for name in cls.arrays:
+            dtype = np.int32 if name == 'last_period' else np.float64
+            np.lib.format.open_memmap(os.path.join(directory, name + '.npy'), 'w+', dtype, shapes[name]).flush()
+        with open(os.path.join(directory, 'meta.json'), 'w') as fp:
+            json.dump({'paths': NSIM, 'tranches': tranches, 'periods': periods, 'seed': seed, 'start': start,
+                       'faces': [tranche.face for tranche in structured_securities.trancheList],
+                       'rates': [tranche.rate for tranche in structured_securities.trancheList]}, fp)
+        return cls(directory, 'r+')
+
+    # write path `path` (numbered like the simulation) from its structured securities waterfall and its
+    # [DIRR, AL, loss] per tranche; periods after the last one keep zero flows and the final balance
+    def record(self, path, structured_securities_waterfall, metrics):
+        row = path - self._meta['start']
+        if not 0 <= row < len(self):
+            logging.error('Path {} is not in this store'.format(path))
+            raise IndexError('Path {} is not in this store'.format(path))
+        if len(structured_securities_waterfall) > self._meta['periods']:
+            logging.error('The path has {} periods, the store only {}'.format(len(structured_securities_waterfall),
+                                                                             self._meta['periods']))
+            raise ValueError('The path is longer than the periods of the store')
+        # periods x tranches x [balance, interest due, interest paid, interest shortfall, principal paid]
+        waterfall = np.asarray(structured_securities_waterfall, dtype=float)
+        last = len(waterfall)
+        self._interest[row, :, :last] = waterfall[:, :, 2].T
+        self._principal[row, :, :last] = waterfall[:, :, 4].T
+        self._balance[row, :, :last] = waterfall[:, :, 0].T
+        self._balance[row, :, last:] = waterfall[-1, :, 0][:, None]
+        self._metrics[row] = metrics
+        self._last_period[row] = last - 1
+
+    def flush(self):
+        for name in self.arrays:
+            getattr(self, '_' + name).flush()
+
+    # the flows of one path (numbered like the simulation): a dict of the arrays, tranches x periods
+    def path(self, path):
+        row = path - self._meta['start']
+        return {'interest': self._interest[row], 'principal': self._principal[row], 'balance': self._balance[row],
+                'metrics': self._metrics[row], 'lastPeriod': int(self._last_period[row])}
+
+    # the path numbers ordered from the worst to the best outcome of a tranche by a metric ('DIRR', 'AL' or 'loss';
+    # a larger value is worse for all three)
+    def rankPaths(self, tranche, metric='DIRR'):
+        values = self._metrics[:, tranche, ('DIRR', 'AL', 'loss').index(metric)]
+        return np.argsort(-values, kind='stable') + self._meta['start']
+
+    # the path numbers of the worst `fraction` of the paths of a tranche by a metric, worst first
+    def worstPaths(self, tranche, fraction=0.01, metric='DIRR'):
+        return self.rankPaths(tranche, metric)[:max(int(np.ceil(fraction * len(self))), 1)]
+
+    @property
+    def directory(self):
+        return self._directory
+
+    @property
+    def meta(self):
+        return self._meta
+
+    @property
+    def interest(self):
+        return self._interest
+
+    @property
+    def principal(self):
+        return self._principal
+
+    @property
+    def balance(self):
+        return self._balance
+
+    @property
+    def metrics(self):
+        return self._metrics
+
+    @property
+    def lastPeriod(self):
+        return self._last_period
@@ -0,0 +1,122 @@
+"""
+PoolPaths holds the simulated pool cash flows of NSIM default paths: the cash available and principal due in every
+period plus the last period of each path. The pool side of a simulation does not depend on the deal structure, so one
+set of paths can be reused by any number of StructuredSecurities through doTrancheWaterfall
+"""
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from utils.waterfall import doTrancheWaterfall
+from utils.waterfall_backends import getBackend
+from utils.random_streams import newSeed, pathUniforms
+from simulations.simulate_waterfall import averageDIRR_AL
+import numpy as np
+import math
+import logging
+
+
+class PoolPaths(object):
+    def __init__(self, cash, principal, last_period, collateral=None):
+        self._cash = cash  # paths x periods
+        self._principal = principal  # paths x periods
+        self._lastPeriod = last_period  # paths
+        self._collateral = collateral  # pool balance, paths x periods, only for waterfall specs with an OC test
+
+    def __len__(self):
+        return len(self._lastPeriod)
+
+    # run the tranche waterfall of the given structured securities along one path, returns the doWaterfall metrics
+    def doWaterfall(self, index, structured_securities):
+        return self._trancheWaterfall(index, structured_securities)[2]
+
+    def _trancheWaterfall(self, index, structured_securities):
+        structured_securities.reset()
+        return doTrancheWaterfall(self._cash[index].tolist(), self._principal[index].tolist(),
+                                  int(self._lastPeriod[index]), structured_securities,
+                                  self._collateral[index].tolist() if self._collateral is not None else None)
+
+    # [DIRR, AL] of each tranche on each path, an array of paths x tranches x 2 like simulatePathMetrics
+    # with a PathStore the tranche flows of path index are recorded as path start + index
+    # backend runs the paths on that compute backend instead (see utils.waterfall_backends), without a store
+    def pathDIRR_AL(self, structured_securities, store=None, start=0, backend=None):
+        if backend is not None and store is None:
+            return getBackend(backend).pathDIRR_AL(self._cash, self._principal, self._lastPeriod,
+                                                   structured_securities, self._collateral)
+        path_metrics = np.zeros((len(self), len(structured_securities.trancheList), 2))
+        for index in range(len(self)):
+            waterfall, _, metrics = self._trancheWaterfall(index, structured_securities)
+            for i, tranche_metric in enumerate(metrics):
+                # if AL is infinite, get rid of the AL, only add up the DIRR to get the average
+                path_metrics[index, i] = [tranche_metric[1], tranche_metric[2] if tranche_metric[2] != math.inf else 0]
+            if store is not None:
+                losses = [waterfall[-1][i][0] / tranche.face
+                          for i, tranche in enumerate(structured_securities.trancheList)]
+                store.record(start + index, waterfall, np.column_stack([path_metrics[index], losses]))
+        if store is not None:
+            store.flush()
+        return path_metrics
+
+    # the same average [DIRR, AL] per tranche that simulateWaterfall gives, over all the paths
+    def averageDIRR_AL(self, structured_securities, backend=None):
+        return averageDIRR_AL(self.pathDIRR_AL(structured_securities, backend=backend))
+
+    # the first NSIM paths
+    def head(self, NSIM):
+        return PoolPaths(self._cash[:NSIM], self._principal[:NSIM], self._lastPeriod[:NSIM],
+                         self._collateral[:NSIM] if self._collateral is not None else None)
+
+    # paths start..stop-1
+    def slice(self, start, stop):
+        return PoolPaths(self._cash[start:stop], self._principal[start:stop], self._lastPeriod[start:stop],
+                         self._collateral[start:stop] if self._collateral is not None else None)
+
+    # the paths of both, this one first (the collateral is kept only if both have it)
+    def merge(self, other):
+        collateral = np.concatenate([self._collateral, other.collateral]) \
+            if self._collateral is not None and other.collateral is not None else None
+        return PoolPaths(np.concatenate([self._cash, other.cash]), np.concatenate([self._principal, other.principal]),
+                         np.concatenate([self._lastPeriod, other.lastPeriod]), collateral)
+
+    @property
+    def cash(self):
+        return self._cash
+
+    @property
+    def principal(self):
+        return self._principal
+
+    @property
+    def lastPeriod(self):
+        return self._lastPeriod
+
+    @property
+    def collateral(self):
+        return self._collateral
+
+
+# simulate NSIM default paths of the loan pool at array speed: the no-default schedule is built once, then every
+# path only needs one uniform per loan to place its default period (and one more for its prepayment period when the
+# pool has CPR curves)
+# path i uses its own random stream of the seed (the same paths simulateWaterfall draws for that seed), and start
+# numbers the first path so a later call can add more paths to a run
+# backend builds the pool cash flows on that compute backend (see utils.waterfall_backends), and collateral=True
+# also keeps the pool balance of every path, for waterfall specs with an OC test
+def simulatePoolPaths(loanpool, NSIM, schedule=None, seed=None, start=0, backend=None, collateral=False):
+    if not isinstance(loanpool, LoanPool):
+        logging.error('Please enter the correct class type')
+    schedule = schedule if schedule is not None else PoolSchedule(loanpool)
+    seed = seed if seed is not None else newSeed()
+    default_times, prepay_times = schedule.eventTimes(pathUniforms(seed, start, NSIM, schedule.randomsPerPath))
+    flows = getBackend(backend).poolCashFlows(schedule, default_times, prepay_times) if backend is not None \
+        else schedule.poolCashFlows(default_times, prepay_times=prepay_times)
+    return PoolPaths(*flows, schedule.poolBalance(default_times, prepay_times) if collateral else None)
+
+
+# The [DIRR, AL] of each tranche on the expected pool cash flows (PoolSchedule.expectedCashFlows): one deterministic
+# run of the tranche waterfall instead of Monte Carlo, for screening and as a starting point for runMonte. DIRR is
+# not linear in the pool cash flows, so this approximates the simulated average rather than estimating it: the
+# losses of a few bad paths are spread thin over the expected path, which can understate the tranches that only
+# lose on those paths. A waterfall spec with an OC test runs on the expected pool balance
+def expectedDIRR_AL(loanpool, structured_securities, schedule=None, backend='numpy'):
+    schedule = schedule if schedule is not None else loanpool.schedule()
+    expected = PoolPaths(*schedule.expectedCashFlows(collateral=structured_securities.spec.needsCollateral))
+    return expected.pathDIRR_AL(structured_securities, backend=backend)[0].tolist()
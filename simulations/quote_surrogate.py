@@ -0,0 +1,301 @@
+"""
+QuoteSurrogate gives indicative runMonte answers for one loan pool in milliseconds. It keeps the runs made on the pool
+as samples (the face percent and rate of every tranche in, the average DIRR and AL of every tranche out, for each
+waterfall mode or spec), fits a local linear regression through the samples nearest to a structure, and runs the
+runMonte fixed point iteration (_solveRates) on the fitted values instead of on simulated paths.
+
+Every quote comes with an error estimate: the leave-one-out error of the samples around it (how far each of them is
+from what the others predict) together with their Monte Carlo standard error, carried over to the rate through
+Tranche.calculateYield. A quote is trusted when its structure is inside the range of the samples, close enough to one
+of them and its rate error is small enough. Otherwise the rates are solved on simulated paths, starting from the rates
+of the surrogate, and every iteration of that solve becomes a new sample, so the surrogate fills in where the quotes
+are asked for.
+
+The simulations all run on the same NSIM pool paths of the seed (like runScenarioGrid), which keeps the
+fitted surface smooth in the rates and percents. Those paths stand in for runMonte, which draws new paths every
+iteration, so the answers agree with runMonte up to its Monte Carlo error. The samples can be saved and loaded again
+for the same pool
+"""
+from liabilities.tranche_base import Tranche
+from liabilities.waterfall_spec import builtinSpecs
+from simulations.pool_paths import simulatePoolPaths
+from simulations.simulate_waterfall import averageDIRR_AL
+from simulations.monte import _solveRates, defaultTranches
+from simulations.checkpoint import MonteCheckpoint
+from simulations.result_cache import ResultCache
+from utils.random_streams import newSeed
+import numpy as np
+import copy
+import itertools
+import os
+import pickle
+import time
+import logging
+
+# samples in each local fit, at least twice the coefficients of the fit
+NEIGHBOURS = 12
+# the farthest a trusted quote may be from its nearest sample, in ranges of the samples along every input
+MAX_DISTANCE = 0.25
+# the largest estimated rate error of a trusted quote, per tranche
+MAX_RATE_ERROR = 0.0005
+# surrogate iterations before a quote that does not converge is solved on simulated paths instead
+MAX_ITERATIONS = 200
+
+
+# the surrogate cannot answer a quote, it is simulated instead
+class _Untrusted(Exception):
+    pass
+
+
+# The two-tranche structures of a training grid: every senior face percent (the junior tranche takes the rest) with
+# every senior and junior rate
+def structureGrid(percents, seniorRates, juniorRates):
+    return [[(percent, senior, 0), (1 - percent, junior, 1)]
+            for percent, senior, junior in itertools.product(percents, seniorRates, juniorRates)]
+
+
+class _LocalModel(object):
+    # inputs (samples x inputs), outputs and their standard errors (samples x outputs)
+    def __init__(self, inputs, outputs, errors):
+        self._low, self._high = inputs.min(axis=0), inputs.max(axis=0)
+        self._scale = np.where(self._high > self._low, self._high - self._low, 1.0)
+        self._points = (inputs - self._low) / self._scale
+        self._outputs = outputs
+        self._errors = errors
+        # how far every sample is from the fit of the others
+        self._looErrors = np.array([np.abs(self._fit(point, i)[0] - outputs[i])
+                                    for i, point in enumerate(self._points)])
+
+    # The weighted linear fit at a point (scaled) through its nearest samples, leaving out sample exclude. Returns
+    # the fitted outputs, the samples used and their weights (tricube of the distance)
+    def _fit(self, point, exclude=None):
+        distance = np.linalg.norm(self._points - point, axis=1)
+        if exclude is not None:
+            distance[exclude] = np.inf
+        count = min(max(NEIGHBOURS, 2 * (len(point) + 1)), len(distance) - (exclude is not None))
+        nearest = np.argpartition(distance, count - 1)[:count]
+        radius = max(distance[nearest].max() * 1.25, 1e-12)
+        weights = (1 - (distance[nearest] / radius) ** 3) ** 3
+        root = np.sqrt(weights)[:, None]
+        design = np.hstack([np.ones((count, 1)), self._points[nearest] - point])
+        coefficients = np.linalg.lstsq(design * root, self._outputs[nearest] * root, rcond=None)[0]
+        return coefficients[0], nearest, weights
+
+    # the fitted outputs at the inputs, their estimated error and whether the inputs are in the trusted region
+    def predict(self, inputs, maxDistance):
+        point = (inputs - self._low) / self._scale
+        outputs, nearest, weights = self._fit(point)
+        weights = weights / weights.sum()
+        error = np.sqrt(weights @ self._looErrors[nearest] ** 2 + (weights @ self._errors[nearest]) ** 2)
+        inside = np.all((inputs >= self._low - 1e-9 * self._scale) & (inputs <= self._high + 1e-9 * self._scale))
+        close = np.linalg.norm(self._points - point, axis=1).min() <= maxDistance
+        return outputs, error, bool(inside and close)
+
+    def __len__(self):
+        return len(self._points)
+
+
+class QuoteSurrogate(object):
+    # the surrogate of a loan pool; the simulations run on NSIM paths of the seed (on that compute backend, see
+    # utils.waterfall_backends). A quote is trusted within maxDistance of a sample and maxRateError of its rates
+    def __init__(self, loanpool, NSIM=2000, seed=None, backend='numpy', maxDistance=MAX_DISTANCE,
+                 maxRateError=MAX_RATE_ERROR):
+        self._loanpool = loanpool
+        self._poolKey = ResultCache.key(ResultCache.describePool(loanpool))
+        self._NSIM = NSIM
+        self._seed = seed if seed is not None else newSeed()
+        self._backend = backend
+        self._maxDistance = maxDistance
+        self._maxRateError = maxRateError
+        self._poolPaths = None  # simulated when the first simulation needs them
+        self._samples = {}  # structure key: {'inputs': [...], 'outputs': [...], 'errors': [...]}
+        self._models = {}  # structure key: _LocalModel of its samples, fitted again once samples are added
+
+    # the waterfall a structure is quoted under (its mode, or its own spec), and its number of tranches
+    @staticmethod
+    def structureKey(structured_securities):
+        description = {'mode': structured_securities.mode, 'tranches': len(structured_securities.trancheList)}
+        if structured_securities.spec is not builtinSpecs.get(structured_securities.mode):
+            description['spec'] = structured_securities.spec.steps
+        return ResultCache.key(description)
+
+    # the face percent and then the rate of every tranche
+    @staticmethod
+    def _inputs(structured_securities):
+        tranches = structured_securities.trancheList
+        return [tranche.face_percent for tranche in tranches] + [tranche.rate for tranche in tranches]
+
+    # Record a run of the structure: the average [DIRR, AL] of each tranche and their standard errors (0 when not
+    # given), e.g. a simulateWaterfall result
+    def observe(self, structured_securities, average_DIRR_AL, standardErrors=None):
+        key = self.structureKey(structured_securities)
+        samples = self._samples.setdefault(key, {'inputs': [], 'outputs': [], 'errors': []})
+        samples['inputs'].append(self._inputs(structured_securities))
+        samples['outputs'].append(np.ravel(average_DIRR_AL).tolist())
+        samples['errors'].append(np.ravel(standardErrors).tolist() if standardErrors is not None
+                                 else [0.0] * len(samples['outputs'][-1]))
+        self._models.pop(key, None)
+
+    # Record the iterations of a runMonte checkpoint of this pool (see MonteCheckpoint); structured_securities gives
+    # the mode and tranches the face percents of the run (defaultTranches, as runMonte). A checkpoint of another pool,
+    # or one that does not know its pool, is a ValueError.
+    # Every iteration of runMonte averages fresh paths, so it is recorded with the standard error of its difference
+    # from the pool paths of the surrogate: the spread of the pool paths at its rates over its own NSIM paths and over
+    # the NSIM of the surrogate. An iteration on the very paths of the surrogate (same seed, paths 0..NSIM-1) has none
+    def addCheckpoint(self, filename, structured_securities, tranches=None):
+        state = MonteCheckpoint.load(filename)
+        if state.pool != self._poolKey:
+            reason = 'was run on a different loan pool' if state.pool is not None else 'does not record its loan pool'
+            logging.error('The checkpoint {} {}'.format(filename, reason))
+            raise ValueError('The checkpoint {} {}'.format(filename, reason))
+        trial = copy.deepcopy(structured_securities)
+        tranches = sorted(tranches or defaultTranches, key=lambda tranche: tranche[2])
+        start = 0
+        for entry in state.history:
+            rates, DIRR_AL, NSIM = entry[0], entry[1], entry[3] if len(entry) > 3 else state.NSIM
+            self._setTranches(trial, tranches, rates)
+            if state.seed == self._seed and start == 0 and NSIM == self._NSIM:
+                errors = None
+            else:
+                path_metrics = self._paths(trial).pathDIRR_AL(trial, backend=self._backend)
+                errors = path_metrics.std(axis=0, ddof=1) * np.sqrt(1 / NSIM + 1 / len(path_metrics)) \
+                    if len(path_metrics) > 1 else np.zeros(path_metrics.shape[1:])
+            self.observe(trial, DIRR_AL, errors)
+            start += NSIM
+
+    # Simulate every structure ([(face percent, rate, subordination), ...], see structureGrid) under the mode of
+    # structured_securities, which is left alone, to give the surrogate samples to start from
+    def train(self, structured_securities, structures):
+        trial = copy.deepcopy(structured_securities)
+        for structure in structures:
+            structure = sorted(structure, key=lambda tranche: tranche[2])
+            self._setTranches(trial, structure, [tranche[1] for tranche in structure])
+            self.simulate(trial)
+
+    # the tranches of a structure with these rates, in place of the ones it had
+    @staticmethod
+    def _setTranches(structured_securities, tranches, rates):
+        structured_securities.trancheList = []
+        for tranche, rate in zip(tranches, rates):
+            structured_securities.addTranche(tranche[0], rate, tranche[2])
+
+    # the pool paths, simulated once (again with the pool balance if a spec needs it: the same paths of the seed)
+    def _paths(self, structured_securities):
+        collateral = structured_securities.spec.needsCollateral
+        if self._poolPaths is None or (collateral and self._poolPaths.collateral is None):
+            self._poolPaths = simulatePoolPaths(self._loanpool, self._NSIM, seed=self._seed, collateral=collateral)
+        return self._poolPaths
+
+    # the average [DIRR, AL] of each tranche over the pool paths, recorded as a sample; also returns the standard
+    # errors of the averages
+    def simulateWithErrors(self, structured_securities):
+        path_metrics = self._paths(structured_securities).pathDIRR_AL(structured_securities, backend=self._backend)
+        average_DIRR_AL = averageDIRR_AL(path_metrics)
+        errors = (path_metrics.std(axis=0, ddof=1) / np.sqrt(len(path_metrics))).tolist() \
+            if len(path_metrics) > 1 else np.zeros(path_metrics.shape[1:]).tolist()
+        self.observe(structured_securities, average_DIRR_AL, errors)
+        return average_DIRR_AL, errors
+
+    def simulate(self, structured_securities):
+        return self.simulateWithErrors(structured_securities)[0]
+
+    # The fitted average [DIRR, AL] of each tranche of the structure, their estimated errors (same layout) and
+    # whether the structure is in the trusted region. None when there are too few samples of its mode to fit
+    def predict(self, structured_securities):
+        key = self.structureKey(structured_securities)
+        samples = self._samples.get(key)
+        inputs = self._inputs(structured_securities)
+        if samples is None or len(samples['inputs']) < len(inputs) + 2:
+            return None
+        if key not in self._models:
+            self._models[key] = _LocalModel(*(np.array(samples[name], dtype=float)
+                                              for name in ('inputs', 'outputs', 'errors')))
+        outputs, error, trusted = self._models[key].predict(np.array(inputs), self._maxDistance)
+        return outputs.reshape(-1, 2).tolist(), error.reshape(-1, 2).tolist(), trusted
+
+    # the error of each tranche rate from the errors of its DIRR and AL: the rates converge to their yields
+    @staticmethod
+    def rateErrors(average_DIRR_AL, errors):
+        rate_errors = []
+        for (DIRR, AL), (DIRR_error, AL_error) in zip(average_DIRR_AL, errors):
+            DIRR, AL = max(DIRR, 0.0), max(AL, 0.0)
+            base = Tranche.calculateYield(DIRR, AL)
+            rate_errors.append(abs(Tranche.calculateYield(DIRR + DIRR_error, AL) - base) +
+                               abs(Tranche.calculateYield(DIRR, AL + AL_error) - base))
+        return rate_errors
+
+    # A runMonte quote of the pool: the tranches (defaultTranches by default, as runMonte) are added to
+    # structured_securities and their rates solved to the tolerance on the surrogate, or on the pool paths when the
+    # surrogate cannot be trusted there. Returns a dict of 'result' (the [DIRR, AL, rating, rate] of each tranche, as
+    # runMonte), 'error' (the estimated [DIRR, AL, rate] error of each tranche), 'simulated' (whether it fell back
+    # to the pool paths) and 'seconds'
+    def quote(self, structured_securities, tolerance, tranches=None, initialRates=None):
+        started = time.time()
+        tranches = sorted(tranches or defaultTranches, key=lambda tranche: tranche[2])
+        trial = copy.deepcopy(structured_securities)
+        predictions = []
+
+        def predict(seed, start):
+            prediction = self.predict(trial)
+            if prediction is None or len(predictions) >= MAX_ITERATIONS:
+                raise _Untrusted()
+            predictions.append(prediction)
+            return [list(tranche) for tranche in prediction[0]]
+
+        try:
+            result = _solveRates(trial, tolerance, 1, predict, initialRates=initialRates, tranches=tranches, seed=0)
+            _, errors, trusted = predictions[-1]
+            rate_errors = self.rateErrors([tranche[:2] for tranche in result], errors)
+            if not trusted or max(rate_errors) > self._maxRateError:
+                raise _Untrusted()
+            for tranche, rate in zip(tranches, [tranche[-1] for tranche in result]):
+                structured_securities.addTranche(tranche[0], rate, tranche[2])
+            simulated = False
+        except _Untrusted:
+            # solved on the pool paths, from the rates the surrogate got to if it got anywhere
+            rates = [tranche.rate for tranche in trial.trancheList] if predictions else initialRates
+            last = {}
+
+            def simulate(seed, start):
+                average_DIRR_AL, last['errors'] = self.simulateWithErrors(structured_securities)
+                return average_DIRR_AL
+
+            logging.info('The surrogate cannot be trusted for this quote, simulating {} paths'.format(self._NSIM))
+            result = _solveRates(structured_securities, tolerance, self._NSIM, simulate, initialRates=rates,
+                                 tranches=tranches, seed=self._seed)
+            errors = last['errors']
+            rate_errors = self.rateErrors([tranche[:2] for tranche in result], errors)
+            simulated = True
+        return {'result': result, 'error': [error + [rate_error] for error, rate_error in zip(errors, rate_errors)],
+                'simulated': simulated, 'seconds': time.time() - started}
+
+    # write the samples to a file, to be loaded again for the same pool
+    def save(self, filename):
+        state = {'pool': self._poolKey, 'NSIM': self._NSIM, 'seed': self._seed, 'samples': self._samples}
+        with open(filename + '.tmp', 'wb') as fp:
+            pickle.dump(state, fp)
+        os.replace(filename + '.tmp', filename)
+
+    # A surrogate of the loan pool with the samples of a file saved for that same pool, simulating on the same paths
+    @classmethod
+    def load(cls, filename, loanpool, backend='numpy', maxDistance=MAX_DISTANCE, maxRateError=MAX_RATE_ERROR):
+        with open(filename, 'rb') as fp:
+            state = pickle.load(fp)
+        surrogate = cls(loanpool, state['NSIM'], state['seed'], backend, maxDistance, maxRateError)
+        if state['pool'] != surrogate._poolKey:
+            logging.error('The surrogate in {} was fitted on a different loan pool'.format(filename))
+            raise ValueError('The surrogate in {} was fitted on a different loan pool'.format(filename))
+        surrogate._samples = state['samples']
+        return surrogate
+
+    # samples recorded over every mode
+    def __len__(self):
+        return sum(len(samples['inputs']) for samples in self._samples.values())
+
+    @property
+    def NSIM(self):
+        return self._NSIM
+
+    @property
+    def seed(self):
+        return self._seed
@@ -0,0 +1,189 @@
+"""
+Rep-line compression of a LoanPool for fast screening. Loans of the same loan class and asset class whose terms and
+rates fall in the same bands are replaced by one representative line: a loan with their average face, average asset
+value, face-weighted average rate and (rounded) face-weighted average term, standing for all of them. The schedules
+are built per line (a PoolSchedule of the representative loans) and every path draws how many loans of each line
+default or prepay in each period (a binomial count of the loans of a line that end early, then the period and kind
+of each end from the odds of the line: the same odds as every loan drawing its own default and prepayment period),
+so the cost of a path goes with the number of lines instead of the number of loans.
+
+The result is an approximation: the loans of a line do not all pay exactly like their average. compressionError runs
+the full loan-level simulation next to the rep-line one and reports the difference in DIRR and AL together with the
+standard errors of both runs, so the error can be weighed against the Monte Carlo noise and the speed up
+"""
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from simulations.pool_paths import PoolPaths, simulatePoolPaths
+from utils.random_streams import newSeed, pathGenerator
+import numpy as np
+import logging
+import time
+
+# the most event counts (paths x lines x 2 x periods) built at once
+BLOCK_CELLS = 2 ** 22
+
+
+class RepLinePool(object):
+    # rateBand and termBand are the widths of the rate and term (months) bands of a line; loans with a variable
+    # rate (a dict) each stay on a line of their own
+    def __init__(self, loanpool, rateBand=0.005, termBand=6, blockSize=256):
+        if rateBand <= 0 or termBand < 1:
+            logging.error('The rate and term bands should be positive')
+            raise ValueError('The rate and term bands should be positive')
+        lines = {}
+        for index, loan in enumerate(loanpool):
+            rate_key = int(loan.rate // rateBand) if not isinstance(loan.rate, dict) else ('variable', index)
+            key = (loan.__class__.__name__, loan.asset.__class__.__name__, int(loan.term // termBand), rate_key)
+            lines.setdefault(key, []).append(loan)
+        self._lines = list(lines.values())
+        self._loanCount = sum(len(members) for members in self._lines)
+        self._counts = np.array([len(members) for members in self._lines], dtype=np.int64)
+        self._blockSize = blockSize
+        self._schedule = PoolSchedule(LoanPool([self.representative(members) for members in self._lines],
+                                               getattr(loanpool, 'hazard', None)),
+                                      int(max((loan.term for loan in loanpool), default=0)) + 1)
+        default, prepay, never = self._schedule.outcomeProbabilities()
+        # the chance that a loan of a line ends early, and the CDF of when and how it does if it does (lines x
+        # 2 periods, defaults then prepayments) shifted by the line number for drawEvents
+        self._endProbability = np.clip(1 - never, 0, 1)
+        outcomes = np.concatenate([default, prepay], axis=1)
+        outcome_cdf = np.cumsum(outcomes, axis=1) / np.where(outcomes.sum(axis=1) > 0, outcomes.sum(axis=1), 1)[:, None]
+        outcome_cdf[:, -1] = 1
+        self._outcomeCDF = (np.arange(len(outcomes))[:, None] + outcome_cdf).ravel()
+
+    # the loan that stands for the loans of a line: same classes, average face and asset value, face-weighted
+    # rate and term
+    @staticmethod
+    def representative(members):
+        faces = np.array([loan.face for loan in members], dtype=float)
+        weights = faces / faces.sum() if faces.sum() > 0 else np.full(len(members), 1 / len(members))
+        first = members[0]
+        rate = first.rate if isinstance(first.rate, dict) else float(np.dot(weights, [loan.rate for loan in members]))
+        term = int(round(float(np.dot(weights, [loan.term for loan in members]))))
+        asset = first.asset.__class__(float(np.mean([loan.asset.initialValue for loan in members])))
+        return first.__class__(term, rate, float(faces.mean()), asset)
+
+    # The default and prepayment events of NSIM paths starting at path start of the seed, every path from its own
+    # stream: a binomial count of the loans of each line that default or prepay at all, then the period and kind of
+    # each of them from the odds of the line. Returns the path, line, period and whether it is a prepayment of
+    # every event, sorted by path, and how many loans of each line end early on each path (paths x lines)
+    def drawEvents(self, seed, start, NSIM):
+        lines, categories = len(self._counts), 2 * self._schedule.periods
+        ended = np.empty((NSIM, lines), dtype=np.int64)
+        paths, queries = [], []
+        for i in range(NSIM):
+            generator = pathGenerator(seed, start + i)
+            ended[i] = generator.binomial(self._counts, self._endProbability)
+            line = np.repeat(np.arange(lines), ended[i])
+            paths.append(np.full(len(line), i))
+            queries.append(line + generator.random(len(line)))
+        path = np.concatenate(paths) if paths else np.zeros(0, dtype=int)
+        query = np.concatenate(queries) if queries else np.zeros(0)
+        # every line's outcome CDF is shifted by its line number, so one search finds the line and the outcome
+        outcome = np.searchsorted(self._outcomeCDF, query, side='right')
+        line, category = outcome // categories, outcome % categories
+        periods = self._schedule.periods
+        return path, line, category % periods, category >= periods, ended
+
+    # How many loans of each line default and prepay in each period from the events of drawEvents: two arrays of
+    # paths x lines x periods
+    def eventCounts(self, path, line, period, prepaid, ended):
+        shape = (len(ended), len(self._counts), 2, self._schedule.periods)
+        cells = np.ravel_multi_index((path, line, prepaid.astype(int), period), shape)
+        counts = np.bincount(cells, np.ones(len(cells)), minlength=int(np.prod(shape))).reshape(shape)
+        return counts[:, :, 0], counts[:, :, 1]
+
+    # Cash available, principal due (paths x periods) and last period of each path from the events of drawEvents,
+    # like PoolSchedule.poolCashFlows: a loan pays in the period it defaults in (its recovery comes then too) and is
+    # out of the principal due from then on, a loan that prepays pays off its balance in that period and nothing
+    # after. Every line is worked out for all its loans at once, so the cost goes with the number of lines.
+    # collateral=True also returns the pool balance (paths x periods) like PoolSchedule.poolBalance: the scheduled
+    # balance of every loan that has not ended by the period
+    def poolCashFlows(self, path, line, period, prepaid, ended, collateral=False):
+        schedule = self._schedule
+        defaults, prepays = self.eventCounts(path, line, period, prepaid, ended)
+        ended_by = np.cumsum(defaults + prepays, axis=2)
+        # loans that end in a period still pay in it, the ones that ended before do not
+        ended_before = ended_by.copy()
+        ended_before[:, :, 1:] = ended_before[:, :, :-1]
+        ended_before[:, :, 0] = 0
+        cash = self._counts @ schedule.payment - np.einsum('plt,lt->pt', ended_before, schedule.payment) + \
+            np.einsum('plt,lt->pt', defaults, schedule.recovery) + \
+            np.einsum('plt,lt->pt', prepays, schedule.balance)
+        principal = self._counts @ schedule.principal - \
+            np.einsum('plt,lt->pt', ended_before + defaults, schedule.principal) + \
+            np.einsum('plt,lt->pt', prepays, schedule.balance)
+        # a line runs to its last active period if any of its loans does not end before it; when every loan of a
+        # line ends (rare), to the last of their periods
+        last_active = schedule.lastActive
+        line_last = np.where(ended < self._counts, last_active, 0)
+        gone = (ended == self._counts)[path, line]
+        np.maximum.at(line_last, (path[gone], line[gone]), np.minimum(period[gone], last_active[line[gone]]))
+        last_period = np.maximum(line_last.max(axis=1, initial=0), 1)
+        if collateral:
+            balance = self._counts @ schedule.balance - np.einsum('plt,lt->pt', ended_by, schedule.balance)
+            return cash, principal, last_period, balance
+        return cash, principal, last_period
+
+    # NSIM paths of the compressed pool as PoolPaths, a block of paths at a time (fewer paths to a block when there
+    # are many lines, so that the counts of a block stay within BLOCK_CELLS numbers). collateral=True also keeps
+    # the pool balance of every path, for waterfall specs with an OC test
+    def simulatePoolPaths(self, NSIM, seed=None, start=0, collateral=False):
+        seed = seed if seed is not None else newSeed()
+        periods = self._schedule.periods
+        cash, principal = np.empty((NSIM, periods)), np.empty((NSIM, periods))
+        last_period = np.empty(NSIM, dtype=int)
+        balance = np.empty((NSIM, periods)) if collateral else None
+        block = max(1, min(self._blockSize, BLOCK_CELLS // (2 * len(self._counts) * periods)))
+        for low in range(0, NSIM, block):
+            size = min(block, NSIM - low)
+            flows = self.poolCashFlows(*self.drawEvents(seed, start + low, size), collateral=collateral)
+            cash[low:low + size], principal[low:low + size], last_period[low:low + size] = flows[:3]
+            if collateral:
+                balance[low:low + size] = flows[3]
+        return PoolPaths(cash, principal, last_period, balance)
+
+    def __len__(self):
+        return len(self._lines)
+
+    @property
+    def lines(self):
+        return self._lines
+
+    @property
+    def counts(self):
+        return self._counts
+
+    @property
+    def schedule(self):
+        return self._schedule
+
+    # loans per line
+    @property
+    def compressionRatio(self):
+        return self._loanCount / max(len(self._lines), 1)
+
+
+# The error of the rep-line approximation of a pool: the average [DIRR, AL] of each tranche from the full loan-level
+# simulation and from the rep lines (NSIM paths each), their difference, the standard error of each run, the number
+# of lines, the compression ratio and the time each run took. A difference well within the standard errors is noise
+# rather than approximation error. Both runs keep the pool balance when the waterfall spec has an OC test
+def compressionError(loanpool, structured_securities, NSIM, rateBand=0.005, termBand=6, seed=None, backend='numpy'):
+    seed = seed if seed is not None else newSeed()
+    collateral = structured_securities.spec.needsCollateral
+    started = time.time()
+    full = simulatePoolPaths(loanpool, NSIM, seed=seed, collateral=collateral).pathDIRR_AL(structured_securities,
+                                                                                           backend=backend)
+    full_seconds = time.time() - started
+    started = time.time()
+    rep_lines = RepLinePool(loanpool, rateBand, termBand)
+    compressed = rep_lines.simulatePoolPaths(NSIM, seed, collateral=collateral).pathDIRR_AL(structured_securities,
+                                                                                            backend=backend)
+    rep_seconds = time.time() - started
+    full_mean, compressed_mean = full.mean(axis=0), compressed.mean(axis=0)
+    return {'full': full_mean.tolist(), 'repLines': compressed_mean.tolist(),
+            'error': (compressed_mean - full_mean).tolist(),
+            'standardError': [(full.std(axis=0, ddof=1) / np.sqrt(NSIM)).tolist(),
+                              (compressed.std(axis=0, ddof=1) / np.sqrt(NSIM)).tolist()],
+            'lines': len(rep_lines), 'compressionRatio': rep_lines.compressionRatio,
+            'seconds': [full_seconds, rep_seconds]}
@@ -0,0 +1,119 @@
+"""
+ResultCache is a persistent, content-addressed cache of simulation results. Every entry is keyed by a sha256 hash of
+everything the result depends on: the loan tape, the tranche structure and mode, Loan.default_dict, the recovery
+multiplier, the asset depreciation rates, NSIM, tolerance and seed. Results live in a sqlite database and the simulated
+pool paths in .npz files next to it, so asking for a larger NSIM on the same pool and seed only simulates the paths
+that are missing and merges them in (every path has its own random stream, so this gives the same paths as
+simulating all of them at once)
+"""
+from loan.loan_base import Loan
+from liabilities.waterfall_spec import builtinSpecs
+from simulations.pool_paths import PoolPaths, simulatePoolPaths
+from simulations.monte import _solveRates, defaultTranches
+import hashlib
+import json
+import os
+import sqlite3
+import numpy as np
+
+
+class ResultCache(object):
+    def __init__(self, directory):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, 'results.sqlite'))
+        self._db.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, result TEXT)')
+
+    # content hash of any json-able description
+    @staticmethod
+    def key(*parts):
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    # everything about the collateral that changes its cash flows
+    @staticmethod
+    def describePool(loanpool):
+        loans = [[loan.__class__.__name__, loan.asset.__class__.__name__, loan.asset.initialValue,
+                  loan.asset.annualDeprRate(), loan.face, loan.rate, loan.term] for loan in loanpool]
+        description = {'loans': loans, 'default_dict': sorted(Loan.default_dict.items()),
+                       'recovery_multiplier': Loan.recovery_multiplier}
+        if loanpool.hazard is not None:
+            # the CDR and CPR curves, with every rate written out
+            description['hazard'] = [{key: np.asarray(curve, dtype=float).tolist() for key, curve in curves.items()}
+                                     if isinstance(curves, dict) else
+                                     np.asarray(curves, dtype=float).tolist() if curves is not None else None
+                                     for curves in (loanpool.hazard.cdr, loanpool.hazard.cpr)]
+        return description
+
+    @staticmethod
+    def describeStructure(structured_securities):
+        tranches = [[tranche.__class__.__name__, tranche.face, tranche.rate, tranche.face_percent,
+                     tranche.subordination] for tranche in structured_securities.trancheList]
+        description = {'tranches': tranches, 'mode': structured_securities.mode}
+        if structured_securities.spec is not builtinSpecs.get(structured_securities.mode):
+            # a custom waterfall spec is part of the structure
+            description['spec'] = structured_securities.spec.steps
+        return description
+
+    def get(self, key):
+        row = self._db.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key, result):
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?)', (key, json.dumps(result)))
+
+    # paths start..start+NSIM-1 of the pool and seed: the stored ones, topped up with newly simulated paths if needed
+    # collateral=True also gives the pool balance of every path (for waterfall specs with an OC test); stored paths
+    # without it are simulated again with it, and from then on every path of the file keeps it
+    def poolPaths(self, loanpool, NSIM, seed, start=0, collateral=False):
+        filename = os.path.join(self._directory, self.key('paths', self.describePool(loanpool), seed) + '.npz')
+        pool_paths = None
+        if os.path.exists(filename):
+            with np.load(filename) as stored:
+                if not collateral or 'collateral' in stored:
+                    pool_paths = PoolPaths(stored['cash'], stored['principal'], stored['lastPeriod'],
+                                           stored['collateral'] if 'collateral' in stored else None)
+        if pool_paths is None or len(pool_paths) < start + NSIM:
+            first = len(pool_paths) if pool_paths is not None else 0
+            collateral = collateral or (pool_paths is not None and pool_paths.collateral is not None)
+            new_paths = simulatePoolPaths(loanpool, start + NSIM - first, seed=seed, start=first,
+                                          collateral=collateral)
+            pool_paths = new_paths if pool_paths is None else pool_paths.merge(new_paths)
+            arrays = {'cash': pool_paths.cash, 'principal': pool_paths.principal, 'lastPeriod': pool_paths.lastPeriod}
+            if pool_paths.collateral is not None:
+                arrays['collateral'] = pool_paths.collateral
+            np.savez(filename, **arrays)
+        return pool_paths.slice(start, start + NSIM)
+
+    # cached counterpart of simulateWaterfall: the average [DIRR, AL] of each tranche
+    def simulateWaterfall(self, loanpool, structured_securities, NSIM, seed=0):
+        key = self.key('simulateWaterfall', self.describePool(loanpool), self.describeStructure(structured_securities),
+                       NSIM, seed)
+        result = self.get(key)
+        if result is None:
+            result = self.poolPaths(loanpool, NSIM, seed, collateral=structured_securities.spec.needsCollateral
+                                    ).averageDIRR_AL(structured_securities)
+            self.put(key, result)
+        return result
+
+    # cached counterpart of runMonte: DIRR, AL, rating and rate of each tranche. Like runMonte every iteration
+    # simulates the next NSIM paths of the seed, taken from the cached paths (which are extended as needed), so the
+    # result is the same as runMonte with that seed. The tranches of runMonte are added to structured_securities
+    # with the rates found, also when the result comes from the cache
+    def runMonte(self, loanpool, structured_securities, tolerance, NSIM, seed=0):
+        key = self.key('runMonte', self.describePool(loanpool), self.describeStructure(structured_securities),
+                       tolerance, NSIM, seed, 'next paths every iteration')
+        result = self.get(key)
+        if result is None:
+            collateral = structured_securities.spec.needsCollateral
+            result = _solveRates(structured_securities, tolerance, NSIM,
+                                 lambda seed, start: self.poolPaths(loanpool, NSIM, seed, start, collateral
+                                                                    ).averageDIRR_AL(structured_securities), seed=seed)
+            self.put(key, result)
+        else:
+            for tranche, tranche_result in zip(sorted(defaultTranches, key=lambda tranche: tranche[2]), result):
+                structured_securities.addTranche(tranche[0], tranche_result[-1], tranche[2])
+        return result
+
+    def close(self):
+        self._db.close()
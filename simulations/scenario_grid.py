@@ -0,0 +1,58 @@
+"""
+Evaluate a grid of deal structures against the same collateral. The loan pool paths are simulated once and every
+candidate StructuredSecurities (tranche face percents, rates, subordination and mode) runs its tranche waterfall over
+those shared paths, with the scenarios spread across processes.
+
+A scenario is a dict: {'tranches': [(face_percent, rate, subordination), ...], 'mode': 'Sequential'}, with an
+optional 'spec': a list of waterfall steps (see liabilities.waterfall_spec) that replaces the mode
+"""
+from liabilities.structured_securities import StructuredSecurities
+from liabilities.tranche_base import Tranche
+from liabilities.waterfall_spec import WaterfallSpec
+from simulations.pool_paths import simulatePoolPaths
+import multiprocessing
+
+_poolPaths = None  # the shared pool paths, set once in each worker process
+
+
+def _initWorker(pool_paths):
+    global _poolPaths
+    _poolPaths = pool_paths
+
+
+# build the StructuredSecurities of a scenario
+def buildStructuredSecurities(total_face, scenario):
+    structured_securities = StructuredSecurities(total_face)
+    for face_percent, rate, subordination in scenario['tranches']:
+        structured_securities.addTranche(face_percent, rate, subordination)
+    structured_securities.mode = scenario.get('mode', 'Sequential')
+    if 'spec' in scenario:
+        structured_securities.spec = WaterfallSpec(scenario['spec'])
+    return structured_securities
+
+
+# average DIRR and AL of each tranche of one scenario over the shared pool paths, with the rating of the average
+def evaluateScenario(total_face, scenario, pool_paths=None):
+    pool_paths = pool_paths if pool_paths is not None else _poolPaths
+    structured_securities = buildStructuredSecurities(total_face, scenario)
+    average_DIRR_AL = pool_paths.averageDIRR_AL(structured_securities)
+    return [[tranche.face_percent, tranche.rate, DIRR, AL, Tranche.DIRR_Rating(DIRR)]
+            for tranche, (DIRR, AL) in zip(structured_securities.trancheList, average_DIRR_AL)]
+
+
+# Returns one row per tranche per scenario, tranches in order of subordination:
+# [scenario index, mode, tranche index, face percent, rate, DIRR, AL, rating]
+# seed: optional master seed of the paths, the same paths simulateWaterfall draws for it
+def runScenarioGrid(loanpool, scenarios, NSIM, numProcesses, seed=None):
+    total_face = loanpool.totalPrincipal()
+    # the pool balance of every path is only kept when a scenario has a waterfall spec with an OC test
+    collateral = any(buildStructuredSecurities(total_face, scenario).spec.needsCollateral for scenario in scenarios)
+    pool_paths = simulatePoolPaths(loanpool, NSIM, seed=seed, collateral=collateral)
+    with multiprocessing.Pool(numProcesses, initializer=_initWorker, initargs=(pool_paths,)) as pool:
+        results = pool.starmap(evaluateScenario, [(total_face, scenario) for scenario in scenarios])
+
+    table = []
+    for index, (scenario, tranches) in enumerate(zip(scenarios, results)):
+        for tranche_index, tranche_result in enumerate(tranches):
+            table.append([index, scenario.get('mode', 'Sequential'), tranche_index] + tranche_result)
+    return table
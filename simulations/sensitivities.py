@@ -0,0 +1,108 @@
+"""
+Bump-and-revalue sensitivities of the tranche DIRR, AL and rating with common random numbers. The base case and every
+bumped case run on the same default-time uniforms, so the difference between two cases is only the effect of the bump
+and not the noise of two independent sets of paths: the finite differences have a far smaller variance than running
+simulateWaterfall again for each bump.
+
+Only what a bump changes is built again. The PoolSchedule of the pool is built once; a default bump only moves the
+default periods of the same uniforms, a recovery or depreciation bump only changes the recovery cash of the same
+defaults, and a coupon bump only runs the tranche waterfall again on the base paths. The pool cases are stacked and
+run through the tranche waterfall in one batch on a compute backend (utils.waterfall_backends).
+
+The bumps, each applied up and down for a central difference:
+    'default'       relative bump of the default probabilities (0.1 = 10% more likely), Loan.default_dict or CDR
+    'recovery'      absolute bump of Loan.recovery_multiplier
+    'depreciation'  relative bump of the depreciation rates of the assets
+    'coupon'        absolute bump of the rate of every tranche, one tranche at a time ('coupon 0', 'coupon 1', ...)
+"""
+from loan.loan_base import Loan
+from loan.pool_schedule import PoolSchedule
+from simulations.pool_paths import PoolPaths
+from simulations.simulate_waterfall import averageDIRR_AL
+from liabilities.tranche_base import Tranche
+from utils.random_streams import newSeed, pathUniforms
+import numpy as np
+import logging
+
+# the bump of each factor when none is given
+defaultBumps = {'default': 0.1, 'recovery': 0.05, 'depreciation': 0.1, 'coupon': 0.0025}
+
+
+# Sensitivities of the average [DIRR, AL] of each tranche to the bumps (a dict of factor: bump size, defaultBumps
+# when None) over NSIM paths of the seed. Returns a dict with
+#   'base': [DIRR, AL, rating] of each tranche
+#   'sensitivities': for every bump, a dict of its 'bump' size, the 'up' and 'down' [DIRR, AL, rating] of each
+#                    tranche, the central difference 'delta' [dDIRR, dAL] of each tranche per unit of the factor and
+#                    its 'standardError' from the paired paths
+#   'paths': NSIM
+def bumpSensitivities(loanpool, structured_securities, NSIM, bumps=None, seed=None, start=0, schedule=None,
+                      backend='numpy'):
+    bumps = defaultBumps if bumps is None else bumps
+    for factor in bumps:
+        if factor not in defaultBumps:
+            logging.error('Unknown sensitivity factor {}'.format(factor))
+            raise ValueError('Unknown sensitivity factor {}'.format(factor))
+    schedule = schedule if schedule is not None else PoolSchedule(loanpool)
+    seed = seed if seed is not None else newSeed()
+    uniforms = pathUniforms(seed, start, NSIM, schedule.randomsPerPath)
+    needs_collateral = structured_securities.spec.needsCollateral
+
+    # the pool side of every case: cash, principal due, last period and collateral of each path
+    def poolCase(default_times, prepay_times):
+        return schedule.poolCashFlows(default_times, prepay_times=prepay_times) + \
+            (schedule.poolBalance(default_times, prepay_times) if needs_collateral else None,)
+
+    base_times, base_prepay = schedule.eventTimes(uniforms)
+    base = poolCase(base_times, base_prepay)
+    cases = [('base', base)]
+    for sign, side in [(1, 'up'), (-1, 'down')]:
+        if 'default' in bumps:
+            cases.append((('default', side), poolCase(*schedule.eventTimes(uniforms, 1 + sign * bumps['default']))))
+        recoveries = []
+        if 'recovery' in bumps:
+            recoveries.append(('recovery', schedule.recoverySchedule(
+                multiplier=Loan.recovery_multiplier + sign * bumps['recovery'])))
+        if 'depreciation' in bumps:
+            recoveries.append(('depreciation', schedule.recoverySchedule(
+                depreciationScale=1 + sign * bumps['depreciation'])))
+        for factor, recovery in recoveries:
+            # the same defaults, only the recovery cash changes
+            cash = base[0] + schedule.recoveryCash(base_times, recovery - schedule.recovery)
+            cases.append(((factor, side), (cash,) + base[1:]))
+
+    # every pool case through the tranche waterfall in one batch
+    stacked = [np.concatenate([case[i] for _, case in cases]) if base[i] is not None else None for i in range(4)]
+    path_metrics = PoolPaths(*stacked).pathDIRR_AL(structured_securities, backend=backend)
+    case_metrics = {name: path_metrics[i * NSIM:(i + 1) * NSIM] for i, (name, _) in enumerate(cases)}
+
+    # the coupons only change the tranches: the base paths again with one rate bumped
+    if 'coupon' in bumps:
+        base_paths = PoolPaths(*base)
+        for k, tranche in enumerate(structured_securities.trancheList):
+            rate = tranche.rate
+            try:
+                for sign, side in [(1, 'up'), (-1, 'down')]:
+                    tranche.rate = rate + sign * bumps['coupon']
+                    case_metrics[('coupon {}'.format(k), side)] = base_paths.pathDIRR_AL(structured_securities,
+                                                                                        backend=backend)
+            finally:
+                tranche.rate = rate  # the caller's tranche keeps its coupon even when a bumped run fails
+
+    sensitivities = {}
+    factors = [factor for factor in bumps if factor != 'coupon']
+    factors += ['coupon {}'.format(k) for k in range(len(structured_securities.trancheList)) if 'coupon' in bumps]
+    for factor in factors:
+        bump = bumps['coupon' if factor.startswith('coupon') else factor]
+        up, down = case_metrics[(factor, 'up')], case_metrics[(factor, 'down')]
+        # the per-path differences of the paired paths carry the whole error of the estimate
+        differences = (up - down) / (2 * bump)
+        sensitivities[factor] = {'bump': bump, 'up': _withRatings(up), 'down': _withRatings(down),
+                                 'delta': averageDIRR_AL(differences),
+                                 'standardError': (differences.std(axis=0, ddof=1) / np.sqrt(NSIM)).tolist()
+                                 if NSIM > 1 else None}
+    return {'base': _withRatings(case_metrics['base']), 'sensitivities': sensitivities, 'paths': NSIM}
+
+
+# [DIRR, AL, rating] of each tranche from per-path [DIRR, AL]
+def _withRatings(path_metrics):
+    return [[DIRR, AL, Tranche.DIRR_Rating(DIRR)] for DIRR, AL in averageDIRR_AL(path_metrics)]
@@ -1,32 +1,100 @@
 from loan.loan_pool import LoanPool
 from utils.waterfall import doWaterfall
+from utils.random_streams import newSeed
 from liabilities.structured_securities import StructuredSecurities
+from simulations.tranche_distribution import TrancheDistribution
 import math
 import numpy as np
 import logging
 
 
-def simulateWaterfall(loanpool, structured_securities, NSIM):
+# The average DIRR and AL of each tranche over NSIM paths. Path i draws its defaults from its own stream of the master
+# seed (utils.random_streams), so the same seed always gives the same paths, and start numbers the first path so that
+# runs can be split up or continued. A new seed is drawn when none is given
+# the tranche flows of every path are written to store (a PathStore) when one is given
+def simulateWaterfall(loanpool, structured_securities, NSIM, seed=None, start=0, store=None):
+    return averageDIRR_AL(simulatePathMetrics(loanpool, structured_securities, NSIM, seed, start, store))
+
+
+# [DIRR, AL] of each tranche on each path, an array of NSIM x tranches x 2
+def simulatePathMetrics(loanpool, structured_securities, NSIM, seed=None, start=0, store=None):
+    # create an array filled with zeros, could be used to filled in later
+    path_metrics = np.zeros((NSIM, len(structured_securities.trancheList), 2))
+    for i, metrics in enumerate(iterPathMetrics(loanpool, structured_securities, NSIM, seed, start, store)):
+        path_metrics[i] = metrics[:, :2]
+    return path_metrics
+
+
+# The distribution of DIRR, AL and loss of each tranche over NSIM paths (see TrancheDistribution), built path by path
+# so memory does not grow with NSIM. Returns a dict with the 'DIRR_AL' means and the 'distribution'
+def simulateWaterfallDistribution(loanpool, structured_securities, NSIM, seed=None, start=0, k=None):
+    distribution = TrancheDistribution(len(structured_securities.trancheList), k)
+    for metrics in iterPathMetrics(loanpool, structured_securities, NSIM, seed, start):
+        distribution.add(metrics)
+    return {'DIRR_AL': distribution.DIRR_AL, 'distribution': distribution}
+
+
+# [DIRR, AL, loss] of each tranche (tranches x 3) for one path after another; the loss is the part of the face of the
+# tranche still unpaid at the end of the path. With a PathStore every path is also recorded in it
+def iterPathMetrics(loanpool, structured_securities, NSIM, seed=None, start=0, store=None):
     if not isinstance(loanpool, LoanPool) or not isinstance(structured_securities, StructuredSecurities):
         logging.error('Please enter the correct class type')
-    rating_metrics = []  # intialize an empty list to get the doWaterfall results
-    # create an array filled with zeros, could be used to filled in later
-    sum_DIRR_AL = np.zeros((len(structured_securities.trancheList), 2))
+    seed = seed if seed is not None else newSeed()
     for i in range(NSIM):
         # remember to reset each time of the simulation
         loanpool.reset()
         structured_securities.reset()
+        loanpool.drawDefaults(seed, start + i)
         # obtain the results of rating metrics from the doWaterfall
-        rating_metrics.append(doWaterfall(loanpool, structured_securities)[3])
-    for simulations in rating_metrics:
-        for i, tranche_metric in enumerate(simulations):
-            if tranche_metric[2] != math.inf:  # if AL not infinite
-                sum_DIRR_AL[i] += [tranche_metric[1], tranche_metric[2]]
-            else:
-                # if AL is infinite, get rid of the AL, only add up the DIRR to get the average
-                sum_DIRR_AL[i] += [tranche_metric[1], 0]
-    # return the average DIRR and AL values for each tranche
-    # use ndarray here because it allows to divide directly instead of doing a list comprehension
-    DIRR_AL = sum_DIRR_AL / NSIM
-    DIRR_AL = DIRR_AL.tolist()  # convert the array to list
-    return DIRR_AL
+        waterfall = doWaterfall(loanpool, structured_securities)
+        metrics = np.zeros((len(structured_securities.trancheList), 3))
+        for j, tranche_metric in enumerate(waterfall[3]):
+            # if AL is infinite, get rid of the AL, only add up the DIRR to get the average
+            metrics[j] = [tranche_metric[1], tranche_metric[2] if tranche_metric[2] != math.inf else 0,
+                          waterfall[1][-1][j][0] / structured_securities.trancheList[j].face]
+        if store is not None:
+            store.record(start + i, waterfall[1], metrics)
+        yield metrics
+    if store is not None:
+        store.flush()
+
+
+# average [DIRR, AL] of each tranche from per-path metrics; math.fsum is exactly rounded, so the average is the same
+# to the last bit however the paths were split between processes
+def averageDIRR_AL(path_metrics):
+    return [[math.fsum(path_metrics[:, i, k]) / len(path_metrics) for k in range(2)]
+            for i in range(path_metrics.shape[1])]
+
+
+# An exact running sum (Shewchuk's partials, as in math.fsum): value() is the correctly rounded sum of everything
+# added, the same as math.fsum over all the values at once. The partials of sums over different paths merge into
+# the exact sum of all of them, so partial sums can be sent between processes without changing the last bit
+class ExactSum(object):
+    def __init__(self, partials=None):
+        self._partials = list(partials or [])
+
+    def add(self, values):
+        for x in values:
+            x = float(x)
+            i = 0
+            for y in self._partials:
+                if abs(x) < abs(y):
+                    x, y = y, x
+                hi = x + y
+                lo = y - (hi - x)
+                if lo:
+                    self._partials[i] = lo
+                    i += 1
+                x = hi
+            self._partials[i:] = [x]
+        return self
+
+    def merge(self, other):
+        return self.add(other.partials)
+
+    def value(self):
+        return math.fsum(self._partials)
+
+    @property
+    def partials(self):
+        return list(self._partials)
@@ -0,0 +1,243 @@
+"""
+Distributed simulation: a SimulationCoordinator splits the NSIM paths of a simulation into shards (path ranges of one
+seed) and hands them out to worker processes, on this machine or on others, over a multiprocessing.managers TCP
+connection. The loan pool goes to each worker once; every shard carries only the structured securities and its path
+range, and comes back as the exact partial sums of the DIRR and AL of its paths (simulate_waterfall.ExactSum), which
+merge into the sums of all the paths. Since every path has its own random stream and the sums are exact, the result
+is the same as simulateWaterfall with the same seed however the shards were spread.
+Workers send heartbeats, and the shards of a worker that stops sending them are handed to the other workers, as are
+shards taken off the queue by a worker that went away before claiming them. A simulation fails when no worker has
+been heard from for workerTimeout seconds, or when it takes longer than jobTimeout.
+
+The workers load pickles from the coordinator, so the connection is guarded by an authkey: a random one unless one
+is given (coordinator.authkey, to pass on to the workers).
+On each worker machine:  python -m simulations.simulation_distributed --host <coordinator> --port <port> --authkey <k>
+For a single machine startLocalWorkers() starts worker processes on localhost.
+"""
+from loan.pool_schedule import PoolSchedule
+from simulations.pool_paths import simulatePoolPaths
+from simulations.simulate_waterfall import ExactSum
+from utils.random_streams import newSeed
+from multiprocessing.managers import BaseManager
+import argparse
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import secrets
+import socket
+import threading
+import time
+
+
+# hands the pickled loan pools to the workers, by version
+class _PoolStore(object):
+    def __init__(self):
+        self._pools = {}
+
+    def put(self, version, pickled_pool):
+        self._pools[version] = pickled_pool
+
+    def get(self, version):
+        return self._pools[version]
+
+
+class _WorkerManager(BaseManager):
+    pass
+
+
+_WorkerManager.register('tasks')
+_WorkerManager.register('results')
+_WorkerManager.register('pools')
+
+
+class SimulationCoordinator(object):
+    _versions = itertools.count(1)
+
+    # authkey: the key the workers need to connect, a random one by default; jobTimeout: the most seconds a
+    # simulation may take (no limit by default)
+    def __init__(self, loanpool, address=('127.0.0.1', 0), authkey=None, shardSize=100, workerTimeout=10.0,
+                 seed=None, jobTimeout=None):
+        self._shardSize = shardSize  # paths per shard
+        self._workerTimeout = workerTimeout  # seconds without a heartbeat before a worker counts as gone
+        self._jobTimeout = jobTimeout
+        self._seed = seed if seed is not None else newSeed()
+        self._simulated = 0  # paths simulated so far, every simulation gets the next range of paths of the seed
+        self._jobs = itertools.count(1)
+        self._tasks = queue.Queue()
+        self._results = queue.Queue()
+        self._pools = _PoolStore()
+        self._poolVersion = next(self._versions)
+        self._pools.put(self._poolVersion, pickle.dumps(loanpool))
+        self._lastSeen = {}  # worker id -> time of its last message
+
+        # a manager class of its own, so coordinators never share registrations
+        manager_class = type('_CoordinatorManager', (BaseManager,), {})
+        manager_class.register('tasks', callable=lambda: self._tasks)
+        manager_class.register('results', callable=lambda: self._results)
+        manager_class.register('pools', callable=lambda: self._pools)
+        authkey = authkey if authkey is not None else secrets.token_hex(16).encode()
+        self._server = manager_class(address=address, authkey=authkey).get_server()
+        self._authkey = authkey
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+
+    @property
+    def address(self):
+        return self._server.address
+
+    @property
+    def authkey(self):
+        return self._authkey
+
+    # Run NSIM paths over the workers, returns the average [DIRR, AL] per tranche like simulateWaterfall.
+    # Without a seed and start the coordinator's own seed is used, continuing after the paths it simulated last time
+    def simulate(self, structured_securities, NSIM, seed=None, start=None):
+        if seed is None:
+            seed, start = self._seed, self._simulated
+            self._simulated += NSIM
+        start = start or 0
+        job = next(self._jobs)
+        shards = {}
+        for index, first in enumerate(range(0, NSIM, self._shardSize)):
+            shards[index] = (job, index, self._poolVersion, structured_securities, seed, start + first,
+                             min(self._shardSize, NSIM - first))
+            self._tasks.put(shards[index])
+
+        pending = set(shards)
+        claimed = {}  # shard -> worker working on it
+        taken = {}  # shard -> when it was first seen off the queue without a claim
+        started = heard = time.time()
+        sums = [[ExactSum(), ExactSum()] for _ in structured_securities.trancheList]
+        try:
+            while pending:
+                try:
+                    kind, worker, key, payload = self._results.get(timeout=0.5)
+                    self._lastSeen[worker] = heard = time.time()
+                    if key is not None and key[0] == job and key[1] in pending:
+                        if kind == 'claim':
+                            claimed[key[1]] = worker
+                        elif kind == 'result':
+                            pending.remove(key[1])
+                            for tranche_sums, tranche_partials in zip(sums, payload):
+                                for metric_sum, partials in zip(tranche_sums, tranche_partials):
+                                    metric_sum.merge(ExactSum(partials))
+                        elif kind == 'error':
+                            raise RuntimeError(f'Worker {worker} failed on shard {key[1]}: {payload}')
+                except queue.Empty:
+                    pass
+                now = time.time()
+                if now - heard > self._workerTimeout:
+                    logging.error(f'No worker has been heard from for {self._workerTimeout} seconds')
+                    raise RuntimeError(f'No worker has been heard from for {self._workerTimeout} seconds')
+                if self._jobTimeout is not None and now - started > self._jobTimeout:
+                    logging.error(f'Simulation {job} did not finish within {self._jobTimeout} seconds')
+                    raise RuntimeError(f'Simulation {job} did not finish within {self._jobTimeout} seconds')
+                # hand the shards of workers that went quiet to the others
+                for shard in [shard for shard in pending if shard in claimed]:
+                    if now - self._lastSeen.get(claimed[shard], now) > self._workerTimeout:
+                        logging.warning(f'Worker {claimed[shard]} dropped out, reassigning shard {shard}')
+                        del claimed[shard]
+                        self._tasks.put(shards[shard])
+                # and the shards a worker took off the queue but never claimed (it went away in between)
+                waiting = self._waiting(job)
+                for shard in pending:
+                    if shard in claimed or shard in waiting:
+                        taken.pop(shard, None)
+                    elif now - taken.setdefault(shard, now) > self._workerTimeout:
+                        logging.warning(f'Shard {shard} was taken but never claimed, putting it back')
+                        del taken[shard]
+                        self._tasks.put(shards[shard])
+        finally:
+            self._drop(job)
+        return [[metric_sum.value() / NSIM for metric_sum in tranche_sums] for tranche_sums in sums]
+
+    # the shards of a simulation still on the task queue
+    def _waiting(self, job):
+        with self._tasks.mutex:
+            return {task[1] for task in self._tasks.queue if task is not None and task[0] == job}
+
+    # take the shards of a simulation that is over off the task queue
+    def _drop(self, job):
+        with self._tasks.mutex:
+            remaining = [task for task in self._tasks.queue if task is None or task[0] != job]
+            self._tasks.queue.clear()
+            self._tasks.queue.extend(remaining)
+
+    # tell n workers to stop
+    def stopWorkers(self, n):
+        for _ in range(n):
+            self._tasks.put(None)
+
+
+# The worker loop: takes shards until it gets None or the coordinator goes away. The loan pool and its schedule are
+# fetched once per pool version and kept
+def runWorker(address, authkey, heartbeat=1.0):
+    manager = _WorkerManager(address=tuple(address), authkey=authkey)
+    manager.connect()
+    tasks, results, pools = manager.tasks(), manager.results(), manager.pools()
+    worker = f'{socket.gethostname()}-{os.getpid()}'
+    stopped = threading.Event()
+
+    def beat():
+        while not stopped.wait(heartbeat):
+            try:
+                results.put(('alive', worker, None, None))
+            except (EOFError, OSError):
+                break
+
+    threading.Thread(target=beat, daemon=True).start()
+    loanpools = {}
+    try:
+        while True:
+            try:
+                task = tasks.get(timeout=1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break  # the coordinator is gone
+            if task is None:
+                break
+            job, shard, version, structured_securities, seed, start, NSIM = task
+            results.put(('claim', worker, (job, shard), None))
+            try:
+                if version not in loanpools:
+                    loanpool = pickle.loads(pools.get(version))
+                    loanpools[version] = (loanpool, PoolSchedule(loanpool))
+                loanpool, schedule = loanpools[version]
+                pool_paths = simulatePoolPaths(loanpool, NSIM, schedule, seed, start,
+                                               collateral=structured_securities.spec.needsCollateral)
+                path_metrics = pool_paths.pathDIRR_AL(structured_securities)
+                # the exact partial sums of the DIRR and AL of each tranche, a few floats however many paths
+                partials = [[ExactSum().add(path_metrics[:, i, k]).partials for k in range(2)]
+                            for i in range(path_metrics.shape[1])]
+                results.put(('result', worker, (job, shard), partials))
+            except Exception as error:
+                results.put(('error', worker, (job, shard), repr(error)))
+    finally:
+        stopped.set()
+
+
+# start numWorkers worker processes on this machine, e.g. for testing
+def startLocalWorkers(coordinator, numWorkers):
+    processes = []
+    for i in range(numWorkers):
+        p = multiprocessing.Process(target=runWorker, args=(coordinator.address, coordinator.authkey), daemon=True)
+        p.start()
+        processes.append(p)
+    return processes
+
+
+# the distributed counterpart of runSimulationParallel
+def runSimulationDistributed(coordinator, structured_securities, NSIM, seed=None, start=0):
+    return coordinator.simulate(structured_securities, NSIM, seed, start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulation worker')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, required=True)
+    parser.add_argument('--authkey', required=True, help='the authkey of the coordinator')
+    args = parser.parse_args()
+    runWorker((args.host, args.port), args.authkey.encode())
@@ -1,6 +1,8 @@
 import numpy as np
-from simulations.simulate_waterfall import simulateWaterfall
+from simulations.simulate_waterfall import simulatePathMetrics, simulateWaterfallDistribution, averageDIRR_AL
+from utils.random_streams import newSeed
 import multiprocessing
+import logging
 
 
 # doWork function can be any function with any argument
@@ -15,14 +17,47 @@ def doWork(input, output):
             break
 
 
-def runSimulationParallel(loan_pool, structured_securities, NSIM, numProcesses):
+# the paths of one process, tagged with the first path so the results can be put back in order
+def _simulateShard(loan_pool, structured_securities, NSIM, seed, start, store=None):
+    return start, simulatePathMetrics(loan_pool, structured_securities, NSIM, seed, start, store)
+
+
+# the distribution of the paths of one process, see _simulateShard
+def _distributionShard(loan_pool, structured_securities, NSIM, seed, start, k):
+    return start, simulateWaterfallDistribution(loan_pool, structured_securities, NSIM, seed, start, k)['distribution']
+
+
+# Every process simulates its own range of paths of the same master seed, so no two processes simulate the same
+# path and the result is the same as simulateWaterfall with that seed, whatever the number of processes
+# with a PathStore every process writes the flows of its own paths into the store's files
+def runSimulationParallel(loan_pool, structured_securities, NSIM, numProcesses, seed=None, start=0, store=None):
+    res = _runShards(_simulateShard, (store,), loan_pool, structured_securities, NSIM, numProcesses, seed, start)
+    # put the paths back in order and average them like simulateWaterfall does
+    return averageDIRR_AL(np.concatenate(res))
+
+
+# runSimulationParallel for simulateWaterfallDistribution: every process keeps only the distribution of its paths
+# and the distributions are merged in path order. The means agree with runSimulationParallel up to rounding
+def runDistributionParallel(loan_pool, structured_securities, NSIM, numProcesses, seed=None, start=0, k=None):
+    res = _runShards(_distributionShard, (k,), loan_pool, structured_securities, NSIM, numProcesses, seed, start)
+    distribution = res[0]
+    for other in res[1:]:
+        distribution.merge(other)
+    return {'DIRR_AL': distribution.DIRR_AL, 'distribution': distribution}
+
+
+# run shard(loan_pool, structured_securities, size, seed, first path, *args) over one contiguous range of paths per
+# process and return the results in path order
+def _runShards(shard, args, loan_pool, structured_securities, NSIM, numProcesses, seed, start):
+    seed = seed if seed is not None else newSeed()
     input_queue = multiprocessing.Queue()
     output_queue = multiprocessing.Queue()
 
-    # add 20 runMC function items into input_queue
-    for i in range(numProcesses):
-        input_queue.put((simulateWaterfall, (loan_pool, structured_securities, int(NSIM / numProcesses))))
-        # create 5 child processes
+    # split the paths into one contiguous range per process
+    bounds = np.linspace(0, NSIM, numProcesses + 1).astype(int)
+    shards = [(int(low), int(high - low)) for low, high in zip(bounds[:-1], bounds[1:]) if high > low]
+    for low, size in shards:
+        input_queue.put((shard, (loan_pool, structured_securities, size, seed, start + low) + tuple(args)))
 
     processes = []  # initialize an empty list of process
     for i in range(numProcesses):
@@ -31,13 +66,14 @@ def runSimulationParallel(loan_pool, structured_securities, NSIM, numProcesses):
         processes.append(p)  # append all the processes
 
     res = []  # result
-    # return the result list
-    while True:
+    done = 0
+    # wait for every shard (or for every process to have stopped)
+    while len(res) < len(shards) and done < numProcesses:
         r = output_queue.get()
-        if r != 'Done':
-            res.append(r)
+        if isinstance(r, str):
+            done += 1
         else:
-            break
+            res.append(r)
 
     for p in processes:
         p.terminate()  # stop the process after done
@@ -45,12 +81,7 @@ def runSimulationParallel(loan_pool, structured_securities, NSIM, numProcesses):
     for p in processes:
         p.join()  # calling main processes to wait until all the processes are finished
 
-    sum_DIRR_AL = np.zeros((len(structured_securities.trancheList), 2))
-    # initialize a ndarray filled with zeros, so that I could change the value by specifying index
-    for simulations in res:
-        for i, tranche in enumerate(simulations):
-            sum_DIRR_AL[i] += [tranche[0], tranche[1]]  # sum both DIRR and AL up
-
-    DIRR_AL = sum_DIRR_AL / len(res)  # get the average by dividing the length of the outer list
-    DIRR_AL = DIRR_AL.tolist()
-    return DIRR_AL
+    if len(res) < len(shards):
+        logging.error('A simulation process failed before finishing its paths')
+        raise RuntimeError('A simulation process failed before finishing its paths')
+    return [result for _, result in sorted(res, key=lambda r: r[0])]
@@ -0,0 +1,79 @@
+"""
+TrancheDistribution summarises the simulated distribution of DIRR, AL and loss of every tranche in constant memory:
+a KLL quantile sketch and running moments per tranche and metric (utils.quantile_sketch). The loss of a tranche on a
+path is the part of its face still unpaid at the end of the path. Paths are added one at a time as they are
+simulated, and the distributions of different processes merge into the distribution of all their paths. The sketches
+are sized from the tail quantiles wanted (utils.quantile_sketch.sketchSize), and summary() reports the rank error of
+the quantiles next to them
+"""
+from utils.quantile_sketch import KLLSketch, Moments, sketchSize
+import numpy as np
+
+
+class TrancheDistribution(object):
+    metrics = ('DIRR', 'AL', 'loss')
+
+    # with k None the sketches are sized so the rank error is at most a tenth of the smallest tail of `quantiles`
+    def __init__(self, tranches, k=None, quantiles=(0.95, 0.99, 0.999)):
+        self._quantiles = tuple(quantiles)
+        k = k if k is not None else sketchSize(self._quantiles)
+        self._moments = Moments((tranches, len(self.metrics)))
+        self._sketches = [[KLLSketch(k) for _ in self.metrics] for _ in range(tranches)]
+
+    def __len__(self):
+        return len(self._moments)
+
+    # add one path: [DIRR, AL, loss] of each tranche, tranches x 3
+    def add(self, path_metrics):
+        self._moments.add(path_metrics)
+        for tranche_sketches, tranche_metrics in zip(self._sketches, path_metrics):
+            for sketch, value in zip(tranche_sketches, tranche_metrics):
+                sketch.add(value)
+
+    # the distribution of the paths of both; the other one is not changed
+    def merge(self, other):
+        self._moments.merge(other._moments)
+        for tranche_sketches, other_sketches in zip(self._sketches, other._sketches):
+            for sketch, other_sketch in zip(tranche_sketches, other_sketches):
+                sketch.merge(other_sketch)
+        return self
+
+    # the q quantile(s) of each tranche and metric: tranches x 3 (x len(q))
+    def quantile(self, q):
+        return np.array([[sketch.quantile(q) for sketch in tranche_sketches] for tranche_sketches in self._sketches])
+
+    # a table per tranche of mean, standard deviation, skewness, excess kurtosis and the given tail quantiles of
+    # every metric, e.g. summary()[0]['DIRR']['q0.99'] (by default the quantiles the sketches were sized for), with
+    # 'rankError': each quantile is the value of a rank within rankError * len(self) of the exact one
+    def summary(self, quantiles=None):
+        quantiles = quantiles if quantiles is not None else self._quantiles
+        tail = self.quantile(list(quantiles))
+        std = np.sqrt(self._moments.variance)
+        res = []
+        for i in range(len(self._sketches)):
+            tranche = {}
+            for j, metric in enumerate(self.metrics):
+                tranche[metric] = {'mean': float(self.mean[i, j]), 'std': float(std[i, j]),
+                                   'skewness': float(self._moments.skewness[i, j]),
+                                   'kurtosis': float(self._moments.kurtosis[i, j])}
+                tranche[metric].update({'q{}'.format(q): float(tail[i, j, n]) for n, q in enumerate(quantiles)})
+                tranche[metric]['rankError'] = self._sketches[i][j].rankError
+            res.append(tranche)
+        return res
+
+    # the [DIRR, AL] means of each tranche, like simulateWaterfall returns
+    @property
+    def DIRR_AL(self):
+        return self.mean[:, :2].tolist()
+
+    @property
+    def k(self):
+        return self._sketches[0][0].k
+
+    @property
+    def mean(self):
+        return self._moments.mean
+
+    @property
+    def moments(self):
+        return self._moments
@@ -0,0 +1,107 @@
+"""
+Variance reduction for simulateWaterfall. The paths are simulated with the array engine (PoolSchedule + PoolPaths);
+what changes is how the default-time uniforms are drawn and how the paths are averaged:
+
+antithetic: paths come in pairs, the second one using 1 - U for every loan, and each pair is averaged first
+control: 'defaults' or 'loss', a control variate on the number of defaults or on the pool default loss of each path,
+         whose expectation is known analytically from the schedule and Loan.default_dict
+sobol: the uniforms are scrambled Sobol points (needs scipy), in `replicates` independently scrambled batches so the
+       error can still be estimated
+
+Besides the average [DIRR, AL] per tranche, every run reports the standard error of each estimate and its variance
+reduction factor: the variance plain Monte Carlo would have with the same number of paths, divided by the variance
+achieved. A factor of 4 means plain Monte Carlo would need 4 times the paths for the same precision
+"""
+from loan.pool_schedule import PoolSchedule
+from simulations.pool_paths import PoolPaths
+from utils.random_streams import newSeed, pathGenerator, pathUniforms
+import logging
+import math
+import numpy as np
+
+try:
+    from scipy.stats import qmc
+except ImportError:  # scipy is only needed for sobol
+    qmc = None
+
+
+# scrambled Sobol uniforms for NSIM paths in `replicates` independently scrambled batches
+def sobolUniforms(seed, start, NSIM, size, replicates):
+    if qmc is None:
+        logging.error('Sobol sampling needs scipy (pip install scipy)')
+        raise ImportError('Sobol sampling needs scipy (pip install scipy)')
+    per_replicate = NSIM // replicates
+    batches = []
+    for r in range(replicates):
+        try:
+            sampler = qmc.Sobol(d=size, scramble=True, rng=pathGenerator(seed, start + r))
+        except TypeError:  # scipy before 1.15 calls it seed
+            sampler = qmc.Sobol(d=size, scramble=True, seed=pathGenerator(seed, start + r))
+        batches.append(sampler.random(per_replicate))
+    return np.concatenate(batches)
+
+
+# Simulate the waterfall with the chosen variance reduction. Returns a dict with 'DIRR_AL' (average [DIRR, AL] per
+# tranche, as simulateWaterfall), 'standardError' and 'varianceReduction' (both per tranche, per DIRR and AL),
+# 'paths' (paths simulated) and 'units' (independent units the error is estimated from). NSIM is rounded up to whole
+# antithetic pairs and to Sobol replicates of a power of two paths each, with a warning
+def simulateWaterfallVR(loanpool, structured_securities, NSIM, antithetic=False, control=None, sobol=False,
+                        replicates=8, seed=None, start=0, schedule=None):
+    if control not in {None, 'defaults', 'loss'}:
+        logging.error('Please enter a valid control variate (defaults/loss)')
+        raise ValueError('Please enter a valid control variate (defaults/loss)')
+    schedule = schedule if schedule is not None else PoolSchedule(loanpool)
+    seed = seed if seed is not None else newSeed()
+    loans = len(schedule.lastActive)
+    draws = (NSIM + 1) // 2 if antithetic else NSIM  # paths drawn, before mirroring
+    if sobol:
+        # Sobol points are only balanced in powers of two, so every replicate draws the next power of two of its share
+        draws = replicates * (1 << (max(math.ceil(draws / replicates), 1) - 1).bit_length())
+    paths = draws * 2 if antithetic else draws
+    if paths != NSIM:
+        logging.warning(f'{NSIM} paths do not fill {"antithetic pairs" if antithetic else ""}'
+                        f'{" and " if antithetic and sobol else ""}{"Sobol replicates" if sobol else ""}, '
+                        f'simulating {paths} paths instead')
+
+    if sobol:
+        uniforms = sobolUniforms(seed, start, draws, schedule.randomsPerPath, replicates)
+        unit = np.repeat(np.arange(replicates), draws // replicates)  # a replicate is one independent unit
+    else:
+        uniforms = pathUniforms(seed, start, draws, schedule.randomsPerPath)
+        unit = np.arange(draws)  # every path (or antithetic pair) is its own unit
+    if antithetic:
+        uniforms = np.concatenate([uniforms, 1 - uniforms])
+        unit = np.concatenate([unit, unit])
+
+    # the controls use the default periods drawn before prepayments take any loans out, whose expectation is known
+    default_times = schedule.defaultTimes(uniforms[:, :loans])
+    event_times, prepay_times = schedule.competingRisks(default_times, uniforms[:, loans:])
+    path_metrics = PoolPaths(*schedule.poolCashFlows(event_times, prepay_times=prepay_times)).pathDIRR_AL(
+        structured_securities)
+    units = unit.max() + 1
+    counts = np.bincount(unit, minlength=units)
+    # mean of every unit: units x tranches x 2
+    unit_metrics = np.stack([np.bincount(unit, path_metrics[:, i, k], minlength=units) / counts
+                             for i in range(path_metrics.shape[1]) for k in range(2)], axis=1)
+    unit_metrics = unit_metrics.reshape(units, path_metrics.shape[1], 2)
+
+    if control is not None:
+        if control == 'defaults':
+            x, expected = schedule.defaultCount(default_times), schedule.expectedDefaultCount()
+        else:
+            x, expected = schedule.defaultLoss(default_times), schedule.expectedDefaultLoss()
+        unit_x = np.bincount(unit, x, minlength=units) / counts - expected
+        # regression coefficient of every estimate on the control, then take the known error of the control out
+        centered_x = unit_x - unit_x.mean()
+        variance_x = (centered_x ** 2).sum()
+        beta = np.tensordot(centered_x, unit_metrics - unit_metrics.mean(axis=0), axes=(0, 0)) / variance_x \
+            if variance_x > 0 else np.zeros(unit_metrics.shape[1:])
+        unit_metrics = unit_metrics - beta * unit_x[:, None, None]
+
+    estimate = unit_metrics.mean(axis=0)
+    variance = unit_metrics.var(axis=0, ddof=1) / units
+    plain_variance = path_metrics.var(axis=0, ddof=1) / len(path_metrics)  # plain Monte Carlo, same number of paths
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variance_reduction = np.where(variance > 0, plain_variance / variance, np.inf)
+    return {'DIRR_AL': estimate.tolist(), 'standardError': np.sqrt(variance).tolist(),
+            'varianceReduction': variance_reduction.tolist(), 'paths': len(path_metrics), 'units': int(units)}
@@ -0,0 +1,114 @@
+from asset.asset_houses import PrimaryHome, VacationHome
+from loan.loan_pool import LoanPool
+from loan.mortgage import FixedMortgage
+from loan.pool_surfaces import SurfaceStatistics, surfaceBlocks
+import numpy as np
+import logging
+import os
+import tempfile
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the LTV and equity surfaces of a pool of auto loans and mortgages, one of them flagged as
+defaulted, against asking every loan: surfaces() is balance(T) / asset.value(T) and equity(T) of every loan and
+period, also when written into memmap files. The summary of surfaceStatistics is the count, balance, value and equity
+of the active loans, the underwater loans and their negative equity, the pool LTV and WALTV worked out from those per
+loan figures, whatever the block size, and the statistics of two halves of the pool merged are those of the whole.
+The LTV quantiles of the histogram are the quantiles of the loan LTVs within a bin. A loan is paid off at its term,
+so the rounding Loan.balance leaves there does not make it an active loan
+'''
+
+LOANS = 150  # auto loans of the csv used
+MORTGAGES = 30  # mortgages added to them
+BLOCK = 17  # loans per block of the streamed statistics
+TOLERANCE = 1e-9  # largest relative difference allowed
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+def main():
+    rng = np.random.default_rng(2048)
+    loans = list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS]
+    loans += [FixedMortgage(int(rng.choice([120, 180, 360])), float(rng.uniform(0.02, 0.08)), face,
+                            (PrimaryHome if i % 2 else VacationHome)(face * float(rng.uniform(0.9, 1.5))))
+              for i, face in enumerate(rng.uniform(50000, 400000, MORTGAGES))]
+    loans[3].checkDefault(0)
+    pool1 = LoanPool(loans)
+    periods = int(max(loan.term for loan in loans)) + 1
+    failures = []
+
+    def relative(value, reference):
+        return float(np.max(np.abs(value - reference) / np.maximum(np.abs(reference), 1), initial=0))
+
+    # a loan is paid off at its term, where Loan.balance leaves a rounding of about 1e-11 of either sign
+    balance = np.array([[loan.balance(T) if T != loan.term else 0.0 for T in range(periods)] for loan in loans])
+    value = np.array([[loan.asset.value(T) for T in range(periods)] for loan in loans])
+    equity = np.maximum(value - balance, 0)
+    diff = relative(equity, np.array([[loan.equity(T) for T in range(periods)] for loan in loans]))
+    print(f'equity of the balances against Loan.equity: {diff:.3e}')
+    failures += ['equity'] if diff > TOLERANCE else []
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ltv = np.where(value > 0, balance / value, np.where(balance > 0, np.inf, 0.0))
+    surfaces = pool1.surfaces()
+    diffs = [relative(surfaces[0], ltv), relative(surfaces[1], equity)]
+    with tempfile.TemporaryDirectory() as directory:
+        ltv_file, equity_file = [np.lib.format.open_memmap(os.path.join(directory, name), 'w+', float,
+                                                           (len(loans), periods)) for name in ('ltv.npy', 'eq.npy')]
+        pool1.surfaces(ltvOut=ltv_file, equityOut=equity_file)
+        diffs += [relative(np.asarray(ltv_file), ltv), relative(np.asarray(equity_file), equity)]
+        del ltv_file, equity_file
+    print(f'surfaces against the loans: LTV {diffs[0]:.3e}, equity {diffs[1]:.3e}, '
+          f'memmap {diffs[2]:.3e} and {diffs[3]:.3e}')
+    failures += ['surfaces'] if max(diffs) > TOLERANCE else []
+
+    active = balance > 0
+    underwater = active & (balance > value)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = {'active': active.sum(axis=0), 'balance': balance.sum(axis=0),
+                    'value': np.where(active, value, 0).sum(axis=0), 'equity': np.where(active, equity, 0).sum(axis=0),
+                    'underwater': underwater.sum(axis=0),
+                    'negativeEquity': np.where(underwater, balance - value, 0).sum(axis=0)}
+        expected['underwaterShare'] = np.where(expected['active'] > 0, expected['underwater'] / expected['active'], 0)
+        expected['underwaterBalanceShare'] = np.where(
+            expected['balance'] > 0, np.where(underwater, balance, 0).sum(axis=0) / expected['balance'], 0)
+        expected['poolLTV'] = np.where(expected['value'] > 0, expected['balance'] / expected['value'], 0)
+        expected['WALTV'] = np.where(expected['balance'] > 0, (balance * np.where(active, ltv, 0)).sum(axis=0) /
+                                     expected['balance'], 0)
+
+    statistics = pool1.surfaceStatistics(blockLoans=BLOCK)
+    halves = LoanPool(loans[:len(loans) // 2]).surfaceStatistics(periods).merge(
+        LoanPool(loans[len(loans) // 2:]).surfaceStatistics(periods))
+    print(f'{"statistic":<24s}{"blocks":<12s}{"halves"}')
+    for name, reference in expected.items():
+        diff = [relative(statistics.summary()[name], reference), relative(halves.summary()[name], reference)]
+        print(f'{name:<24s}{diff[0]:<12.3e}{diff[1]:.3e}')
+        failures += [name] if max(diff) > TOLERANCE else []
+
+    # an LTV quantile of the histogram is in the bin of the loan at that rank (an LTV above the bins in the last one)
+    width = np.diff(statistics.bins).max()
+    for q in QUANTILES:
+        histogram = statistics.quantile(q)
+        loans_quantile = np.array([np.quantile(np.minimum(ltv[active[:, T], T], statistics.bins[-1]), q,
+                                               method='inverted_cdf')
+                                   if active[:, T].any() else np.nan for T in range(periods)])
+        diff = np.nanmax(np.abs(histogram - loans_quantile))
+        same_periods = np.array_equal(np.isnan(histogram), np.isnan(loans_quantile))
+        print(f'LTV {q:g} quantile: {diff:.4f} from the loans, a bin is {width:.4f}')
+        failures += ['LTV {:g}'.format(q)] if diff > width or not same_periods else []
+
+    blocks = SurfaceStatistics(periods)
+    for _, block_balance, block_value in surfaceBlocks(loans, periods, BLOCK):
+        blocks.add(block_balance, block_value)
+    diff = np.abs(blocks.histogram - statistics.histogram).max()
+    print(f'histogram of surfaceBlocks added up against surfaceStatistics: {diff:.3e}')
+    failures += ['histogram'] if diff > 0 else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The surfaces are the LTV and equity of the loans')
+
+
+if __name__ == '__main__':
+    main()
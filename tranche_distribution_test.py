@@ -0,0 +1,89 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from simulations.simulate_waterfall import simulateWaterfall, simulateWaterfallDistribution
+from simulations.simulation_parallel import runDistributionParallel
+from utils.quantile_sketch import KLLSketch, Moments, sketchSize
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the streaming distributions. A KLLSketch of a stream that is split in parts, sketched part
+by part and merged, gives quantiles whose ranks are within the rankError it reports of the exact ones, both with the
+old k = 200 and with k sized by sketchSize for the 99.9% quantile, and Moments merged the same way give the numpy
+mean, variance, skewness and kurtosis. On the waterfall, simulateWaterfallDistribution has the means of
+simulateWaterfall and, with fewer paths than k, the exact quantiles of the paths, and runDistributionParallel
+merges to the same distribution
+'''
+
+VALUES = 200000  # values of the sketched stream
+PARTS = 4  # parts sketched on their own and merged
+QUANTILES = [0.5, 0.95, 0.99, 0.999]  # quantiles checked
+NSIM = 40  # paths of the waterfall
+SEED = 2035  # master seed of the paths
+LOANS = 100  # loans of the csv used
+TOLERANCE = 1e-9  # largest difference allowed in means and moments
+
+
+def main():
+    failures = []
+    values = np.random.default_rng(SEED).standard_t(3, VALUES)
+    exact = np.sort(values)
+    print(f'{"k":<8s}{"rank error":<12s}' + ''.join(f'{"q" + str(q):<12s}' for q in QUANTILES))
+    for k in [200, sketchSize(QUANTILES)]:
+        sketch = KLLSketch(k)
+        for part in np.array_split(values, PARTS):
+            other = KLLSketch(k)
+            other.update(part)
+            sketch.merge(other)
+        ranks = np.searchsorted(exact, sketch.quantile(QUANTILES), 'right') / VALUES
+        print(f'{k:<8d}{sketch.rankError:<12.5f}' + ''.join(f'{rank:<12.5f}' for rank in ranks))
+        if len(sketch) != VALUES or np.abs(ranks - QUANTILES).max() > sketch.rankError:
+            failures.append('sketch with k = {}'.format(k))
+
+    moments = Moments()
+    for part in np.array_split(values, PARTS):
+        other = Moments()
+        for value in part:
+            other.add(value)
+        moments.merge(other)
+    centred = values - values.mean()
+    reference = np.array([values.mean(), values.var(ddof=1), (centred ** 3).mean() / (centred ** 2).mean() ** 1.5,
+                          (centred ** 4).mean() / (centred ** 2).mean() ** 2 - 3])
+    merged = np.array([moments.mean, moments.variance, moments.skewness, moments.kurtosis])
+    diff = np.abs(merged - reference) / np.maximum(np.abs(reference), 1)
+    print(f'merged Moments against numpy: {diff.max():.3e}')
+    failures += ['Moments'] if diff.max() > TOLERANCE else []
+
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    plain = simulateWaterfall(pool1, structured_securities, NSIM, seed=SEED)
+    res = simulateWaterfallDistribution(pool1, structured_securities, NSIM, seed=SEED)
+    distribution = res['distribution']
+    mean_diff = np.abs(np.array(res['DIRR_AL']) - plain).max()
+    print(f'simulateWaterfallDistribution against simulateWaterfall: {mean_diff:.3e} (k = {distribution.k})')
+    failures += ['means'] if mean_diff > TOLERANCE else []
+
+    summary = distribution.summary()
+    errors = [summary[i][metric]['rankError'] for i in range(len(summary)) for metric in distribution.metrics]
+    print(f'rank error reported with {NSIM} paths: {max(errors)}')
+    failures += ['exact quantiles'] if max(errors) != 0 else []
+
+    parallel = runDistributionParallel(pool1, structured_securities, NSIM, 2, seed=SEED)['distribution']
+    quantile_diff = np.abs(parallel.quantile(QUANTILES) - distribution.quantile(QUANTILES)).max()
+    print(f'runDistributionParallel against simulateWaterfallDistribution: {quantile_diff:.3e}')
+    failures += ['parallel'] if quantile_diff > TOLERANCE else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The sketches stay within their reported rank error')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from liabilities.tranche_base import Tranche
+from liabilities.standard_tranche import StandardTranche
+from utils.waterfall import doWaterfall
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the payment ledger of StandardTranche: on every path of doWaterfall (the same tranches
+reset between paths, the paths longer than the first ledger so it has to grow) the ledger holds the interest and
+principal paid of every period of the structured securities waterfall, and the metrics doWaterfall returns from
+the ledger (ledgerMetrics) are the ones the tranche methods give from lists of the waterfall payments, the way
+doWaterfall worked them out before the ledger
+'''
+
+NSIM = 20  # number of paths
+SEED = 2039  # master seed of the paths
+LOANS = 100  # loans of the csv used
+TOLERANCE = 1e-9  # largest difference allowed in payments, IRR, DIRR and AL
+
+
+# IRR, DIRR, AL and rating of each tranche from the lists of payments of the structured securities waterfall
+def listMetrics(structured_securities, structured_securities_waterfall):
+    metrics = []
+    for index, tranche in enumerate(structured_securities.trancheList):
+        principal_payment = [period[index][4] for period in structured_securities_waterfall]
+        monthly_payment = [period[index][2] + period[index][4] for period in structured_securities_waterfall]
+        metrics.append([tranche.IRR(monthly_payment), tranche.DIRR(monthly_payment), tranche.AL(principal_payment),
+                        Tranche.DIRR_Rating(tranche.DIRR(monthly_payment))])
+    return metrics
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.7, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.07, 1)
+    structured_securities.addTranche(0.1, 0.1, 2)
+    failures = []
+
+    ledger_diff = metric_diff = 0.0
+    ratings = periods = 0
+    for path in range(NSIM):
+        pool1.reset()
+        structured_securities.reset()
+        pool1.drawDefaults(SEED, path)
+        _, structured_securities_waterfall, _, metrics = doWaterfall(pool1, structured_securities)
+        waterfall = np.array(structured_securities_waterfall, dtype=float)
+        periods = max(periods, len(waterfall))
+        for index, tranche in enumerate(structured_securities.trancheList):
+            ledger_diff = max(ledger_diff, float(len(tranche.ledger) != len(waterfall)),
+                              np.abs(tranche.ledger - waterfall[:, index, [2, 4]]).max())
+        reference = listMetrics(structured_securities, structured_securities_waterfall)
+        metric_diff = max(metric_diff, np.abs(np.array(metrics)[:, :3].astype(float) -
+                                              np.array(reference)[:, :3].astype(float)).max())
+        ratings += sum(metric[3] != reference_metric[3] for metric, reference_metric in zip(metrics, reference))
+    print(f'ledger against the waterfall payments ({periods} periods, first ledger '
+          f'{StandardTranche.ledgerCapacity}): {ledger_diff:.3e}')
+    print(f'ledgerMetrics against the tranche methods: {metric_diff:.3e}, ratings that differ: {ratings}')
+    failures += ['ledger'] if ledger_diff > TOLERANCE else []
+    failures += ['metrics'] if metric_diff > TOLERANCE or ratings else []
+    failures += ['ledger never grew'] if periods <= StandardTranche.ledgerCapacity else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('The ledger has the payments of the waterfall')
+
+
+if __name__ == '__main__':
+    main()
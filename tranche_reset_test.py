@@ -0,0 +1,79 @@
+from loan.loan_pool import LoanPool
+from liabilities.structured_securities import StructuredSecurities
+from simulations.simulate_waterfall import simulatePathMetrics
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check that StructuredSecurities.reset() (and so StandardTranche.reset()) puts the tranches back
+in the state they were created in: every attribute of a tranche that has run a path and been reset is the same as
+that of a new tranche, and the paths of simulatePathMetrics, which resets the same tranches between paths, are the
+same as running every path on tranches of its own. A principal shortfall left at the end of a path would otherwise be
+owed again on the next path
+'''
+
+NSIM = 60  # number of paths
+SEED = 2038  # master seed of the paths
+LOANS = 100  # loans of the csv used
+TOLERANCE = 1e-12  # largest difference allowed in DIRR, AL and payments
+SHORT_PAYMENT = 1000  # principal paid on a full face due, leaving a shortfall
+PRINCIPAL_DUE = 5000  # principal due of the first period after the reset
+
+
+def structure(loanpool):
+    structured_securities = StructuredSecurities(loanpool.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    return structured_securities
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    failures = []
+
+    shared = structure(pool1)
+    path_metrics = simulatePathMetrics(pool1, shared, NSIM, SEED)
+    own = np.concatenate([simulatePathMetrics(pool1, structure(pool1), 1, SEED, path) for path in range(NSIM)])
+    differ = np.abs(path_metrics - own).max(axis=(1, 2))
+    print(f'paths that differ from a run on tranches of their own: {int((differ > TOLERANCE).sum())} of {NSIM}, '
+          f'largest difference {differ.max():.3e}')
+    failures += ['paths'] if differ.max() > TOLERANCE else []
+
+    # leave a principal shortfall on the tranches, reset them and pay both them and new tranches the same
+    fresh = structure(pool1)
+    shared.reset()
+    for tranche in shared.trancheList:
+        tranche.increaseTimePeriod()
+        tranche.makePrincipalPayment(SHORT_PAYMENT, tranche.face)
+    shared.reset()
+    paid = []
+    for tranche, new in zip(shared.trancheList, fresh.trancheList):
+        for payee in [tranche, new]:
+            payee.increaseTimePeriod()
+            payee.makeInterestPayment(payee.face)
+            paid.append(payee.face - payee.makePrincipalPayment(payee.face, PRINCIPAL_DUE))
+    paid = np.array(paid).reshape(-1, 2)
+    print(f'principal paid after reset against new tranches (due {PRINCIPAL_DUE}): {paid.tolist()}')
+    failures += ['principal due after reset'] if np.abs(paid[:, 0] - paid[:, 1]).max() > TOLERANCE else []
+    shared.reset()
+    fresh.reset()
+    # the ledger keeps the capacity it has grown to, only the periods in use have to be the same
+    stale = sorted({name for tranche, new in zip(shared.trancheList, fresh.trancheList)
+                    for name, value in vars(new).items()
+                    if name != '_ledger' and not np.array_equal(vars(tranche)[name], value)} |
+                   {'ledger' for tranche in shared.trancheList if tranche._ledger.any() or len(tranche.ledger)})
+    print(f'attributes not reset: {stale}')
+    failures += ['reset'] if stale else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('Every path starts from new tranches')
+
+
+if __name__ == '__main__':
+    main()
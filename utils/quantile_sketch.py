@@ -0,0 +1,181 @@
+"""
+Mergeable streaming summaries of a stream of values, in memory that does not grow with the number of values:
+KLLSketch for quantiles (Karnin, Lang and Liberty's compactor sketch) and Moments for the count, mean, variance,
+skewness and kurtosis. Two summaries of different streams merge into the summary of both streams, so every process
+can summarise its own paths and the results are merged afterwards
+"""
+import numpy as np
+import logging
+
+
+# the k of a KLLSketch whose rank error is at most `share` of the smallest tail of the quantiles, min(q, 1 - q),
+# and at least 200: the 0.999 quantile needs k = 17000 for a rank error of 0.01%
+def sketchSize(quantiles, share=0.1):
+    tail = min(min(q, 1 - q) for q in np.atleast_1d(quantiles))
+    if tail <= 0:
+        return 200
+    return max(int(np.ceil(KLLSketch.errorConstant / (share * tail))), 200)
+
+
+class KLLSketch(object):
+    # the rank error is about errorConstant / k of the number of values (k = 200 gives ~1%)
+    errorConstant = 1.7
+
+    # k sets the accuracy (see sketchSize to size it from the quantiles wanted); until the values overflow the
+    # k-sized top buffer nothing is compacted and the quantiles are exact
+    # the seed only decides which half of a compacted buffer is kept, so the same stream gives the same sketch
+    def __init__(self, k=200, seed=0):
+        if k < 8:
+            logging.error('k should be at least 8, got {}'.format(k))
+            raise ValueError('k should be at least 8')
+        self._k = k
+        self._compactors = [[]]  # level h holds values of weight 2 ** h
+        self._count = 0
+        self._min = np.inf
+        self._max = -np.inf
+        self._random = np.random.Generator(np.random.Philox(seed))
+
+    def __len__(self):
+        return self._count
+
+    # the capacity of level h: k at the top level, shrinking by 2 / 3 per level below it, at least 2
+    def _capacity(self, level):
+        return max(int(np.ceil(self._k * (2 / 3) ** (len(self._compactors) - level - 1))), 2)
+
+    def add(self, value):
+        value = float(value)
+        self._compactors[0].append(value)
+        self._count += 1
+        self._min = min(self._min, value)
+        self._max = max(self._max, value)
+        if len(self._compactors[0]) >= self._capacity(0):
+            self._compress()
+
+    def update(self, values):
+        for value in values:
+            self.add(value)
+
+    # while the sketch holds more values than its total capacity, halve the lowest level that is over its capacity:
+    # sort it and promote every other value to the level above
+    def _compress(self):
+        while sum(map(len, self._compactors)) >= sum(map(self._capacity, range(len(self._compactors)))):
+            level = next(level for level, compactor in enumerate(self._compactors)
+                         if len(compactor) >= self._capacity(level))
+            if level + 1 == len(self._compactors):
+                self._compactors.append([])
+            compactor = sorted(self._compactors[level])
+            # an odd value out stays at this level
+            keep = [compactor.pop()] if len(compactor) % 2 else []
+            self._compactors[level + 1].extend(compactor[int(self._random.integers(2))::2])
+            self._compactors[level] = keep
+
+    # the sketch of both streams; the other sketch is not changed
+    def merge(self, other):
+        if other._k != self._k:
+            logging.error('Cannot merge sketches with different k ({} and {})'.format(self._k, other._k))
+            raise ValueError('Cannot merge sketches with different k')
+        while len(self._compactors) < len(other._compactors):
+            self._compactors.append([])
+        for level, compactor in enumerate(other._compactors):
+            self._compactors[level].extend(compactor)
+        self._count += other._count
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        self._compress()
+        return self
+
+    # the approximate q quantile(s) of the stream, q in [0, 1]
+    def quantile(self, q):
+        if self._count == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        values = np.concatenate([np.asarray(compactor) for compactor in self._compactors])
+        weights = np.concatenate([np.full(len(compactor), 2.0 ** level)
+                                  for level, compactor in enumerate(self._compactors)])
+        order = np.argsort(values, kind='stable')
+        values, ranks = values[order], np.cumsum(weights[order])
+        index = np.searchsorted(ranks, np.asarray(q) * ranks[-1], 'left')
+        result = values[np.minimum(index, len(values) - 1)]
+        # the exact extremes are known, so the 0 and 1 quantiles are exact
+        result = np.where(np.asarray(q) <= 0, self._min, np.where(np.asarray(q) >= 1, self._max, result))
+        return result if np.ndim(q) else float(result)
+
+    @property
+    def k(self):
+        return self._k
+
+    # the bound on the rank error of quantile() as a share of the values: 0 while nothing has been compacted
+    @property
+    def rankError(self):
+        return 0.0 if len(self._compactors) == 1 else self.errorConstant / self._k
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+
+# count, mean and the 2nd to 4th central moment sums of a stream of arrays of the same shape, element by element
+# values are added one array at a time and two Moments merge exactly (Pebay's pairwise formulas)
+class Moments(object):
+    def __init__(self, shape=()):
+        self._count = 0
+        self._mean = np.zeros(shape)
+        self._M2 = np.zeros(shape)
+        self._M3 = np.zeros(shape)
+        self._M4 = np.zeros(shape)
+
+    def __len__(self):
+        return self._count
+
+    def add(self, values):
+        values = np.asarray(values, dtype=float)
+        zero = np.zeros_like(values)
+        self._combine(1, values, zero, zero, zero)
+
+    # the moments of both streams; the other Moments is not changed
+    def merge(self, other):
+        self._combine(other._count, other._mean, other._M2, other._M3, other._M4)
+        return self
+
+    def _combine(self, nb, mean_b, M2b, M3b, M4b):
+        na = self._count
+        if nb == 0:
+            return
+        n = na + nb
+        delta = mean_b - self._mean
+        M2a, M3a, M4a = self._M2, self._M3, self._M4
+        self._M4 = (M4a + M4b + delta ** 4 * na * nb * (na * na - na * nb + nb * nb) / n ** 3
+                    + 6 * delta ** 2 * (na * na * M2b + nb * nb * M2a) / n ** 2
+                    + 4 * delta * (na * M3b - nb * M3a) / n)
+        self._M3 = (M3a + M3b + delta ** 3 * na * nb * (na - nb) / n ** 2
+                    + 3 * delta * (na * M2b - nb * M2a) / n)
+        self._M2 = M2a + M2b + delta ** 2 * na * nb / n
+        self._mean = self._mean + delta * nb / n
+        self._count = n
+
+    @property
+    def count(self):
+        return self._count
+
+    @property
+    def mean(self):
+        return self._mean
+
+    # sample variance
+    @property
+    def variance(self):
+        return self._M2 / (self._count - 1) if self._count > 1 else np.zeros_like(self._M2)
+
+    @property
+    def skewness(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self._M2 > 0, np.sqrt(self._count) * self._M3 / self._M2 ** 1.5, 0.0)
+
+    # excess kurtosis
+    @property
+    def kurtosis(self):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self._M2 > 0, self._count * self._M4 / self._M2 ** 2 - 3, 0.0)
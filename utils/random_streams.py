@@ -0,0 +1,34 @@
+"""
+Per-path random number streams. The randomness of simulation path i under master seed s comes from its own
+counter-based Philox generator keyed by SeedSequence(s, spawn_key=(i,)), so any single path can be regenerated on its
+own, shards of paths are independent however the paths are split between processes, and a serial and a parallel run
+with the same seed simulate exactly the same paths
+"""
+import numpy as np
+
+# the first part of the spawn key of every loan stream (see loanGenerator)
+LOAN_STREAMS = 1
+
+
+# a fresh master seed, for runs that were not given one
+def newSeed():
+    return np.random.SeedSequence().entropy
+
+
+# the generator of one path
+def pathGenerator(seed, path):
+    return np.random.Generator(np.random.Philox(np.random.SeedSequence(seed, spawn_key=(path,))))
+
+
+# uniforms on [0, 1) for NSIM consecutive paths starting at path start, size of them per path: (NSIM, size)
+def pathUniforms(seed, start, NSIM, size):
+    uniforms = np.empty((NSIM, size))
+    for i in range(NSIM):
+        uniforms[i] = pathGenerator(seed, start + i).random(size)
+    return uniforms
+
+
+# the generator of one loan: draws that follow the loan with key (an int) whatever pool it is in, see
+# simulations.incremental_pool. The two-part spawn keys of the loans never meet the one-part keys of the paths
+def loanGenerator(seed, key):
+    return np.random.Generator(np.random.Philox(np.random.SeedSequence(seed, spawn_key=(LOAN_STREAMS, key))))
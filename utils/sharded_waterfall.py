@@ -0,0 +1,131 @@
+"""
+doWaterfall of a single path on a huge pool as a map-reduce over the loans. The pool side of a path is a sum over
+the loans, so the loans are split into shards, every shard builds the PoolSchedule of its own loans and the
+per-period series of the path (PoolSchedule.pathAggregates: payments, principal, interest, recoveries, prepayments,
+active loans and balance) in a process (or thread) of its own, the series of the shards are added up into the pool
+series and the tranche waterfall runs once on them. The pool work, and the memory of the schedules, is spread over
+the cores instead of one pass over every loan every period.
+
+The path is the current path of the pool (LoanPool.pathEvents), the same one doWaterfall would run, and the
+tranche results are the same as doWaterfall up to rounding. Instead of the waterfall of every loan, the pool side
+comes back as the pool series
+"""
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from utils.waterfall import doTrancheWaterfall
+from multiprocessing.pool import ThreadPool
+import numpy as np
+import multiprocessing
+import queue
+import math
+import logging
+
+# the most loans in a shard: a PoolSchedule takes about 100 bytes per loan x period while it is built
+SHARD_LOANS = 10000
+
+
+# The pool series of the path for loans low..high of the pool, from a PoolSchedule of those loans over all the
+# periods of the pool
+def shardAggregates(loans, hazard, periods, default_times, prepay_times, low, high):
+    schedule = PoolSchedule(LoanPool(loans[low:high], hazard), periods)
+    return schedule.pathAggregates(default_times[low:high],
+                                   prepay_times[low:high] if prepay_times is not None else None)
+
+
+# a map process: takes (low, high) shards until there are none left and puts back ('result', shard, series), or
+# ('error', shard, error) for a shard that failed. The loans come with the process when it starts, only the bounds of
+# the shards go through the queue
+def _shardWorker(loans, hazard, periods, default_times, prepay_times, input, output):
+    while True:
+        try:
+            low, high = input.get(timeout=1)
+        except queue.Empty:
+            output.put('Done')
+            break
+        try:
+            output.put(('result', (low, high),
+                        shardAggregates(loans, hazard, periods, default_times, prepay_times, low, high)))
+        except Exception as error:
+            output.put(('error', (low, high), repr(error)))
+
+
+# doWaterfall of the current path of the pool with the loans split into shards of at most shardSize loans, mapped
+# over numProcesses processes (all cores by default), or threads with threads=True (numpy lets go of the GIL in the
+# large array operations), or run in this process with numProcesses=1.
+# Returns the pool series (a dict of arrays over periods 0..last period, see PoolSchedule.pathAggregates, plus the
+# 'cash' available and 'principalDue'), the tranche waterfall, the reserve account and the tranche metrics
+def doWaterfallSharded(loanpool, structured_securities, numProcesses=None, shardSize=None, threads=False):
+    if not isinstance(loanpool, LoanPool) or not isinstance(structured_securities, StructuredSecurities):
+        logging.error('Please enter the correct class type')
+    loans = list(loanpool)
+    periods = int(max((loan.term for loan in loans), default=0)) + 1
+    default_times, prepay_times = loanpool.pathEvents()
+    numProcesses = numProcesses or multiprocessing.cpu_count()
+    shardSize = shardSize or max(1, min(SHARD_LOANS, math.ceil(len(loans) / numProcesses)))
+    shards = [(low, min(low + shardSize, len(loans))) for low in range(0, len(loans), shardSize)]
+    args = (loans, loanpool.hazard, periods, default_times, prepay_times)
+
+    if numProcesses == 1 or len(shards) <= 1:
+        res = [(low, shardAggregates(*args, low, high)) for low, high in shards]
+    elif threads:
+        with ThreadPool(numProcesses) as pool:
+            res = list(zip([low for low, _ in shards],
+                           pool.starmap(shardAggregates, [args + shard for shard in shards])))
+    else:
+        res = _mapShards(args, shards, numProcesses)
+
+    # reduce: the series of the shards added up in the order of the loans
+    series = {name: np.zeros(periods, dtype=values.dtype) for name, values in res[0][1].items()} if res else \
+        PoolSchedule(LoanPool([], loanpool.hazard), periods).pathAggregates(default_times[:0])
+    for _, shard_series in sorted(res, key=lambda r: r[0]):
+        for name, values in shard_series.items():
+            series[name] += values
+    series['cash'] = series['payment'] + series['recovery'] + series['prepayment']
+    series['principalDue'] = series['principal'] + series['prepayment']
+    active = np.nonzero(series['active'])[0]
+    last_period = max(int(active[-1]) if len(active) else 0, 1)
+
+    collateral = series['balance'].tolist() if structured_securities.spec.needsCollateral else None
+    structured_securities_waterfall, reserve_account, metrics = doTrancheWaterfall(
+        series['cash'].tolist(), series['principalDue'].tolist(), last_period, structured_securities, collateral)
+    return {name: values[:last_period + 1] for name, values in series.items()}, structured_securities_waterfall, \
+        reserve_account, metrics
+
+
+# the map over processes, the results in any order
+def _mapShards(args, shards, numProcesses):
+    input_queue = multiprocessing.Queue()
+    output_queue = multiprocessing.Queue()
+    for shard in shards:
+        input_queue.put(shard)
+
+    processes = []
+    for i in range(min(numProcesses, len(shards))):
+        p = multiprocessing.Process(target=_shardWorker, args=args + (input_queue, output_queue))
+        p.start()
+        processes.append(p)
+
+    res = []
+    done = 0
+    try:
+        # wait for every shard (or for every process to have stopped)
+        while len(res) < len(shards) and done < len(processes):
+            r = output_queue.get()
+            if isinstance(r, str):
+                done += 1
+            elif r[0] == 'error':
+                logging.error(f'Waterfall shard of loans {r[1][0]}..{r[1][1] - 1} failed: {r[2]}')
+                raise RuntimeError(f'Waterfall shard of loans {r[1][0]}..{r[1][1] - 1} failed: {r[2]}')
+            else:
+                res.append((r[1][0], r[2]))
+    finally:
+        for p in processes:
+            p.terminate()
+        for p in processes:
+            p.join()
+
+    if len(res) < len(shards):
+        logging.error('A waterfall shard process failed before finishing its loans')
+        raise RuntimeError('A waterfall shard process failed before finishing its loans')
+    return res
@@ -1,6 +1,5 @@
 from loan.loan_pool import LoanPool
 from liabilities.structured_securities import StructuredSecurities
-from liabilities.tranche_base import Tranche
 import logging
 
 '''
@@ -15,6 +14,8 @@ in the liabilities module
 def doWaterfall(loanpool, structured_securities):
     if not isinstance(loanpool, LoanPool) or not isinstance(structured_securities, StructuredSecurities):
         logging.error('Please enter the correct class type')
+    if loanpool.hazard is not None:
+        return _scheduleWaterfall(loanpool, structured_securities)
     loan_pool_waterfall = []  # this will be to save the info
     structured_securities_waterfall = []
     reserve_account = []
@@ -32,7 +33,9 @@ def doWaterfall(loanpool, structured_securities):
         # check if there's any recovery value because of the defaulted loans
         recovery_val = loanpool.checkDefaults(T)
         # now make the payment, also add the recovery value to the cash amount (part c)
-        structured_securities.makePayments(cash_amount + recovery_val, loanpool.principalDue(T))
+        # the pool balance is only worked out for a waterfall spec with an OC test
+        collateral = loanpool.balance(T) if structured_securities.spec.needsCollateral else None
+        structured_securities.makePayments(cash_amount + recovery_val, loanpool.principalDue(T), collateral)
         # append the result to the structure securities waterfall by calling getWaterfall on the class
         structured_securities_waterfall.append(structured_securities.getWaterfall())
         # append the result to the loan pool waterfall by calling getWaterfall on the class
@@ -42,23 +45,46 @@ def doWaterfall(loanpool, structured_securities):
         structured_securities.increaseTimePeriod()  # this will increase for all the tranches
         T += 1  # increase time period for the loan pool
 
-    # initialize three lists of list with the length of number of tranches
-    principal_payment = [[] for i in range(len(structured_securities.trancheList))]
-    monthly_payment = [[] for i in range(len(structured_securities.trancheList))]
-    metrics = [[] for i in range(len(structured_securities.trancheList))]
-    # now use for loop to flatten the structured_securities_waterfall (different periods are different lists)
-    for period in structured_securities_waterfall:
-        for index, tranche_waterfall in enumerate(period):  # the index indicates the index of each tranche
-            # sum the principal payment of each tranche separately
-            principal_payment[index].append(tranche_waterfall[4])
-            # sum the monthly payment = principal payment + interest payment of each tranche separately
-            monthly_payment[index].append(tranche_waterfall[2] + tranche_waterfall[4])
-    # enumerate the tranche, to make sure store the correct metrics for each tranche
-    for index, tranche in enumerate(structured_securities.trancheList):
-        metrics[index].append(tranche.IRR(monthly_payment[index]))
-        metrics[index].append(tranche.DIRR(monthly_payment[index]))
-        metrics[index].append(tranche.AL(principal_payment[index]))  # remember only AL uses principal payment
-        metrics[index].append(Tranche.DIRR_Rating(tranche.DIRR(monthly_payment[index])))
-
+    metrics = trancheMetrics(structured_securities)
     # after the loop is done, return all the results, as well as any amount left in reserve account
     return loan_pool_waterfall, structured_securities_waterfall, reserve_account, metrics
+
+
+# doWaterfall of a pool with hazard curves: the pool cash flows of the current path, prepayments included, come
+# from the arrays of the PoolSchedule of the pool in one go instead of asking every loan every period
+def _scheduleWaterfall(loanpool, structured_securities):
+    schedule = loanpool.schedule()
+    default_times, prepay_times = loanpool.pathEvents()
+    prepay_times = prepay_times[None] if prepay_times is not None else None
+    cash, principal, last_period = schedule.poolCashFlows(default_times[None], prepay_times=prepay_times)
+    last_period = int(last_period[0])
+    collateral = schedule.poolBalance(default_times[None], prepay_times)[0].tolist() \
+        if structured_securities.spec.needsCollateral else None
+    structured_securities_waterfall, reserve_account, metrics = doTrancheWaterfall(
+        cash[0].tolist(), principal[0].tolist(), last_period, structured_securities, collateral)
+    loan_pool_waterfall = schedule.loanWaterfall(default_times, prepay_times[0] if prepay_times is not None
+                                                 else None)[:last_period + 1].tolist()
+    return loan_pool_waterfall, structured_securities_waterfall, reserve_account, metrics
+
+
+# The tranche half of doWaterfall, for when the pool cash flows are already known (e.g. one path of a simulation
+# shared by several deal structures). cash_amount and principal_due are indexed by period, entry 0 is ignored,
+# and payments are made for periods 1..last_period; collateral (the pool balance by period) is only needed by a
+# waterfall spec with an OC test
+def doTrancheWaterfall(cash_amount, principal_due, last_period, structured_securities, collateral=None):
+    structured_securities_waterfall = [structured_securities.getWaterfall()]
+    reserve_account = [0]
+    structured_securities.increaseTimePeriod()
+    for T in range(1, last_period + 1):
+        structured_securities.makePayments(cash_amount[T], principal_due[T],
+                                           collateral[T] if collateral is not None else None)
+        structured_securities_waterfall.append(structured_securities.getWaterfall())
+        reserve_account.append(structured_securities.reserveAccount)
+        structured_securities.increaseTimePeriod()
+    metrics = trancheMetrics(structured_securities)
+    return structured_securities_waterfall, reserve_account, metrics
+
+
+# IRR, DIRR, AL and rating of each tranche, from the payment ledger every tranche keeps while it is paid
+def trancheMetrics(structured_securities):
+    return [tranche.ledgerMetrics() for tranche in structured_securities.trancheList]
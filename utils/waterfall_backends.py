@@ -0,0 +1,353 @@
+"""
+Interchangeable implementations of the period-loop kernels of a simulation: the pool cash flows of a batch of default
+paths, the tranche allocation (the compiled waterfall spec of the deal, see liabilities.waterfall_spec, with
+shortfalls carried over and the left over cash going to the reserve account) and the IRR of the tranche payments.
+
+    python  the reference: PoolSchedule.poolCashFlows, then doTrancheWaterfall with the StructuredSecurities
+            objects and numpy_financial's irr on every path, exactly what PoolPaths.pathDIRR_AL does
+    numpy   the tranche allocation runs on all paths at once, one period at a time, and the IRR is solved with a
+            vectorized Newton iteration
+    numba   the same loops compiled with numba.njit, only available when numba can be imported
+
+getBackend() picks numba when it is importable and numpy otherwise. Every backend gives the [DIRR, AL] of each
+tranche on each path (pathDIRR_AL) and must match the python one, see backends_parity_test.py
+"""
+from utils.waterfall import doTrancheWaterfall
+from liabilities.waterfall_spec import runProgram, OP, TRANCHE, PARAM, SLOT, GUARD, GUARD_VALUE, FROM, KIND, \
+    INTEREST, CASH_FLAG, PRINCIPAL, TURBO, RESERVE, TEST, OC
+import numpy_financial as npf
+import numpy as np
+import math
+import logging
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+class WaterfallBackend(object):
+    name = None
+
+    # cash available, principal due (paths x periods) and last period of each path, see PoolSchedule.poolCashFlows
+    def poolCashFlows(self, schedule, default_times, prepay_times=None):
+        raise NotImplementedError()
+
+    # interest paid, principal paid and notional balance of every tranche in every period: paths x tranches x
+    # periods each, period 0 included (no payments, balance = face) and nothing after the last period of a path.
+    # The payments follow the compiled waterfall spec of the structured securities; collateral (the pool balance,
+    # paths x periods) is only needed by a spec with an OC test
+    def trancheWaterfall(self, cash, principal, last_period, structured_securities, collateral=None):
+        raise NotImplementedError()
+
+    # the monthly IRR of every row of flows (the first column is the investment)
+    def IRR(self, flows):
+        raise NotImplementedError()
+
+    # [DIRR, AL] of each tranche on each path, paths x tranches x 2 like PoolPaths.pathDIRR_AL
+    def pathDIRR_AL(self, cash, principal, last_period, structured_securities, collateral=None):
+        tranches = structured_securities.trancheList
+        faces = np.array([tranche.face for tranche in tranches], dtype=float)
+        rates = np.array([tranche.rate for tranche in tranches], dtype=float)
+        interest_paid, principal_paid, _ = self.trancheWaterfall(cash, principal, last_period, structured_securities,
+                                                                 collateral)
+        paths, count, periods = principal_paid.shape
+        flows = np.empty((paths, count, periods + 1))
+        flows[:, :, 0] = -faces
+        flows[:, :, 1:] = interest_paid + principal_paid
+        IRR = self.IRR(flows.reshape(-1, periods + 1)).reshape(paths, count) * 12
+        path_metrics = np.empty((paths, count, 2))
+        path_metrics[:, :, 0] = rates - IRR
+        path_metrics[:, :, 1] = (principal_paid * np.arange(periods)).sum(axis=2) / faces
+        return path_metrics
+
+
+# the reference: the StructuredSecurities objects along every path, like doWaterfall
+class PythonBackend(WaterfallBackend):
+    name = 'python'
+
+    def poolCashFlows(self, schedule, default_times, prepay_times=None):
+        return schedule.poolCashFlows(default_times, prepay_times=prepay_times)
+
+    def trancheWaterfall(self, cash, principal, last_period, structured_securities, collateral=None):
+        shape = (len(last_period), len(structured_securities.trancheList), cash.shape[1])
+        interest_paid, principal_paid, balance = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+        for index in range(len(last_period)):
+            structured_securities.reset()
+            waterfall = np.array(doTrancheWaterfall(cash[index].tolist(), principal[index].tolist(),
+                                                    int(last_period[index]), structured_securities,
+                                                    _row(collateral, index))[0])
+            # periods x tranches x [balance, interest due, interest paid, interest shortfall, principal paid]
+            interest_paid[index, :, :len(waterfall)] = waterfall[:, :, 2].T
+            principal_paid[index, :, :len(waterfall)] = waterfall[:, :, 4].T
+            balance[index, :, :len(waterfall)] = waterfall[:, :, 0].T
+        return interest_paid, principal_paid, balance
+
+    def IRR(self, flows):
+        return np.array([npf.irr(row) for row in flows])
+
+    def pathDIRR_AL(self, cash, principal, last_period, structured_securities, collateral=None):
+        path_metrics = np.zeros((len(last_period), len(structured_securities.trancheList), 2))
+        for index in range(len(last_period)):
+            structured_securities.reset()
+            metrics = doTrancheWaterfall(cash[index].tolist(), principal[index].tolist(), int(last_period[index]),
+                                         structured_securities, _row(collateral, index))[2]
+            for i, tranche_metric in enumerate(metrics):
+                path_metrics[index, i] = [tranche_metric[1], tranche_metric[2] if tranche_metric[2] != math.inf else 0]
+        return path_metrics
+
+
+class NumpyBackend(WaterfallBackend):
+    name = 'numpy'
+
+    def poolCashFlows(self, schedule, default_times, prepay_times=None):
+        return schedule.poolCashFlows(default_times, prepay_times=prepay_times)
+
+    # all paths advance one period at a time through the compiled spec (waterfall_spec.runProgram); a path that is
+    # past its last period keeps its state
+    def trancheWaterfall(self, cash, principal, last_period, structured_securities, collateral=None):
+        faces, rates, program = _trancheArrays(structured_securities, collateral)
+        paths, count, periods = len(last_period), len(faces), cash.shape[1]
+        interest_paid, principal_paid = np.zeros((paths, count, periods)), np.zeros((paths, count, periods))
+        balance = np.zeros((paths, count, periods))
+        notional = np.tile(faces, (paths, 1))
+        interest_shortfall, principal_shortfall = np.zeros((paths, count)), np.zeros((paths, count))
+        reserve = np.zeros(paths)
+        balance[:, :, 0] = notional
+        for T in range(1, int(last_period.max(initial=0)) + 1):
+            active = T <= last_period
+            interest_due = notional * (rates / 12) + interest_shortfall
+            paid_interest, paid_principal, new_shortfall, _ = runProgram(
+                program, T, active, cash[:, T], principal[:, T], collateral[:, T] if collateral is not None else None,
+                notional, interest_due, principal_shortfall, reserve)
+            interest_paid[:, :, T] = paid_interest
+            principal_paid[:, :, T] = paid_principal
+            interest_shortfall = np.where(active[:, None], new_shortfall, interest_shortfall)
+            balance[:, :, T] = np.where(active[:, None], notional, 0)
+        return interest_paid, principal_paid, balance
+
+    def IRR(self, flows):
+        return _newtonIRR(flows)
+
+
+class NumbaBackend(WaterfallBackend):
+    name = 'numba'
+
+    def __init__(self):
+        if numba is None:
+            logging.error('The numba backend needs numba installed')
+            raise ImportError('The numba backend needs numba installed')
+        self._poolCashFlows = numba.njit(cache=True)(_poolCashFlowsLoop)
+        self._trancheWaterfall = numba.njit(cache=True)(_trancheWaterfallLoop)
+        self._IRR = numba.njit(cache=True)(_IRRLoop)
+
+    def poolCashFlows(self, schedule, default_times, prepay_times=None):
+        default_times = np.atleast_2d(default_times)
+        prepay_times = prepay_times if prepay_times is not None else np.full(default_times.shape, schedule.periods)
+        return self._poolCashFlows(schedule.payment, schedule.principal, schedule.recovery, schedule.balance,
+                                   schedule.lastActive, default_times.astype(np.int64),
+                                   np.atleast_2d(prepay_times).astype(np.int64))
+
+    def trancheWaterfall(self, cash, principal, last_period, structured_securities, collateral=None):
+        faces, rates, program = _trancheArrays(structured_securities, collateral)
+        collateral = collateral if collateral is not None else np.zeros(np.shape(cash))
+        return self._trancheWaterfall(np.ascontiguousarray(cash, dtype=float),
+                                      np.ascontiguousarray(principal, dtype=float),
+                                      np.asarray(last_period, dtype=np.int64), faces, rates, program,
+                                      np.ascontiguousarray(collateral, dtype=float))
+
+    def IRR(self, flows):
+        return self._IRR(np.ascontiguousarray(flows, dtype=float))
+
+
+backends = {'python': PythonBackend, 'numpy': NumpyBackend, 'numba': NumbaBackend}
+_instances = {}
+
+
+# the backend of that name, or the fastest one available: numba if it can be imported, numpy otherwise
+def getBackend(name=None):
+    name = name if name is not None else ('numba' if numba is not None else 'numpy')
+    if name not in backends:
+        logging.error('Unknown backend {}, choose one of {}'.format(name, sorted(backends)))
+        raise ValueError('Unknown backend {}'.format(name))
+    if name not in _instances:
+        _instances[name] = backends[name]()
+    return _instances[name]
+
+
+# face and rate of every tranche in order of subordination and the compiled waterfall spec
+def _trancheArrays(structured_securities, collateral=None):
+    if structured_securities.spec.needsCollateral and collateral is None:
+        logging.error('The OC test of the waterfall spec needs the collateral balance')
+        raise ValueError('The OC test of the waterfall spec needs the collateral balance')
+    tranches = structured_securities.trancheList
+    return (np.array([tranche.face for tranche in tranches], dtype=float),
+            np.array([tranche.rate for tranche in tranches], dtype=float),
+            structured_securities.programArray)
+
+
+# the collateral of one path as a list, or None
+def _row(collateral, index):
+    return collateral[index].tolist() if collateral is not None else None
+
+
+# Monthly IRR of every row of flows: the root x = 1 / (1 + irr) of sum_t flows[t] x^t. The flows are an investment
+# followed by payments of 0 or more, so the polynomial is increasing and convex for x > 0 and Newton's method from a
+# point right of the root converges to it; rows without payments have no IRR (nan), like numpy_financial's irr
+def _newtonIRR(flows, iterations=100):
+    flows = np.atleast_2d(flows)
+    x = np.ones(len(flows))
+    value, _ = _polynomial(flows, x)
+    # a negative IRR has its root above 1: double x until the value is positive
+    for _ in range(64):
+        low = value <= 0
+        if not low.any():
+            break
+        x = np.where(low, 2 * x, x)
+        value, _ = _polynomial(flows, x)
+    for _ in range(iterations):
+        value, slope = _polynomial(flows, x)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step = np.where(slope > 0, value / slope, 0)
+        x = x - step
+        if (np.abs(step) <= 1e-15 * np.abs(x)).all():
+            break
+    return np.where((flows[:, 1:] > 0).any(axis=1), 1 / x - 1, np.nan)
+
+
+# value and derivative of sum_t flows[t] x^t for every row (Horner's method)
+def _polynomial(flows, x):
+    value, slope = np.zeros(len(flows)), np.zeros(len(flows))
+    for t in range(flows.shape[1] - 1, -1, -1):
+        slope = slope * x + value
+        value = value * x + flows[:, t]
+    return value, slope
+
+
+# ---- the loops of the numba backend, plain python so that they can also be checked without numba ----
+
+def _poolCashFlowsLoop(payment, principal_due, recovery, balance, last_active, default_times, prepay_times):
+    paths, loans = default_times.shape
+    periods = payment.shape[1]
+    cash = np.zeros((paths, periods))
+    principal = np.zeros((paths, periods))
+    last_period = np.ones(paths, dtype=np.int64)
+    for p in range(paths):
+        for loan in range(loans):
+            default = default_times[p, loan]
+            prepay = prepay_times[p, loan]
+            for T in range(min(default, prepay, periods - 1) + 1):
+                cash[p, T] += payment[loan, T]
+                if T < default:
+                    principal[p, T] += principal_due[loan, T]
+            if default < periods:
+                cash[p, default] += recovery[loan, default]
+            if prepay < periods:
+                cash[p, prepay] += balance[loan, prepay]
+                principal[p, prepay] += balance[loan, prepay]
+            last_period[p] = max(last_period[p], min(last_active[loan], default, prepay))
+    return cash, principal, last_period
+
+
+def _trancheWaterfallLoop(cash, principal, last_period, faces, rates, program, collateral):
+    paths, periods = cash.shape
+    count = len(faces)
+    interest_paid = np.zeros((paths, count, periods))
+    principal_paid = np.zeros((paths, count, periods))
+    balance = np.zeros((paths, count, periods))
+    slots = 0
+    for row in range(program.shape[0]):
+        slots = max(slots, int(program[row, SLOT]) + 1)
+    flags = np.zeros(max(slots, 1), dtype=np.bool_)
+    for p in range(paths):
+        notional = faces.copy()
+        interest_due = np.zeros(count)
+        interest_shortfall = np.zeros(count)
+        principal_shortfall = np.zeros(count)
+        reserve = 0.0
+        for k in range(count):
+            balance[p, k, 0] = notional[k]
+        for T in range(1, last_period[p] + 1):
+            for k in range(count):
+                interest_due[k] = notional[k] * (rates[k] / 12) + interest_shortfall[k]
+                interest_shortfall[k] = 0.0
+            cash_left = cash[p, T] + reserve
+            available = cash_left
+            for row in range(program.shape[0]):
+                op = int(program[row, OP])
+                k = int(program[row, TRANCHE])
+                param = program[row, PARAM]
+                guard = int(program[row, GUARD])
+                if T < program[row, FROM] or (guard >= 0 and flags[guard] != (program[row, GUARD_VALUE] == 1)):
+                    continue
+                if op == TEST:
+                    covered = 0.0
+                    for j in range(k + 1):
+                        covered += notional[j] if program[row, KIND] == OC else interest_due[j]
+                    numerator = collateral[p, T] if program[row, KIND] == OC else available
+                    ratio = numerator / covered if covered > 0 else np.inf
+                    flags[int(program[row, SLOT])] = ratio < param
+                elif op == INTEREST:
+                    if interest_due[k] != 0 and interest_paid[p, k, T] == 0:
+                        paid = min(interest_due[k], cash_left)
+                        interest_shortfall[k] = interest_due[k] - paid
+                        cash_left = cash_left - paid
+                        interest_paid[p, k, T] = paid
+                elif op == CASH_FLAG:
+                    flags[int(program[row, SLOT])] = cash_left != 0
+                elif op == PRINCIPAL:
+                    if flags[int(program[row, SLOT])] and notional[k] != 0 and principal_paid[p, k, T] == 0:
+                        principal_due = min(notional[k], principal[p, T] * param + principal_shortfall[k])
+                        paid = min(principal_due, cash_left)
+                        notional[k] -= paid
+                        principal_shortfall[k] = principal_due - paid
+                        cash_left = cash_left - paid
+                        principal_paid[p, k, T] = paid
+                elif op == TURBO:
+                    if notional[k] != 0:
+                        paid = min(notional[k], cash_left)
+                        notional[k] -= paid
+                        principal_shortfall[k] = min(principal_shortfall[k], notional[k])
+                        cash_left = cash_left - paid
+                        principal_paid[p, k, T] += paid
+                elif op == RESERVE:
+                    cash_left = min(cash_left, param)
+            reserve = cash_left
+            for k in range(count):
+                balance[p, k, T] = notional[k]
+    return interest_paid, principal_paid, balance
+
+
+def _IRRLoop(flows):
+    rows, length = flows.shape
+    res = np.empty(rows)
+    for r in range(rows):
+        paying = False
+        for t in range(1, length):
+            if flows[r, t] > 0:
+                paying = True
+        if not paying:
+            res[r] = np.nan
+            continue
+        x = 1.0
+        for _ in range(64):
+            value = 0.0
+            for t in range(length - 1, -1, -1):
+                value = value * x + flows[r, t]
+            if value > 0:
+                break
+            x = 2 * x
+        for _ in range(100):
+            value = 0.0
+            slope = 0.0
+            for t in range(length - 1, -1, -1):
+                slope = slope * x + value
+                value = value * x + flows[r, t]
+            if slope <= 0:
+                break
+            step = value / slope
+            x = x - step
+            if abs(step) <= 1e-15 * abs(x):
+                break
+        res[r] = 1 / x - 1
+    return res
@@ -0,0 +1,66 @@
+from loan.loan_pool import LoanPool
+from loan.pool_schedule import PoolSchedule
+from liabilities.structured_securities import StructuredSecurities
+from simulations.variance_reduction import simulateWaterfallVR
+from simulations.pool_paths import simulatePoolPaths
+import numpy as np
+import logging
+import os
+
+# remember to set the level to WARNING level
+logging.getLogger().setLevel(logging.WARNING)
+
+'''
+In this program, I check the variance reduction options of simulateWaterfallVR: without any option it gives the
+same paths and average as simulatePoolPaths with the same seed, every option (antithetic pairs, the two control
+variates and Sobol points) agrees with a large plain run within a few of its standard errors, and a number of paths
+that does not fill antithetic pairs or Sobol replicates is rounded up and reported rather than dropped
+'''
+
+NSIM = 400  # paths of every run
+REFERENCE_NSIM = 8000  # paths of the plain reference run
+SEED = 2033  # master seed of the paths
+LOANS = 300  # loans of the csv used
+ERRORS = 4  # how many standard errors a run may be from the reference
+
+
+def main():
+    pool1 = LoanPool(list(LoanPool.readLoansFromCSV(os.path.join('Loan Test', 'Loans.csv')))[:LOANS])
+    structured_securities = StructuredSecurities(pool1.totalPrincipal())
+    structured_securities.addTranche(0.8, 0.05, 0)
+    structured_securities.addTranche(0.2, 0.08, 1)
+    schedule = PoolSchedule(pool1)
+    failures = []
+
+    plain = simulateWaterfallVR(pool1, structured_securities, NSIM, seed=SEED, schedule=schedule)
+    reference = simulatePoolPaths(pool1, NSIM, schedule, seed=SEED).averageDIRR_AL(structured_securities)
+    diff = np.abs(np.array(plain['DIRR_AL']) - reference).max()
+    print(f'plain against simulatePoolPaths: {diff:.3e}')
+    failures += ['plain'] if diff > 1e-9 else []
+
+    reference = np.array(simulatePoolPaths(pool1, REFERENCE_NSIM, schedule, seed=SEED + 1).averageDIRR_AL(
+        structured_securities))
+    print(f'{"option":<28s}{"paths":<8s}{"largest error (SE)":<20s}{"variance reduction"}')
+    for name, options, NSIM_run in [('antithetic', {'antithetic': True}, NSIM + 1),
+                                    ('control defaults', {'control': 'defaults'}, NSIM),
+                                    ('control loss', {'control': 'loss'}, NSIM),
+                                    ('antithetic + control loss', {'antithetic': True, 'control': 'loss'}, NSIM),
+                                    ('sobol', {'sobol': True}, NSIM)]:
+        run = simulateWaterfallVR(pool1, structured_securities, NSIM_run, seed=SEED, schedule=schedule, **options)
+        # the error of the run against the reference, in standard errors of both
+        errors = np.abs(np.array(run['DIRR_AL']) - reference) / np.sqrt(
+            np.array(run['standardError']) ** 2 + (np.array(plain['standardError']) ** 2) * NSIM / REFERENCE_NSIM)
+        print(f'{name:<28s}{run["paths"]:<8d}{errors.max():<20.2f}{np.round(run["varianceReduction"], 2).tolist()}')
+        failures += [name] if errors.max() > ERRORS else []
+        # an odd NSIM becomes whole pairs, Sobol replicates get a power of two paths each
+        expected_paths = {'antithetic': NSIM + 2, 'sobol': 8 * 64}.get(name, NSIM)
+        failures += [name + ' paths'] if run['paths'] != expected_paths else []
+
+    if failures:
+        print('FAILED: ' + ', '.join(failures))
+        raise SystemExit(1)
+    print('Every variance reduction option agrees with plain Monte Carlo')
+
+
+if __name__ == '__main__':
+    main()